@@ -1,13 +1,20 @@
+from utils import startup  # 起動時間の計測のため最初に読み込む
 from flask import Flask, render_template, request, redirect, url_for, send_file, Response
 from blueprints.alb import alb_bp
 from blueprints.classroom import classroom_bp
-from blueprints.callback import callback_bp
+from blueprints.callback import callback_bp, dispatcher as webhook_dispatcher
 from blueprints.link import link_bp
-from blueprints.admin import admin_bp
+from blueprints.admin import admin_bp, queue_action
+from utils.write_queue import start_flusher, queue_depth
+from utils.notify_queue import start_notifier, notify_queue_depth
+from utils.notify import get_line_stats
+from utils.fanout import start_fanout_worker, fanout_status
+from utils.logging_util import log_stats, log_exception
+from utils import metrics, deadline
 from dotenv import load_dotenv
 import os
 from flask_wtf import CSRFProtect
-import threading, time, random, requests
+import threading, time, random
 from datetime import datetime
 from urllib.parse import urlparse
 
@@ -26,6 +33,10 @@ app.secret_key = os.environ.get("SECRET_KEY", "fallback-secret-key")
 csrf = CSRFProtect()
 csrf.init_app(app)
 csrf.exempt(callback_bp)
+csrf.exempt(queue_action)  # ADMIN_TOKEN で認証する
+metrics.init_app(app)
+startup.init_app(app)
+deadline.init_app(app)
 
 load_dotenv()
 
@@ -36,6 +47,36 @@ app.register_blueprint(callback_bp, url_prefix="/callback")
 app.register_blueprint(link_bp)
 app.register_blueprint(admin_bp)
 
+startup.mark("app_imported")
+
+_background_started = False
+_background_lock = threading.Lock()
+
+def start_background_workers():
+    """
+    バックグラウンドのスレッドを（プロセスにつき 1 回）起動する。
+    import 時に起動すると gunicorn --preload の fork でスレッドが引き継がれないので、
+    fork 後（gunicorn.conf.py の post_worker_init・asgi.py の lifespan）か最初のリクエストで呼ぶ。
+    """
+    global _background_started
+    with _background_lock:
+        if _background_started:
+            return
+        _background_started = True
+    # 書き込みキューのフラッシャー（前回プロセスの未送信分もここで再送される）
+    start_flusher()
+    # LINE 通知の送信スレッド（同上）
+    start_notifier()
+    # 新しい教室の告知（送信途中のジョブもここで再開される）
+    start_fanout_worker()
+    # 認証・シートを開く・キャッシュの作成を最初のリクエストと並行して行う
+    startup.start_prewarm()
+
+@app.before_request
+def _ensure_background_workers():
+    if not _background_started:
+        start_background_workers()
+
 @app.route("/")
 def index():
     return Response("\U0001F4D8 Flask アプリ稼働中：/alb, /classroom, /callback, /link などのルートを確認してください。", content_type="text/plain; charset=utf-8")
@@ -45,6 +86,7 @@ def _default_local_url():
     return f"http://127.0.0.1:{port}/"
 
 def _keep_alive_loop(app):
+    import requests
     enabled = os.environ.get("ENABLE_SELF_PING", "0") == "1"
     if not enabled:
         app.logger.info("Self-ping disabled (ENABLE_SELF_PING != 1).")
@@ -106,7 +148,37 @@ def status():
         "keep_alive_url": status_data["keep_alive_url"],
         "monitor_interval": status_data["monitor_interval"],
         "recent_logs": status_data["recent_logs"],
+        "write_queue": queue_depth(),
+        "notify_queue": notify_queue_depth(),
+        "line": get_line_stats(),
+        "fanout": fanout_status(),
+        "webhook": webhook_dispatcher.status(),
+        "logging": log_stats(),
+        "startup": startup.startup_report(),
     }, 200
 
+@app.route("/metrics")
+def metrics_endpoint():
+    token_env = os.environ.get("METRICS_TOKEN")  # 設定しなければ誰でも見える
+    if token_env:
+        auth = request.headers.get("Authorization", "")
+        token = auth[7:] if auth.startswith("Bearer ") else request.args.get("token")
+        if token != token_env:
+            return Response("Forbidden", status=403)
+    try:
+        # 自分の最新値を書き出してから、全ワーカーの値を合算する
+        metrics.flush()
+        write_queue, notify_queue = queue_depth(), notify_queue_depth()
+        body = metrics.render({
+            "acro_write_queue_pending": ("Sheet writes waiting to be flushed", write_queue["pending"]),
+            "acro_write_queue_dead": ("Sheet writes given up after retries", write_queue["dead"]),
+            "acro_notify_queue_pending": ("LINE pushes waiting to be sent", notify_queue["pending"]),
+            "acro_notify_queue_dead": ("LINE pushes given up after retries", notify_queue["dead"]),
+        })
+    except Exception as e:
+        log_exception(e, context="メトリクス出力")
+        return "Internal Server Error", 500
+    return Response(body, mimetype="text/plain; version=0.0.4")
+
 if __name__ == "__main__":
     app.run(debug=True)
@@ -0,0 +1,138 @@
+# asgi.py
+"""
+ASGI モード。既存の WSGI アプリ（app.py）はそのままで、次のどちらかで起動する。
+
+    uvicorn asgi:app --host 0.0.0.0 --port $PORT
+    gunicorn asgi:app -k uvicorn.workers.UvicornWorker
+
+Sheets / LINE の応答を待つことが多いルートはイベントループ上の非同期ハンドラーで受け、
+ブロックする呼び出しだけを上限つきのスレッドで待つ（待っている間はスレッドもワーカーも塞がない）。
+それ以外のルートは Flask アプリへそのまま渡す。処理本体は WSGI 版と同じ関数を使う。
+"""
+import json
+import os
+import time
+from contextlib import asynccontextmanager
+from typing import Optional
+
+from a2wsgi import WSGIMiddleware
+from flask_wtf.csrf import CSRFError
+from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.responses import HTMLResponse, JSONResponse, Response
+from starlette.routing import Mount, Route
+
+from app import app as flask_app, csrf, start_background_workers
+from blueprints.alb import submit_result
+from blueprints.callback import accept_events
+from blueprints.classroom import interest_result
+from blueprints.link import link_result
+from utils import metrics
+from utils.aio import run_io
+from utils.deadline import REQUEST_DEADLINE, deadline
+from utils.logging_util import log_exception
+from utils.storage import get_storage
+
+ASGI_WSGI_THREADS = int(os.getenv("ASGI_WSGI_THREADS", 16))  # Flask に渡すルートを処理するスレッド数
+
+def _csrf_error(request: Request, body: bytes) -> Optional[str]:
+    """Flask 側と同じ CSRF 検証（セッション Cookie とトークン）。通れば None、だめなら理由を返す。"""
+    if not flask_app.config.get("WTF_CSRF_ENABLED", True):
+        return None
+    base_url = f"{request.url.scheme}://{request.url.netloc}"
+    with flask_app.test_request_context(
+        request.url.path, base_url=base_url, method=request.method,
+        headers=list(request.headers.items()), data=body,
+    ):
+        try:
+            csrf.protect()
+        except CSRFError as e:
+            return e.description
+    return None
+
+def _native(endpoint: str):
+    """締め切り・メトリクス・例外処理を WSGI 版と揃える。endpoint は Flask 側のエンドポイント名。"""
+    def decorator(handler):
+        async def wrapper(request: Request) -> Response:
+            started = time.perf_counter()
+            status = 500
+            try:
+                with deadline(REQUEST_DEADLINE):
+                    response = await handler(request)
+                status = response.status_code
+                return response
+            except Exception as e:
+                log_exception(e, context=f"ASGI {endpoint}")
+                return HTMLResponse("Internal Server Error", status_code=500)
+            finally:
+                metrics.HTTP_LATENCY.observe(time.perf_counter() - started, method=request.method, endpoint=endpoint)
+                metrics.HTTP_REQUESTS.inc(method=request.method, endpoint=endpoint, status=status)
+        return wrapper
+    return decorator
+
+def _json_or_none(body: bytes):
+    try:
+        return json.loads(body)
+    except ValueError:
+        return None
+
+@_native("alb.check_registration")
+async def check_registration(request: Request) -> Response:
+    user_id = request.query_params.get("user_id", "")
+    registered = await run_io(lambda: get_storage().is_registered(user_id))
+    return JSONResponse({"registered": registered})
+
+@_native("alb.submit")
+async def submit(request: Request) -> Response:
+    body = await request.body()
+    error = _csrf_error(request, body)
+    if error:
+        return HTMLResponse(f"Bad Request: {error}", status_code=400)
+    form = await request.form()
+    text, status = await run_io(submit_result, form)
+    return HTMLResponse(text, status_code=status)
+
+@_native("classroom.handle_interest")
+async def interest(request: Request) -> Response:
+    body = await request.body()
+    error = _csrf_error(request, body)
+    if error:
+        return HTMLResponse(f"Bad Request: {error}", status_code=400)
+    result, status = await run_io(interest_result, _json_or_none(body))
+    if isinstance(result, dict):
+        return JSONResponse(result, status_code=status)
+    return HTMLResponse(result, status_code=status)
+
+@_native("link.link_liff_unified")
+async def link_liff(request: Request) -> Response:
+    body = await request.body()
+    error = _csrf_error(request, body)
+    if error:
+        return HTMLResponse(f"Bad Request: {error}", status_code=400)
+    result, status = await run_io(link_result, _json_or_none(body) or {})
+    return JSONResponse(result, status_code=status)
+
+@_native("callback.receive_callback")
+async def receive_callback(request: Request) -> Response:
+    data = _json_or_none(await request.body())
+    if not isinstance(data, dict):
+        return HTMLResponse("Error", status_code=500)
+    # 重複確認で SQLite に書く（fsync・他ワーカーのロック待ちがある）ので、ループ上では呼ばずスレッドで待つ
+    text, status = await run_io(accept_events, data)
+    return HTMLResponse(text, status_code=status)
+
+@asynccontextmanager
+async def lifespan(app):
+    # ワーカープロセスの起動後にバックグラウンドのスレッドを起動する
+    start_background_workers()
+    yield
+
+app = Starlette(lifespan=lifespan, routes=[
+    Route("/alb/check", check_registration, methods=["GET"]),
+    Route("/alb/submit", submit, methods=["POST"]),
+    Route("/classroom/interest", interest, methods=["POST"]),
+    Route("/link/liff", link_liff, methods=["POST"]),
+    Route("/callback", receive_callback, methods=["POST"]),
+    # それ以外（フォーム・一覧・管理画面など）は Flask アプリで処理する
+    Mount("/", app=WSGIMiddleware(flask_app, workers=ASGI_WSGI_THREADS)),
+])
@@ -0,0 +1,162 @@
+# bench/fake_gspread.py
+import random
+import threading
+import time
+from collections import Counter
+from typing import Dict, List, Optional
+
+import gspread
+from gspread.utils import a1_to_rowcol
+
+# ベンチマーク用の gspread の代わり（メモリ上のシート）。
+# アプリが使うメソッドだけを実装し、呼び出しごとに指定の遅延を入れて回数を数える。
+
+class FakeClient:
+    """
+    gspread.Client の代わり。latency は 1 呼び出しあたりの秒数、jitter はその揺らぎ（割合）。
+    calls にメソッド名ごとの呼び出し回数が入る。
+    """
+
+    def __init__(self, latency: float = 0.0, jitter: float = 0.2):
+        self.latency = latency
+        self.jitter = jitter
+        self.calls = Counter()
+        self._lock = threading.Lock()
+        self._spreadsheets: Dict[str, "FakeSpreadsheet"] = {}
+
+    def _call(self, method: str):
+        with self._lock:
+            self.calls[method] += 1
+        if self.latency > 0:
+            time.sleep(self.latency * (1 + random.uniform(-self.jitter, self.jitter)))
+
+    def reset_calls(self) -> Counter:
+        """これまでの呼び出し回数を返して 0 に戻す。"""
+        with self._lock:
+            calls, self.calls = self.calls, Counter()
+        return calls
+
+    def spreadsheet(self, key: str) -> "FakeSpreadsheet":
+        with self._lock:
+            return self._spreadsheets.setdefault(key, FakeSpreadsheet(self, key))
+
+    def open_by_key(self, key: str) -> "FakeSpreadsheet":
+        self._call("open_by_key")
+        return self.spreadsheet(key)
+
+class FakeSpreadsheet:
+    def __init__(self, client: FakeClient, key: str):
+        self.client = client
+        self.id = key
+        self._worksheets: Dict[str, "FakeWorksheet"] = {}
+
+    def add_worksheet(self, title: str, rows: Optional[List[list]] = None) -> "FakeWorksheet":
+        worksheet = FakeWorksheet(self.client, title, rows or [])
+        self._worksheets[title] = worksheet
+        return worksheet
+
+    def worksheet(self, title: str) -> "FakeWorksheet":
+        self.client._call("worksheet")
+        if title not in self._worksheets:
+            raise gspread.exceptions.WorksheetNotFound(title)
+        return self._worksheets[title]
+
+class FakeWorksheet:
+    """行はセル文字列のリストのリストで持つ（1 行目がヘッダー）。"""
+
+    def __init__(self, client: FakeClient, title: str, rows: List[list]):
+        self.client = client
+        self.title = title
+        self.id = abs(hash(title)) % 10 ** 9
+        self.rows = [[str(v) for v in row] for row in rows]
+        self._lock = threading.Lock()
+
+    @property
+    def row_count(self) -> int:
+        # グリッドの行数（API 呼び出しではなくハンドルのプロパティ）
+        return len(self.rows)
+
+    def _range(self, first: int, last: int) -> dict:
+        return {"updates": {"updatedRange": f"'{self.title}'!A{first}:Z{last}"}}
+
+    def _set_cell(self, row: int, col: int, value):
+        while len(self.rows) < row:
+            self.rows.append([])
+        cells = self.rows[row - 1]
+        while len(cells) < col:
+            cells.append("")
+        cells[col - 1] = str(value)
+
+    # ---- 読み取り ----
+
+    def get_all_values(self, **kwargs) -> List[list]:
+        self.client._call("get_all_values")
+        with self._lock:
+            return [list(row) for row in self.rows]
+
+    def get_all_records(self, **kwargs) -> List[dict]:
+        self.client._call("get_all_records")
+        with self._lock:
+            if not self.rows:
+                return []
+            headers = self.rows[0]
+            return [{h: (row[i] if i < len(row) else "") for i, h in enumerate(headers)} for row in self.rows[1:]]
+
+    def row_values(self, row: int, **kwargs) -> list:
+        self.client._call("row_values")
+        with self._lock:
+            return list(self.rows[row - 1]) if row <= len(self.rows) else []
+
+    def col_values(self, col: int, **kwargs) -> list:
+        self.client._call("col_values")
+        with self._lock:
+            return [row[col - 1] if len(row) >= col else "" for row in self.rows]
+
+    def get(self, range_name: str, **kwargs) -> List[list]:
+        self.client._call("get")
+        # "A2:H100" / "2:100"（行全体）/ "A:H"（列全体）の行番号だけを見る
+        first, _, last = range_name.split("!")[-1].partition(":")
+        first_digits = "".join(c for c in first if c.isdigit())
+        last_digits = "".join(c for c in (last or first) if c.isdigit())
+        with self._lock:
+            first_row = int(first_digits) if first_digits else 1
+            last_row = int(last_digits) if last_digits else len(self.rows)
+            page = [list(row) for row in self.rows[first_row - 1:last_row]]
+        while page and not any(page[-1]):
+            page.pop()  # API と同じく末尾の空行は返さない
+        return page
+
+    # ---- 書き込み ----
+
+    def append_row(self, values: list, **kwargs) -> dict:
+        self.client._call("append_row")
+        with self._lock:
+            self.rows.append([str(v) for v in values])
+            return self._range(len(self.rows), len(self.rows))
+
+    def append_rows(self, values: List[list], **kwargs) -> dict:
+        self.client._call("append_rows")
+        with self._lock:
+            first = len(self.rows) + 1
+            self.rows.extend([str(v) for v in row] for row in values)
+            return self._range(first, len(self.rows))
+
+    def update_cell(self, row: int, col: int, value) -> dict:
+        self.client._call("update_cell")
+        with self._lock:
+            self._set_cell(row, col, value)
+        return {}
+
+    def batch_update(self, data: List[dict], **kwargs) -> dict:
+        self.client._call("batch_update")
+        with self._lock:
+            for item in data:
+                row, col = a1_to_rowcol(item["range"].split("!")[-1].split(":")[0])
+                for i, values in enumerate(item["values"]):
+                    for j, value in enumerate(values):
+                        self._set_cell(row + i, col + j, value)
+        return {}
+
+    def format(self, ranges, cell_format: dict, **kwargs) -> dict:
+        self.client._call("format")
+        return {}
@@ -0,0 +1,219 @@
+# bench/run_bench.py
+"""
+ルート単位のベンチマーク。Google Sheets の代わりに bench/fake_gspread.py を使う。
+
+    python -m bench.run_bench                      # 100〜100000 行で全ルート
+    python -m bench.run_bench --rows 1000 --requests 500 --concurrency 8 --latency 0.15
+    python -m bench.run_bench --json results.json  # 結果を JSON でも保存（デプロイ前の比較用）
+
+行数ごとに子プロセスを起こすので、メモリ上のキャッシュや SQLite は毎回まっさらな状態から始まる。
+"""
+import argparse
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+ROUTES = ["alb_submit", "alb_check", "classroom_recruit", "classroom_interest", "link_liff"]
+
+EXPERIENCES = ["ハンドスタンド", "側転", "バク転", "倒立", "トランポリン"]
+HANDSLEVELS = ["初級", "中級", "上級"]
+AREAS = ["東京", "神奈川", "埼玉", "千葉", "大阪", "名古屋"]
+
+def _pick(rng: random.Random, values: list, k: int = 2) -> str:
+    return ", ".join(rng.sample(values, rng.randint(1, k)))
+
+def build_sheets(client, rows: int, seed: int = 0):
+    """講師登録・教室・ユーザーの各シートを rows 行ずつ作る。"""
+    from utils.storage import CLASSROOM_HEADERS, REGISTRATION_HEADERS, USER_FIELDS
+    from utils.storage import CLASSROOM_SHEET_NAME, REGISTRATION_SHEET_NAME, USER_SHEET_NAME
+
+    rng = random.Random(seed)
+    spreadsheet = client.spreadsheet(os.environ["SPREADSHEET_ID"])
+    users, registrations, classrooms = [list(USER_FIELDS)], [list(REGISTRATION_HEADERS)], [list(CLASSROOM_HEADERS)]
+    for i in range(rows):
+        app_id, bday4 = f"Uapp{i:06d}", f"{rng.randint(1, 12):02d}{rng.randint(1, 28):02d}"
+        users.append([f"user{i}", f"2000{bday4}", f"Uchat{i:06d}", app_id, "2025-01-01 00:00:00"])
+        registrations.append([
+            f"user{i}", bday4, _pick(rng, EXPERIENCES, 3), _pick(rng, HANDSLEVELS), _pick(rng, AREAS),
+            "土日", "夜", app_id,
+        ])
+        classrooms.append([
+            f"教室{i}", rng.choice(AREAS), f"2026-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}",
+            _pick(rng, EXPERIENCES, 3), _pick(rng, HANDSLEVELS), "詳細", f"Uapp{rng.randrange(rows):06d}",
+        ])
+    spreadsheet.add_worksheet(USER_SHEET_NAME, users)
+    spreadsheet.add_worksheet(REGISTRATION_SHEET_NAME, registrations)
+    spreadsheet.add_worksheet(CLASSROOM_SHEET_NAME, classrooms)
+    return [row for row in classrooms[1:]]
+
+class _NullLineClient:
+    """LINE には送らず、成功したことにする。"""
+
+    stats = {"sends": 0, "success": 0, "retries": 0, "failures": 0}
+    _stats_lock = threading.Lock()
+
+    def push(self, to, messages):
+        from utils.notify import LineResult
+        return LineResult(True, 200, None, False)
+
+    def multicast(self, to, messages, retry_key=None):
+        return self.push(to, messages)
+
+def _requests_for(route: str, rows: int, classroom_ids: list):
+    """(method, path, kwargs) を返す関数。i は通し番号。"""
+    def make(i: int, rng: random.Random):
+        existing = f"Uapp{rng.randrange(rows):06d}"
+        if route == "alb_submit":
+            return "POST", "/alb/submit", {"data": {
+                "user_id": f"Ubench{i:06d}", "name": f"bench{i}", "birthday4": "0302",
+                "experience[]": rng.sample(EXPERIENCES, 2), "handslevel[]": [rng.choice(HANDSLEVELS)],
+                "area": rng.choice(AREAS), "available": "土日", "reachtime": "夜",
+            }}
+        if route == "alb_check":
+            user_id = existing if rng.random() < 0.8 else f"Unew{i:06d}"
+            return "GET", f"/alb/check?user_id={user_id}", {}
+        if route == "classroom_recruit":
+            query = f"page={rng.randint(1, 5)}"
+            if rng.random() < 0.5:
+                query += f"&location={rng.choice(AREAS)}"
+            return "GET", f"/classroom/recruit?{query}", {}
+        if route == "classroom_interest":
+            return "POST", "/classroom/interest", {"json": {"classroom_id": rng.choice(classroom_ids)}}
+        if route == "link_liff":
+            user_id = existing if rng.random() < 0.8 else f"Ulink{i:06d}"
+            return "POST", "/link/liff", {"json": {"userId": user_id}}
+        raise ValueError(route)
+    return make
+
+def _percentile(sorted_values: list, p: float) -> float:
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, int(round(p / 100 * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[index]
+
+def run_child(args) -> dict:
+    """1 つの行数について全ルートを計測する（子プロセス内）。"""
+    sys.path.insert(0, ROOT)
+    os.chdir(ROOT)
+    from bench.fake_gspread import FakeClient
+    import utils.sheets as sheets
+    import utils.notify as notify
+    from utils.classroom_index import assign_classroom_ids
+
+    client = FakeClient(latency=args.latency)
+    classroom_rows = build_sheets(client, args.rows)
+    sheets.gc = client
+    notify._client = _NullLineClient()
+
+    from app import app
+    app.config["WTF_CSRF_ENABLED"] = False
+    classroom_ids = assign_classroom_ids(classroom_rows)
+
+    local = threading.local()
+    results = {}
+    for route in args.routes:
+        make = _requests_for(route, args.rows, classroom_ids)
+        rng_lock = threading.Lock()
+        rng = random.Random(1)
+
+        def one(i: int):
+            test_client = getattr(local, "client", None)
+            if test_client is None:
+                test_client = local.client = app.test_client()
+            with rng_lock:
+                method, path, kwargs = make(i, rng)
+            started = time.perf_counter()
+            response = test_client.open(path, method=method, **kwargs)
+            elapsed = time.perf_counter() - started
+            return elapsed, response.status_code
+
+        # 1 回目（キャッシュが空の状態）は別に記録する
+        client.reset_calls()
+        first, first_status = one(0)
+        first_calls = client.reset_calls()
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+            samples = list(pool.map(one, range(1, args.requests + 1)))
+        wall = time.perf_counter() - started
+        calls = client.reset_calls()
+
+        latencies = sorted(s[0] for s in samples)
+        errors = sum(1 for s in samples if s[1] >= 400) + (first_status >= 400)
+        results[route] = {
+            "requests": len(samples),
+            "errors": errors,
+            "first_ms": first * 1000,
+            "p50_ms": _percentile(latencies, 50) * 1000,
+            "p95_ms": _percentile(latencies, 95) * 1000,
+            "p99_ms": _percentile(latencies, 99) * 1000,
+            "rps": len(samples) / wall if wall > 0 else 0.0,
+            "first_api_calls": dict(first_calls),
+            "api_calls": dict(calls),
+        }
+    return results
+
+def _print_table(all_results: dict):
+    header = (f"{'rows':>7} {'route':<20} {'n':>5} {'err':>4} {'first ms':>9} {'p50 ms':>8} {'p95 ms':>8} "
+              f"{'p99 ms':>8} {'rps':>8}  api calls (first / rest)")
+    print(header)
+    print("-" * len(header))
+    for rows, results in all_results.items():
+        for route, r in results.items():
+            first_calls = sum(r["first_api_calls"].values())
+            calls = ", ".join(f"{k}={v}" for k, v in sorted(r["api_calls"].items())) or "-"
+            print(f"{rows:>7} {route:<20} {r['requests']:>5} {r['errors']:>4} {r['first_ms']:>9.1f} "
+                  f"{r['p50_ms']:>8.1f} {r['p95_ms']:>8.1f} {r['p99_ms']:>8.1f} {r['rps']:>8.1f}  "
+                  f"{first_calls} / {calls}")
+
+def main():
+    parser = argparse.ArgumentParser(description="acro-match route benchmark (fake Google Sheets)")
+    parser.add_argument("--rows", default="100,1000,10000,100000", help="カンマ区切りの行数")
+    parser.add_argument("--routes", default=",".join(ROUTES), help="計測するルート")
+    parser.add_argument("--requests", type=int, default=200, help="ルートごとのリクエスト数")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--latency", type=float, default=0.1, help="Sheets API 1 回あたりの遅延（秒）")
+    parser.add_argument("--real-quota", action="store_true", help="Sheets のクォータ制限を本番と同じにする")
+    parser.add_argument("--json", help="結果を書き出す JSON ファイル")
+    parser.add_argument("--verbose", action="store_true", help="アプリのログを表示する")
+    parser.add_argument("--child-out", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    args.routes = [r for r in args.routes.split(",") if r]
+
+    if args.child_out:
+        args.rows = int(args.rows)
+        with open(args.child_out, "w", encoding="utf-8") as f:
+            json.dump(run_child(args), f)
+        return
+
+    all_results = {}
+    for rows in [int(r) for r in args.rows.split(",") if r]:
+        with tempfile.TemporaryDirectory(prefix="acro-bench-") as tmp:
+            out = os.path.join(tmp, "result.json")
+            env = dict(os.environ, LOCAL_DB_PATH=os.path.join(tmp, "bench.db"), SPREADSHEET_ID="bench")
+            if not args.real_quota:
+                env.update(SHEETS_READ_PER_MINUTE="1000000", SHEETS_WRITE_PER_MINUTE="1000000",
+                           SHEETS_QUOTA_BURST="1000000")
+            command = [sys.executable, "-m", "bench.run_bench", "--child-out", out, "--rows", str(rows),
+                       "--routes", ",".join(args.routes), "--requests", str(args.requests),
+                       "--concurrency", str(args.concurrency), "--latency", str(args.latency)]
+            output = None if args.verbose else subprocess.DEVNULL
+            subprocess.run(command, cwd=ROOT, env=env, check=True, stdout=output, stderr=output)
+            with open(out, encoding="utf-8") as f:
+                all_results[rows] = json.load(f)
+
+    _print_table(all_results)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"args": {k: v for k, v in vars(args).items() if k != "child_out"}, "results": all_results},
+                      f, ensure_ascii=False, indent=2)
+
+if __name__ == "__main__":
+    main()
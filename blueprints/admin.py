@@ -1,20 +1,32 @@
 # blueprints/admin.py
-from flask import Blueprint, request, render_template, redirect
+import csv
+import io
 import json
-import os
+from urllib.parse import quote
+from flask import Blueprint, Response, request, render_template, redirect, stream_with_context
+from utils.settings import load_settings, save_settings
+from utils.storage import get_storage, USER_SHEET_NAME, REGISTRATION_SHEET_NAME, CLASSROOM_SHEET_NAME
+from utils.auth import token_authorized
+from utils.deadline import no_deadline
+from utils import notify_queue, write_queue
+from utils.logging_util import log_exception, log_info
 
 admin_bp = Blueprint("admin", __name__, url_prefix="/admin")
 
-SETTINGS_PATH = "settings.json"
+# 書き出せるシート（URL 上の名前 → シート名）
+EXPORT_SHEETS = {
+    "users": USER_SHEET_NAME,
+    "registrations": REGISTRATION_SHEET_NAME,
+    "classrooms": CLASSROOM_SHEET_NAME,
+}
+EXPORT_FLUSH_ROWS = 200  # この行数ごとにまとめてクライアントへ送る
 
-def load_settings():
-    try:
-        if os.path.exists(SETTINGS_PATH):
-            with open(SETTINGS_PATH, "r", encoding="utf-8") as f:
-                return json.load(f)
-    except Exception as e:
-        print("⚠️ 設定読み込み失敗:", e)
-    return {}
+# 管理画面から扱う送信キュー（URL 上の名前 → (件数, 諦めた行, 再送に戻す, 消す)）
+QUEUES = {
+    "write-queue": (write_queue.queue_depth, write_queue.dead_rows, write_queue.requeue_dead, write_queue.purge_dead),
+    "notify-queue": (notify_queue.notify_queue_depth, notify_queue.dead_rows,
+                     notify_queue.requeue_dead, notify_queue.purge_dead),
+}
 
 @admin_bp.route("/", methods=["GET", "POST"])
 def admin():
@@ -44,9 +56,107 @@ def admin():
             if request.form.get(f"custom_classroom_label_{i}") and request.form.get(f"custom_classroom_name_{i}")
         ]
 
-        with open(SETTINGS_PATH, "w", encoding="utf-8") as f:
-            json.dump(settings, f, ensure_ascii=False, indent=2)
+        save_settings(settings)
 
         return redirect("/admin")
 
     return render_template("admin.html", settings=load_settings())
+
+def _csv_line(row: list) -> str:
+    buffer = io.StringIO()
+    csv.writer(buffer, lineterminator="\r\n").writerow(row)
+    return buffer.getvalue()
+
+def _export_lines(sheet_name: str, fmt: str):
+    """保存先（STORAGE_BACKEND）からページ単位で読みながら 1 行ずつ CSV / JSONL にして返す。"""
+    if fmt == "csv":
+        yield "\ufeff"  # Excel で文字化けしないよう BOM を付ける（最初の 1 バイトをすぐ返す意味もある）
+    headers = None
+    chunk = []
+    count = 0
+    with no_deadline():
+        try:
+            for row in get_storage().iter_rows(sheet_name):
+                if headers is None:
+                    headers = row
+                    if fmt == "csv":
+                        chunk.append(_csv_line(row))
+                    continue
+                row = row + [""] * (len(headers) - len(row))
+                if fmt == "csv":
+                    chunk.append(_csv_line(row))
+                else:
+                    record = {h: row[i] for i, h in enumerate(headers)}
+                    chunk.append(json.dumps(record, ensure_ascii=False) + "\n")
+                count += 1
+                if len(chunk) >= EXPORT_FLUSH_ROWS:
+                    yield "".join(chunk)
+                    chunk = []
+        except Exception as e:
+            # ヘッダー送信後なのでステータスは変えられない。途中で打ち切ったことをログに残す
+            log_exception(e, context=f"書き出し中断: {sheet_name}", payload={"rows": count})
+            raise
+        if chunk:
+            yield "".join(chunk)
+    log_info("%s を %d 行書き出しました", sheet_name, count, context="書き出し")
+
+@admin_bp.route("/export/<dataset>.<fmt>", methods=["GET"])
+def export(dataset, fmt):
+    """ユーザー情報・講師登録・教室を CSV / JSONL で書き出す（メモリに全件を載せない）。"""
+    try:
+        if not token_authorized("EXPORT_TOKEN"):
+            return Response("Forbidden", status=403)
+        sheet_name = EXPORT_SHEETS.get(dataset)
+        if sheet_name is None or fmt not in ("csv", "jsonl"):
+            return "Not Found", 404
+
+        mimetype = "text/csv" if fmt == "csv" else "application/x-ndjson"
+        filename = f"{sheet_name}.{fmt}"
+        return Response(
+            stream_with_context(_export_lines(sheet_name, fmt)),
+            mimetype=mimetype,
+            headers={
+                "Content-Disposition": f"attachment; filename={dataset}.{fmt}; filename*=UTF-8''{quote(filename)}",
+                "Cache-Control": "no-store",
+                "X-Accel-Buffering": "no",
+            },
+        )
+    except Exception as e:
+        log_exception(e, context="書き出し")
+        return "Internal Server Error", 500
+
+@admin_bp.route("/<any('write-queue', 'notify-queue'):queue>", methods=["GET"])
+def queue_status(queue):
+    """書き込みキュー・通知キューの件数と、再試行を諦めた行を返す（ADMIN_TOKEN が必要）。"""
+    try:
+        if not token_authorized("ADMIN_TOKEN"):
+            return Response("Forbidden", status=403)
+        depth, dead_rows, _, _ = QUEUES[queue]
+        limit = min(max(request.args.get("limit", 100, type=int), 1), 1000)
+        return {"depth": depth(), "dead": dead_rows(limit)}
+    except Exception as e:
+        log_exception(e, context=f"キュー確認: {queue}")
+        return "Internal Server Error", 500
+
+@admin_bp.route("/<any('write-queue', 'notify-queue'):queue>/<action>", methods=["POST"])
+def queue_action(queue, action):
+    """
+    諦めた行を再送に戻す（requeue）か消す（purge）。本文の {"ids": [...]} で対象を絞れる（省略すると全件）。
+    トークンで認証するので CSRF の対象外（app.py）。
+    """
+    try:
+        if not token_authorized("ADMIN_TOKEN"):
+            return Response("Forbidden", status=403)
+        depth, _, requeue, purge = QUEUES[queue]
+        handler = {"requeue": requeue, "purge": purge}.get(action)
+        if handler is None:
+            return "Not Found", 404
+        ids = (request.get_json(silent=True) or {}).get("ids")
+        if ids is not None and not (isinstance(ids, list) and all(isinstance(i, int) for i in ids)):
+            return {"error": "ids must be a list of integers"}, 400
+        count = handler(ids)
+        log_info("%s %s: %d 件", queue, action, count, context="管理")
+        return {"action": action, "count": count, "depth": depth()}
+    except Exception as e:
+        log_exception(e, context=f"キュー操作: {queue}")
+        return "Internal Server Error", 500
@@ -1,58 +1,85 @@
 # blueprints/alb.py
 from flask import Blueprint, request, render_template, redirect
-from utils.sheets import get_sheet
-from utils.settings import load_settings
+from utils.storage import get_storage
+from utils.matching import get_matching_engine
+from utils.settings import load_settings, settings_version
+from utils.page_cache import get_page, put_page, page_response, CSRF_PLACEHOLDER, FORM_PAGE_MAX_AGE
 from utils.liff import get_liff_id
 from utils.user import register_user_info
 from utils.logging_util import log_exception
 from flask_wtf.csrf import generate_csrf
+from typing import Tuple
 
 alb_bp = Blueprint("alb", __name__, url_prefix="/alb")
 
 @alb_bp.route("/register", methods=["GET"])
 def show_register_form():
     try:
-        return render_template(
-            "form_alb.html",
-            settings=load_settings(),
-            liff_id=get_liff_id("alb"),
-            error_msg=request.args.get("error"),
-            csrf_token=generate_csrf()
-        )
+        error_msg = request.args.get("error")
+        if error_msg:
+            # エラー表示つきのページはキャッシュしない
+            return render_template(
+                "form_alb.html",
+                settings=load_settings(),
+                liff_id=get_liff_id("alb"),
+                error_msg=error_msg,
+                csrf_token=generate_csrf()
+            )
+
+        # 出力は設定と LIFF ID だけで決まるので、設定の版ごとに描画済みページを使い回す
+        liff_id = get_liff_id("alb")
+        cache_key = ("form_alb", settings_version(), liff_id)
+        page = get_page(cache_key)
+        if page is None:
+            page = put_page(cache_key, render_template(
+                "form_alb.html",
+                settings=load_settings(),
+                liff_id=liff_id,
+                error_msg=None,
+                csrf_token=CSRF_PLACEHOLDER
+            ))
+        return page_response(page, max_age=FORM_PAGE_MAX_AGE)
     except Exception as e:
         log_exception(e, context="アルバイト登録フォーム表示")
         return "Internal Server Error", 500
 
-@alb_bp.route("/submit", methods=["POST"])
-def submit():
-    try:
-        settings = load_settings()
-        sheet = get_sheet("アルバイト登録シート")
+def submit_result(form) -> Tuple[str, int]:
+    """
+    講師登録の処理本体。form は werkzeug の MultiDict か Starlette の FormData（get / getlist を使う）。
+    WSGI のルートと ASGI 版（asgi.py）の両方から呼ぶので、Flask の request には触れない。
+    """
+    settings = load_settings()
+
+    user_id = form.get("user_id", "").strip()
+    if not user_id:
+        # /link/liff が通っていない
+        log_exception(ValueError("user_id missing"), context="アルバイト登録送信")
+        return "Bad Request: not linked (user_id missing)", 400
 
-        user_id = request.form.get("user_id", "").strip()
-        if not user_id:
-            # /link/liff が通っていない
-            log_exception(ValueError("user_id missing"), context="アルバイト登録送信")
-            return "Bad Request: not linked (user_id missing)", 400
+    name = form.get("name", "")
+    birthday4 = form.get("birthday4", "")
+    experience_str = ", ".join(form.getlist("experience[]"))
+    handslevel_str = ", ".join(form.getlist("handslevel[]"))
+    area = form.get("area", "")
+    available = form.get("available", "")
+    reachtime = form.get("reachtime", "")
 
-        name = request.form.get("name", "")
-        birthday4 = request.form.get("birthday4", "")
-        experience_str = ", ".join(request.form.getlist("experience[]"))
-        handslevel_str = ", ".join(request.form.getlist("handslevel[]"))
-        area = request.form.get("area", "")
-        available = request.form.get("available", "")
-        reachtime = request.form.get("reachtime", "")
+    # 設定名のキーは your settings.json に合わせる
+    custom_values = [form.get(field.get("name", ""), "") for field in settings.get("custom_fields", [])]
 
-        # 設定名のキーは your settings.json に合わせる
-        custom_values = [request.form.get(field.get("name", ""), "") for field in settings.get("custom_fields", [])]
+    # 例：誕生日の正規化は任意
+    birthday_full = f"20000302" if birthday4 == "0302" else f"2000{birthday4}" if len(birthday4) == 4 else ""
+    # ユーザー情報も講師登録も書き込みキューに積むだけで、Sheets は待たない
+    register_user_info(name, birthday_full, app_liff_id=user_id)
 
-        # 例：誕生日の正規化は任意
-        birthday_full = f"20000302" if birthday4 == "0302" else f"2000{birthday4}" if len(birthday4) == 4 else ""
-        register_user_info(name, birthday_full, app_liff_id=user_id)
+    row = [name, birthday4, experience_str, handslevel_str, area, available, reachtime] + custom_values + [user_id]
+    get_storage().add_registration(row)
+    return "登録が完了しました！", 200
 
-        row = [name, birthday4, experience_str, handslevel_str, area, available, reachtime] + custom_values + [user_id]
-        res = sheet.append_row(row, value_input_option="USER_ENTERED")
-        return "登録が完了しました！"
+@alb_bp.route("/submit", methods=["POST"])
+def submit():
+    try:
+        return submit_result(request.form)
     except Exception as e:
         log_exception(e, context="アルバイト登録送信")
         return "Internal Server Error", 500
@@ -61,9 +88,34 @@ def submit():
 def check_registration():
     try:
         user_id = request.args.get("user_id", "")
-        sheet = get_sheet("アルバイト登録シート")
-        registered_ids = [row[-1] for row in sheet.get_all_values()[1:]]
-        return {"registered": user_id in registered_ids}
+        return {"registered": get_storage().is_registered(user_id)}
     except Exception as e:
         log_exception(e, context="登録確認")
         return {"error": "Internal error"}, 500
+
+@alb_bp.route("/<user_id>/recommendations", methods=["GET"])
+def recommendations(user_id):
+    """講師に合う教室の上位 k 件を返す。"""
+    try:
+        k = min(max(request.args.get("k", 10, type=int), 1), 50)
+        engine = get_matching_engine()
+        ranked = engine.recommendations_for_instructor(user_id, k=k)
+        if ranked is None:
+            return {"error": "not registered"}, 404
+        return {
+            "user_id": user_id,
+            "recommendations": [
+                {
+                    "classroom_id": classroom_id,
+                    "classroom_name": row[0],
+                    "location": row[1],
+                    "date": row[2],
+                    "score": round(score, 4),
+                }
+                for classroom_id, score in ranked
+                for row in [engine.classroom(classroom_id)]
+            ],
+        }
+    except Exception as e:
+        log_exception(e, context="おすすめ教室取得")
+        return {"error": "Internal error"}, 500
@@ -1,22 +1,39 @@
 # blueprints/classroom.py
 from flask import Blueprint, request, render_template, jsonify, redirect, url_for
-from utils.settings import load_settings
+import json
+from typing import Tuple, Union
+from utils.settings import load_settings, settings_version
 from utils.liff import get_liff_id
-from utils.notify import send_line_message
-from flask_wtf.csrf import generate_csrf
-from utils.sheets import get_sheet, get_chat_liff_id_by_app_liff_id, highlight_classroom_row
+from utils.notify_queue import enqueue_line_message
+from utils.fanout import schedule_classroom_fanout
+from utils.storage import get_storage, USER_FIELDS, CLASSROOM_SHEET_NAME
+from utils.data_version import current_version
+from utils.page_cache import get_page, put_page, page_response, CSRF_PLACEHOLDER, FORM_PAGE_MAX_AGE
+from utils.classroom_index import get_classroom_index, normalize, parse_date
+from utils.matching import get_matching_engine
+from utils.auth import token_authorized
 from utils.logging_util import log_info, log_error, log_exception
 
 classroom_bp = Blueprint("classroom", __name__, url_prefix="/classroom")
 
 @classroom_bp.route("/form")
 def show_form():
-    return render_template(
-        "form_classroom.html",
-        settings=load_settings(),
-        liff_id=get_liff_id("classroom"),
-        csrf_token=generate_csrf()  # ← これを追加
-    )
+    try:
+        # 出力は設定と LIFF ID だけで決まるので、設定の版ごとに描画済みページを使い回す
+        liff_id = get_liff_id("classroom")
+        cache_key = ("form_classroom", settings_version(), liff_id)
+        page = get_page(cache_key)
+        if page is None:
+            page = put_page(cache_key, render_template(
+                "form_classroom.html",
+                settings=load_settings(),
+                liff_id=liff_id,
+                csrf_token=CSRF_PLACEHOLDER
+            ))
+        return page_response(page, max_age=FORM_PAGE_MAX_AGE)
+    except Exception as e:
+        log_exception(e, context="教室登録フォーム表示")
+        return "Internal Server Error", 500
 @classroom_bp.route("/submit", methods=["POST"])
 def submit():
     try:
@@ -31,11 +48,10 @@ def submit():
 
         # user_id, classroom_nameの必須チェック
         if not user_id or not classroom_name:
-            log_error("必須フィールドが不足しています")
+            log_error("必須フィールドが不足しています", context="教室登録")
             return "Bad Request: Missing required fields", 400
 
-        # スプレッドシートにデータを追加
-        sheet = get_sheet("教室登録シート")
+        # ストレージにデータを追加
         row = [
             classroom_name,
             location,
@@ -45,8 +61,11 @@ def submit():
             details,
             user_id
         ]
-        sheet.append_row(row)
-        log_info(f"教室登録が完了しました: {row}")
+        get_storage().add_classroom(row)
+        log_info("教室登録が完了しました", context="教室登録", payload=row)
+
+        # 相性の良い講師への告知はバックグラウンドで行う
+        schedule_classroom_fanout(row)
 
         return "教室登録が完了しました！募集一覧に掲載されているかご確認ください。"
 
@@ -54,36 +73,77 @@ def submit():
         log_exception(e, context="教室登録送信")
         return "Internal Server Error", 500
 
+RECRUIT_PER_PAGE = 20
+RECRUIT_MAX_PER_PAGE = 50
+
+def _recruit_filters() -> dict:
+    """クエリパラメータから絞り込み条件を取り出す（キャッシュキーにも使うので正規化しておく）。"""
+    args = request.args
+    try:
+        page = max(int(args.get("page", 1)), 1)
+    except ValueError:
+        page = 1
+    try:
+        per_page = min(max(int(args.get("per_page", RECRUIT_PER_PAGE)), 1), RECRUIT_MAX_PER_PAGE)
+    except ValueError:
+        per_page = RECRUIT_PER_PAGE
+    return {
+        "location": normalize(args.get("location")),
+        "date_from": parse_date(args.get("date_from")) or "",
+        "date_to": parse_date(args.get("date_to")) or "",
+        "experience": sorted({normalize(v) for v in args.getlist("experience") if normalize(v)}),
+        "handslevel": sorted({normalize(v) for v in args.getlist("handslevel") if normalize(v)}),
+        "page": page,
+        "per_page": per_page,
+    }
+
 @classroom_bp.route("/recruit", methods=["GET"])
 def view_recruitment():
     try:
         # 設定データと LIFF ID を取得
         settings = load_settings()
         liff_id = get_liff_id("recruit")
+        filters = _recruit_filters()
 
-        # スプレッドシートからデータを取得
-        sheet = get_sheet("教室登録シート")
-        headers = sheet.row_values(1)  # ヘッダー行を取得
-        rows = sheet.get_all_values()[1:]  # データ行を取得（ヘッダーを除く）
+        # 教室データの更新番号・設定の版・LIFF ID・絞り込み条件が同じならレンダリング済みページを返す
+        cache_key = (
+            "recruit",
+            current_version(CLASSROOM_SHEET_NAME),
+            settings_version(),
+            liff_id,
+            json.dumps(filters, sort_keys=True, ensure_ascii=False),
+        )
+        page = get_page(cache_key)
+        if page is not None:
+            return page_response(page)
 
-        if not headers or not rows:
-            log_error("スプレッドシートのデータが空です")
+        # 転置インデックスで絞り込み、表示するページ分だけを取り出す
+        index = get_classroom_index()
+        if not index.rows:
+            log_error("スプレッドシートのデータが空です", context="教室募集一覧")
             return "No data available", 404
 
-        # ヘッダーからLIFF ID列を削除
-        headers = headers[:-1]  # 最後の列（LIFF ID）を削除
+        row_ids, total = index.query(
+            location=filters["location"],
+            date_from=filters["date_from"],
+            date_to=filters["date_to"],
+            experience=filters["experience"],
+            handslevel=filters["handslevel"],
+            page=filters["page"],
+            per_page=filters["per_page"],
+        )
 
         # 各行から「業務詳細・その他自由記述」を分離し、ポップアップ用に保持
-        processed_rows = []
-        for row in rows:
+        # 教室 ID は /classroom/interest で使う（行の挿入・削除があっても変わらない）
+        indexed_rows = []
+        for classroom_id in row_ids:
+            row = index.row(classroom_id)
             popup_data = row[-2]  # 業務詳細・その他自由記述（最後から2番目の列）
             row_data = row[:-2]  # 表に表示するデータ（業務詳細・その他自由記述とLIFF IDを除外）
-            processed_rows.append((popup_data, row_data))
-
-        # 各行にインデックスを付与
-        indexed_rows = [(i + 1, popup_data, row_data) for i, (popup_data, row_data) in enumerate(processed_rows)]
-        log_info(f"教室募集一覧を取得しました: {indexed_rows}")
+            indexed_rows.append((classroom_id, popup_data, row_data))
+        log_info("教室募集一覧を取得しました: %d / %d 件", len(indexed_rows), total, context="教室募集一覧")
 
+        filter_args = {k: v for k, v in filters.items() if k not in ("page",) and v}
         context = {
             # 表示順: 教室名, 場所, 開催日, 希望する経験, 補助レベル
             "headers": [
@@ -96,79 +156,114 @@ def view_recruitment():
             "rows": indexed_rows,
             "settings": settings,
             "liff_id": liff_id,
+            "filters": filters,
+            "filter_args": filter_args,
+            "total": total,
+            "page": filters["page"],
+            "total_pages": max((total + filters["per_page"] - 1) // filters["per_page"], 1),
+            # CSRF トークンはレスポンスごとに差し込む
+            "csrf_token": lambda: CSRF_PLACEHOLDER,
         }
 
-        return render_template("view_classrooms.html", **context)
+        page = put_page(cache_key, render_template("view_classrooms.html", **context))
+        return page_response(page)
 
     except Exception as e:
         log_exception(e, context="教室募集一覧表示")
         return "Internal Server Error", 500
     
-@classroom_bp.route("/interest", methods=["POST"])
-def handle_interest():
+@classroom_bp.route("/<classroom_id>/candidates", methods=["GET"])
+def classroom_candidates(classroom_id):
+    """教室に合う講師の上位 k 件を返す（LIFF ID は返さない）。講師の個人情報を含むので ADMIN_TOKEN が必要。"""
     try:
-        # JSON データを取得
-        data = request.get_json(force=True)
-        if data is None:
-            log_error("JSON データが解析できませんでした")
-            return "Bad Request: Invalid JSON", 400
-
-        log_info(f"サーバーが受信したデータ: {data}")
+        if not token_authorized("ADMIN_TOKEN"):
+            return "Forbidden", 403
+        k = min(max(request.args.get("k", 10, type=int), 1), 50)
+        engine = get_matching_engine()
+        ranked = engine.candidates_for_classroom(classroom_id, k=k)
+        if ranked is None:
+            return jsonify({"error": "classroom not found"}), 404
 
-        # row_index の検証
-        row_index_raw = data.get("row_index")
-        try:
-            row_index = int(row_index_raw)
-        except ValueError:
-            log_error(f"'row_index' の形式が不正です: {row_index_raw}")
-            return "Bad Request: Invalid 'row_index'", 400
-
-        # スプレッドシートから該当する行を取得
-        sheet = get_sheet("教室登録シート")
-        rows = sheet.get_all_values()[1:]  # ヘッダーを除いたデータ行を取得
+        candidates = []
+        for user_id, score in ranked:
+            row = engine.instructor(user_id)
+            candidates.append({
+                "name": row[0],
+                "experience": row[2],
+                "handslevel": row[3],
+                "area": row[4],
+                "available": row[5],
+                "score": round(score, 4),
+            })
+        return jsonify({"classroom_id": classroom_id, "candidates": candidates}), 200
+    except Exception as e:
+        log_exception(e, context="講師候補取得")
+        return "Internal Server Error", 500
 
-        if row_index < 1 | row_index > len(rows):
-            log_error(f"row_index が範囲外です: {row_index}")
-            return "Bad Request: 'row_index' out of range", 400
+def interest_result(data) -> Tuple[Union[dict, str], int]:
+    """
+    「興味あり」の処理本体。(応答本文, ステータス) を返す。
+    WSGI のルートと ASGI 版（asgi.py）の両方から呼ぶので、Flask の request には触れない。
+    """
+    if data is None:
+        log_error("JSON データが解析できませんでした", context="興味あり")
+        return "Bad Request: Invalid JSON", 400
 
-        selected_row = rows[row_index - 1]  # row_index は 1ベースなので -1 する
-        classroom_name = selected_row[0]  # 教室名は行の最初の列にあると仮定
-        app_liff_id = selected_row[-1]  # アプリ LIFF ID は行の最後の列にあると仮定
+    log_info("興味ありを受信しました", context="興味あり", payload=data)
 
-        log_info(f"選択された教室名: {classroom_name}")
-        log_info(f"選択されたアプリ LIFF ID: {app_liff_id}")
+    # 教室 ID からメモリ上のインデックスで教室を引く（シートは読み直さない）
+    index = get_classroom_index()
+    classroom_id = str(data.get("classroom_id") or "")
+    if not classroom_id and data.get("row_index") is not None:
+        # 教室 ID 導入前に表示されたページからの送信（絞り込み前の通し番号）
+        try:
+            row_index = int(data.get("row_index"))
+        except (TypeError, ValueError):
+            log_error("'row_index' の形式が不正です: %s", data.get("row_index"), context="興味あり")
+            return "Bad Request: Invalid 'row_index'", 400
+        if 1 <= row_index <= len(index.ids):
+            classroom_id = index.ids[row_index - 1]
+    if not classroom_id:
+        log_error("'classroom_id' がありません", context="興味あり")
+        return "Bad Request: Missing 'classroom_id'", 400
 
-        # ユーザー情報シートから該当する行を探す
-        user_sheet = get_sheet("ユーザー情報")
-        user_rows = user_sheet.get_all_values()[1:]  # ヘッダーを除いたデータ行を取得
+    selected_row = index.row(classroom_id)
+    if selected_row is None:
+        log_error("教室が見つかりません: %s", classroom_id, context="興味あり")
+        return "Not Found: classroom not found", 404
 
-        log_info(f"ユーザー情報シートのデータ: {user_rows}")
+    classroom_name = selected_row[0]  # 教室名は行の最初の列
+    app_liff_id = selected_row[-1]  # アプリ LIFF ID は行の最後の列
+    log_info("選択された教室: %s (%s)", classroom_name, classroom_id, context="興味あり")
 
-        matching_row = None
-        for user_row in user_rows:
-            log_info(f"チェック中の行: {user_row}")
-            if user_row[3] == app_liff_id:  # アプリ LIFF ID が一致する行を探す
-                matching_row = user_row
-                break
+    # アプリ LIFF ID が一致するユーザーをインデックスで引く
+    user_record = get_storage().find_user_by_app_liff_id(app_liff_id)
 
-        if matching_row:
-            log_info(f"対応するユーザー情報行: {matching_row}")
-            chat_liff_id = matching_row[2]  # 該当行のチャット LIFF ID を取得
+    if user_record:
+        matching_row = [user_record.get(f, "") for f in USER_FIELDS]
+        chat_liff_id = user_record.get("チャット LIFF ID")  # 該当行のチャット LIFF ID を取得
 
-            # 通知メッセージを送信
+        # 通知は送信キューに積み、LINE API の応答を待たずに返す
+        if chat_liff_id:
             message = f"教室名: {classroom_name} に興味があると通知されました！"
-            try:
-                send_line_message(chat_liff_id, message)  # LINE Notify API を使用してメッセージを送信
-                log_info(f"通知メッセージを送信しました: {message}")
-            except Exception as notify_error:
-                log_exception(notify_error, context="通知メッセージ送信")
-                return "Internal Server Error: Failed to send notification", 500
-
-            return jsonify({"classroom_name": classroom_name, "matching_row": matching_row}), 200
+            enqueue_line_message(chat_liff_id, message)
+            log_info("通知メッセージを送信キューに追加しました: %s", message, context="興味あり")
         else:
-            log_error(f"アプリ LIFF ID '{app_liff_id}' に対応する行が見つかりません。ユーザー情報シートを確認してください。")
-            return "Bad Request: No matching row found", 400
+            log_error("教室 %s の登録者にチャット LIFF ID がありません", classroom_id, context="興味あり")
+
+        return {"classroom_id": classroom_id, "classroom_name": classroom_name, "matching_row": matching_row}, 200
+    else:
+        log_error("アプリ LIFF ID '%s' に対応する行が見つかりません。ユーザー情報シートを確認してください。", app_liff_id, context="興味あり")
+        return "Bad Request: No matching row found", 400
+
+@classroom_bp.route("/interest", methods=["POST"])
+def handle_interest():
+    try:
+        # JSON データを取得
+        data = request.get_json(force=True)
+        body, status = interest_result(data)
+        return (jsonify(body) if isinstance(body, dict) else body), status
 
     except Exception as e:
         log_exception(e, context="興味ありリクエスト処理")
-        return "Internal Server Error", 500
\ No newline at end of file
+        return "Internal Server Error", 500
@@ -0,0 +1,7 @@
+# gunicorn.conf.py
+# gunicorn はカレントディレクトリのこのファイルを自動で読み込む。
+
+def post_worker_init(worker):
+    # アプリを読み込んだ後、ワーカーごとにバックグラウンドのスレッドを起動する（--preload でも fork 後に動く）
+    from app import start_background_workers
+    start_background_workers()
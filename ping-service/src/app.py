@@ -21,6 +21,7 @@ logger = logging.getLogger("app")
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), ".")))
 
 from services.monitor_service import MonitorService
+from services.probe_service import ProbeTarget, load_targets
 
 app = Flask(__name__)
 monitor_service = MonitorService()
@@ -111,6 +112,23 @@ def _boot_self_ping():
     t.start()
     app.logger.info("[self-ping] background thread started.")
 
+@app.before_first_request
+def _boot_probes():
+    # PROBE_TARGETS の全対象を 1 つのイベントループで監視する（ENABLE_PROBES=1 のときだけ）
+    if os.environ.get("ENABLE_PROBES", "0") != "1":
+        app.logger.info("Probes disabled (ENABLE_PROBES != 1).")
+        return
+    # 設定の誤りで落ちると before_first_request が毎回やり直され、全リクエストが 500 になるので、ログだけ残す
+    try:
+        targets = load_targets()
+        if not targets:
+            target_url = os.environ.get("TARGET_URL", "https://acro-match-w8t0.onrender.com")
+            interval = int(os.environ.get("MONITOR_INTERVAL", 5))  # in minutes
+            targets = [ProbeTarget(name=target_url, url=target_url, interval=interval * 60)]
+        monitor_service.start_probes(targets)
+    except Exception as e:
+        logger.error(f"Probes not started: {e}")
+
 # /status を本体にも提供（トークン保護任意）
 STATUS_TOKEN = os.environ.get("STATUS_TOKEN")
 
@@ -130,6 +148,7 @@ def get_status():
         "keep_alive_url": status_data["keep_alive_url"],
         "monitor_interval": status_data["monitor_interval"],
         "recent_logs": status_data["recent_logs"],
+        "probes": monitor_service.probe_engine.status() if monitor_service.probe_engine else None,
     }), 200
 
 def start_monitoring():
@@ -0,0 +1,117 @@
+# bench_probes.py
+"""
+ProbeEngine のベンチマーク。ローカルに立てた HTTP サーバー（速い・遅い・応答しない・500 を返す）を
+多数の監視対象として 1 回ずつ確認し、従来の 1 件ずつの確認（requests で順番に）と所要時間を比べる。
+
+    python bench_probes.py --targets 200 --slow-ratio 0.1 --hang-ratio 0.05
+"""
+import argparse
+import asyncio
+import os
+import sys
+import threading
+import time
+
+import requests
+from aiohttp import web
+
+sys.path.append(os.path.abspath(os.path.dirname(__file__)))
+
+from services.probe_service import ProbeEngine, ProbeTarget
+
+def start_server(slow_delay: float, hang_delay: float) -> int:
+    """別スレッドのイベントループでスタンドインのサーバーを動かし、ポート番号を返す。"""
+    async def ok(request):
+        return web.Response(text="ok")
+
+    async def slow(request):
+        await asyncio.sleep(slow_delay)
+        return web.Response(text="slow")
+
+    async def hang(request):
+        await asyncio.sleep(hang_delay)
+        return web.Response(text="late")
+
+    async def error(request):
+        return web.Response(status=500, text="error")
+
+    ready = threading.Event()
+    port = {}
+
+    async def serve():
+        app = web.Application()
+        app.router.add_get("/ok", ok)
+        app.router.add_get("/slow", slow)
+        app.router.add_get("/hang", hang)
+        app.router.add_get("/error", error)
+        runner = web.AppRunner(app, access_log=None)
+        await runner.setup()
+        site = web.TCPSite(runner, "127.0.0.1", 0, backlog=1024)
+        await site.start()
+        port["value"] = site._server.sockets[0].getsockname()[1]
+        ready.set()
+        await asyncio.Event().wait()
+
+    threading.Thread(target=asyncio.run, args=(serve(),), daemon=True).start()
+    ready.wait()
+    return port["value"]
+
+def build_targets(port: int, count: int, slow_ratio: float, hang_ratio: float, error_ratio: float,
+                  timeout: float) -> list:
+    kinds = (["hang"] * int(count * hang_ratio) + ["slow"] * int(count * slow_ratio)
+             + ["error"] * int(count * error_ratio))
+    kinds += ["ok"] * (count - len(kinds))
+    return [ProbeTarget(name=f"{kind}-{i}", url=f"http://127.0.0.1:{port}/{kind}?i={i}", timeout=timeout, retries=1)
+            for i, kind in enumerate(kinds)]
+
+def percentile(values: list, p: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+def run_engine(targets: list, pool_size: int) -> dict:
+    engine = ProbeEngine(targets, pool_size=pool_size)
+    started = time.perf_counter()
+    results = asyncio.run(engine.run_once())
+    elapsed = time.perf_counter() - started
+    fast = [r.latency for r in results if r.target.startswith("ok-")]
+    return {"elapsed": elapsed, "ok": sum(r.ok for r in results), "fast_p50": percentile(fast, 0.5),
+            "fast_p95": percentile(fast, 0.95)}
+
+def run_sequential(targets: list) -> dict:
+    """従来の PingService.check_http と同じく、1 件ずつ requests で確認する（再試行なし）。"""
+    session = requests.Session()
+    started = time.perf_counter()
+    ok = 0
+    for target in targets:
+        try:
+            ok += session.get(target.url, timeout=target.timeout).status_code == 200
+        except requests.exceptions.RequestException:
+            pass
+    return {"elapsed": time.perf_counter() - started, "ok": ok}
+
+def main():
+    parser = argparse.ArgumentParser(description="ProbeEngine benchmark against a local stand-in server")
+    parser.add_argument("--targets", type=int, default=200)
+    parser.add_argument("--slow-ratio", type=float, default=0.1)
+    parser.add_argument("--hang-ratio", type=float, default=0.05)
+    parser.add_argument("--error-ratio", type=float, default=0.05)
+    parser.add_argument("--slow-delay", type=float, default=0.5, help="seconds the slow targets take")
+    parser.add_argument("--timeout", type=float, default=2.0, help="per-target timeout (hanging targets exceed it)")
+    parser.add_argument("--pool-size", type=int, default=100)
+    parser.add_argument("--skip-sequential", action="store_true")
+    args = parser.parse_args()
+
+    port = start_server(args.slow_delay, args.timeout * 3)
+    targets = build_targets(port, args.targets, args.slow_ratio, args.hang_ratio, args.error_ratio, args.timeout)
+
+    engine = run_engine(targets, args.pool_size)
+    print(f"engine     targets={len(targets)} ok={engine['ok']} elapsed={engine['elapsed']:.2f}s "
+          f"fast p50={engine['fast_p50'] * 1000:.1f}ms p95={engine['fast_p95'] * 1000:.1f}ms")
+    if not args.skip_sequential:
+        sequential = run_sequential(targets)
+        print(f"sequential targets={len(targets)} ok={sequential['ok']} elapsed={sequential['elapsed']:.2f}s")
+
+if __name__ == "__main__":
+    main()
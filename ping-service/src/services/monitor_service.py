@@ -1,54 +1,56 @@
-import schedule
-import time
+import asyncio
 from services.alert_service import AlertService
-from services.ping_service import PingService
+from services.probe_service import ProbeEngine, ProbeTarget
+from utils.logger import setup_logger
 import os
 from dotenv import load_dotenv
 load_dotenv()
 
+logger = setup_logger("monitor_service_logger")
+
 class MonitorService:
     def __init__(self):
-        # 遅延インポートで循環インポートを回避
-        self.ping_service = PingService()
         self.alert_service = AlertService(
             sender_email=os.environ.get("SMTP_USER"),
             sender_password=os.environ.get("SMTP_PASSWORD"),
             smtp_server=os.environ.get("SMTP_SERVER", "smtp.gmail.com"),
             smtp_port=int(os.environ.get("SMTP_PORT", 587))
         )
+        self.probe_engine = None
 
-    def monitor_http(self, url):
+    def alert_probe_failure(self, result):
         """
-        HTTP監視を実行し、結果を出力する。
+        監視対象が落ちたときのメール通知（ProbeEngine の on_failure）。
         """
-        print(f"Debug: Starting HTTP monitoring for {url}")
-        result = self.ping_service.check_http(url)
-        print(f"Debug: Monitoring result -> {result}")
+        self.alert_service.send_email(
+            recipient_email="recipient_email@example.com",
+            subject="Server Down Alert",
+            message=f"Alert: The server {result.target} at {result.url} is not reachable.\n\nDetails:\n{result.error}"
+        )
 
-        if "reachable" not in result:
-            self.alert_service.send_email(
-                recipient_email="recipient_email@example.com",
-                subject="Server Down Alert",
-                message=f"Alert: The server at {url} is not reachable.\n\nDetails:\n{result}"
-            )
+    def start_probes(self, targets):
+        """
+        複数の監視対象をバックグラウンドのイベントループで並行して監視する。ProbeEngine を返す。
+        """
+        self.probe_engine = ProbeEngine(targets, on_failure=self.alert_probe_failure)
+        self.probe_engine.start_in_thread()
+        logger.info(f"Started probes for {len(targets)} targets")
+        return self.probe_engine
 
     def start_monitoring(self, url, interval=5):
         """
-        定期的にHTTP監視を実行する。
+        定期的にHTTP監視を実行する（interval は分）。戻らない。
         """
-        schedule.every(interval).minutes.do(self.monitor_http, url=url)
-        print(f"Debug: Scheduled HTTP monitoring every {interval} minutes for {url}")
-
-        while True:
-            schedule.run_pending()
-            time.sleep(1)
+        logger.info(f"Scheduled HTTP monitoring every {interval} minutes for {url}")
+        self.probe_engine = ProbeEngine([ProbeTarget(name=url, url=url, interval=interval * 60)],
+                                        on_failure=self.alert_probe_failure)
+        asyncio.run(self.probe_engine.run())
 
 def monitor_server(url, interval=300):
-    ping_service = PingService()
-    while True:
-        result = ping_service.check_http(url)
-        print(result)  # ログはすでに ping_service 内で記録される
-        time.sleep(interval)
+    service = MonitorService()
+    engine = ProbeEngine([ProbeTarget(name=url, url=url, interval=interval)],
+                         on_failure=service.alert_probe_failure)
+    asyncio.run(engine.run())  # ログは probe_service 内で記録される
 
 if __name__ == "__main__":
     monitor_server("https://acro-match-w8t0.onrender.com", interval=300)  # 5分ごとに監視
\ No newline at end of file
@@ -0,0 +1,235 @@
+# services/probe_service.py
+
+import asyncio
+import json
+import os
+import random
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass, field, fields
+from datetime import datetime
+from typing import Callable, Dict, List, Optional
+from urllib.parse import urlparse
+
+import aiohttp
+from utils.logger import setup_logger
+
+logger = setup_logger("probe_service_logger")
+
+# 複数の監視対象を 1 つのイベントループで並行して監視する。
+# 対象ごとに間隔・タイムアウト・ジッターを持ち、接続は 1 つの ClientSession（接続プール）を共有する。
+# 応答の遅い対象があっても、ほかの対象の監視は待たされない。
+
+PROBE_POOL_SIZE = int(os.environ.get("PROBE_POOL_SIZE", 50))         # 同時に張る接続数の上限
+PROBE_INTERVAL = float(os.environ.get("PROBE_INTERVAL", 300))        # 秒（対象で指定がないとき）
+PROBE_TIMEOUT = float(os.environ.get("PROBE_TIMEOUT", 10))           # 秒
+PROBE_RETRIES = int(os.environ.get("PROBE_RETRIES", 3))
+PROBE_BACKOFF_BASE = float(os.environ.get("PROBE_BACKOFF_BASE", 1))  # 再試行の待ち（秒）。1, 2, 4... 倍
+USER_AGENT = "AcroMatchMonitor/1.0"
+
+@dataclass
+class ProbeTarget:
+    name: str
+    url: str
+    interval: float = PROBE_INTERVAL
+    timeout: float = PROBE_TIMEOUT
+    jitter: Optional[float] = None  # 秒。None なら interval の 10%
+    method: str = "GET"
+    retries: int = PROBE_RETRIES
+
+    def __post_init__(self):
+        # PROBE_TARGETS（環境変数）から作るので、起動時に分かるよう値を確かめる
+        parsed = urlparse(self.url) if isinstance(self.url, str) else None
+        if not parsed or parsed.scheme not in ("http", "https") or not parsed.netloc:
+            raise ValueError(f"probe target {self.name!r}: url must be http(s)://...: {self.url!r}")
+        for name in ("interval", "timeout"):
+            value = getattr(self, name)
+            if isinstance(value, bool) or not isinstance(value, (int, float)) or value <= 0:
+                raise ValueError(f"probe target {self.name!r}: {name} must be a positive number: {value!r}")
+        if isinstance(self.retries, bool) or not isinstance(self.retries, int) or self.retries < 1:
+            raise ValueError(f"probe target {self.name!r}: retries must be an integer >= 1: {self.retries!r}")
+        if self.jitter is not None and (not isinstance(self.jitter, (int, float)) or self.jitter < 0):
+            raise ValueError(f"probe target {self.name!r}: jitter must be >= 0: {self.jitter!r}")
+
+    def jitter_seconds(self) -> float:
+        return self.interval * 0.1 if self.jitter is None else self.jitter
+
+_TARGET_FIELDS = {f.name for f in fields(ProbeTarget)}
+
+@dataclass
+class ProbeResult:
+    target: str
+    url: str
+    ok: bool
+    status: Optional[int]
+    latency: float  # 秒（最後の試行）
+    attempts: int
+    error: Optional[str] = None
+    checked_at: str = field(default_factory=lambda: datetime.utcnow().isoformat())
+
+    def to_dict(self) -> dict:
+        return {
+            "target": self.target,
+            "url": self.url,
+            "ok": self.ok,
+            "status": self.status,
+            "latency_ms": round(self.latency * 1000, 1),
+            "attempts": self.attempts,
+            "error": self.error,
+            "checked_at": self.checked_at,
+        }
+
+def load_targets(value: Optional[str] = None) -> List[ProbeTarget]:
+    """
+    PROBE_TARGETS から監視対象を作る。
+    "name=url,name=url" の形か、ProbeTarget の項目を持つオブジェクトの JSON 配列。
+    形式の誤り・未知の項目・http(s) 以外の URL・0 以下の間隔やタイムアウトは ValueError。
+    """
+    value = os.environ.get("PROBE_TARGETS", "") if value is None else value
+    value = value.strip()
+    if not value:
+        return []
+    if value.startswith("["):
+        try:
+            items = json.loads(value)
+        except ValueError as e:
+            raise ValueError(f"PROBE_TARGETS is not valid JSON: {e}") from None
+        targets = []
+        for item in items:
+            if not isinstance(item, dict):
+                raise ValueError(f"PROBE_TARGETS items must be objects: {item!r}")
+            unknown = set(item) - _TARGET_FIELDS
+            if unknown:
+                raise ValueError(f"PROBE_TARGETS has unknown keys: {sorted(unknown)}")
+            if "name" not in item or "url" not in item:
+                raise ValueError(f"PROBE_TARGETS items need name and url: {item!r}")
+            targets.append(ProbeTarget(**item))
+        return targets
+    targets = []
+    for entry in value.split(","):
+        entry = entry.strip()
+        if not entry:
+            continue
+        name, sep, url = entry.partition("=")
+        targets.append(ProbeTarget(name=name.strip(), url=url.strip()) if sep else ProbeTarget(name=entry, url=entry))
+    return targets
+
+class ProbeEngine:
+    """
+    監視対象ごとにコルーチンを 1 つ動かし、間隔ごとに HTTP で確認する。
+    on_failure は対象が落ちたとき（成功から失敗に変わったとき）に 1 回だけ、スレッドで呼ぶ（メール送信などで止まらないように）。
+    """
+
+    def __init__(self, targets: List[ProbeTarget], pool_size: int = PROBE_POOL_SIZE,
+                 on_failure: Optional[Callable[[ProbeResult], None]] = None, history: int = 3):
+        self.targets = list(targets)
+        self.pool_size = pool_size
+        self.on_failure = on_failure
+        self.results: Dict[str, deque] = {t.name: deque(maxlen=history) for t in self.targets}
+        self.failures: Dict[str, int] = {t.name: 0 for t in self.targets}
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._stop: Optional[asyncio.Event] = None
+
+    def _session(self) -> aiohttp.ClientSession:
+        connector = aiohttp.TCPConnector(limit=self.pool_size, ttl_dns_cache=300)
+        return aiohttp.ClientSession(connector=connector, headers={"User-Agent": USER_AGENT})
+
+    async def probe(self, session: aiohttp.ClientSession, target: ProbeTarget) -> ProbeResult:
+        """1 回確認する。通信エラーと 5xx は待ってから再試行し、待つ間もほかの対象の確認は進む。"""
+        timeout = aiohttp.ClientTimeout(total=target.timeout)
+        status, error, latency = None, None, 0.0
+        for attempt in range(1, target.retries + 1):
+            started = time.perf_counter()
+            try:
+                async with session.request(target.method, target.url, timeout=timeout, allow_redirects=False) as resp:
+                    status, error = resp.status, None
+                    await resp.read()
+                latency = time.perf_counter() - started
+                if status < 500:
+                    return ProbeResult(target.name, target.url, status < 400, status, latency, attempt,
+                                       None if status < 400 else f"status {status}")
+                error = f"status {status}"
+            except asyncio.TimeoutError:
+                latency = time.perf_counter() - started
+                status, error = None, f"timeout after {target.timeout}s"
+            except aiohttp.ClientError as e:
+                latency = time.perf_counter() - started
+                status, error = None, f"{type(e).__name__}: {e}"
+            logger.warning(f"Attempt {attempt}: probe failed for {target.name} ({target.url}) -> {error}")
+            if attempt < target.retries:
+                await asyncio.sleep(PROBE_BACKOFF_BASE * 2 ** (attempt - 1))
+        return ProbeResult(target.name, target.url, False, status, latency, target.retries, error)
+
+    async def _record(self, result: ProbeResult):
+        self.results[result.target].appendleft(result)
+        if result.ok:
+            if self.failures[result.target]:
+                logger.info(f"Probe recovered for {result.target} ({result.url})")
+            self.failures[result.target] = 0
+            return
+        self.failures[result.target] += 1
+        logger.error(f"Probe failed for {result.target} ({result.url}): {result.error}")
+        if self.failures[result.target] == 1 and self.on_failure:
+            try:
+                await asyncio.get_running_loop().run_in_executor(None, self.on_failure, result)
+            except Exception as e:
+                logger.error(f"Alert callback failed for {result.target} -> {e}")
+
+    async def _run_target(self, session: aiohttp.ClientSession, target: ProbeTarget):
+        jitter = target.jitter_seconds()
+        # 起動直後に全対象が同時に確認しないよう、最初はランダムにずらす
+        delay = random.uniform(0, jitter)
+        while not await self._wait_stop(delay):
+            started = time.monotonic()
+            try:
+                await self._record(await self.probe(session, target))
+            except Exception as e:
+                logger.error(f"Probe loop error for {target.name} -> {e}")
+            next_delay = max(0.0, target.interval + random.uniform(-jitter, jitter))
+            delay = max(0.0, next_delay - (time.monotonic() - started))
+
+    async def _wait_stop(self, seconds: float) -> bool:
+        """seconds 秒待つ。途中で stop() されたら True。"""
+        if self._stop.is_set():
+            return True
+        try:
+            await asyncio.wait_for(self._stop.wait(), timeout=seconds)
+            return True
+        except asyncio.TimeoutError:
+            return False
+
+    async def run(self):
+        """stop() されるまで全対象を監視する。"""
+        self._loop = asyncio.get_running_loop()
+        self._stop = asyncio.Event()
+        logger.info(f"Starting probes for {len(self.targets)} targets (pool={self.pool_size})")
+        async with self._session() as session:
+            await asyncio.gather(*(self._run_target(session, t) for t in self.targets))
+
+    async def run_once(self) -> List[ProbeResult]:
+        """全対象を 1 回ずつ並行して確認する。"""
+        async with self._session() as session:
+            results = await asyncio.gather(*(self.probe(session, t) for t in self.targets))
+        for result in results:
+            await self._record(result)
+        return list(results)
+
+    def start_in_thread(self) -> threading.Thread:
+        """専用スレッドでイベントループを動かす（Flask アプリからの起動用）。"""
+        thread = threading.Thread(target=asyncio.run, args=(self.run(),), name="probe-engine", daemon=True)
+        thread.start()
+        return thread
+
+    def stop(self):
+        if self._loop and self._stop:
+            self._loop.call_soon_threadsafe(self._stop.set)
+
+    def status(self) -> dict:
+        return {
+            name: {
+                "consecutive_failures": self.failures[name],
+                "recent": [r.to_dict() for r in list(results)],
+            }
+            for name, results in self.results.items()
+        }
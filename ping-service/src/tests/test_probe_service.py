@@ -0,0 +1,142 @@
+import unittest
+import sys
+import os
+import asyncio
+import time
+
+# srcディレクトリをモジュール検索パスに追加
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from aiohttp import web
+from services import probe_service
+from services.probe_service import ProbeEngine, ProbeTarget, load_targets
+
+class TestProbeEngine(unittest.IsolatedAsyncioTestCase):
+
+    async def asyncSetUp(self):
+        self.flaky_calls = 0
+
+        async def ok(request):
+            return web.Response(text="ok")
+
+        async def hang(request):
+            await asyncio.sleep(2)
+            return web.Response(text="late")
+
+        async def flaky(request):
+            # 1 回目だけ 503 を返す
+            self.flaky_calls += 1
+            return web.Response(status=503 if self.flaky_calls == 1 else 200)
+
+        app = web.Application()
+        app.router.add_get("/ok", ok)
+        app.router.add_get("/hang", hang)
+        app.router.add_get("/flaky", flaky)
+        self.runner = web.AppRunner(app)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, "127.0.0.1", 0)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        self.base = f"http://127.0.0.1:{port}"
+        self.backoff = probe_service.PROBE_BACKOFF_BASE
+        probe_service.PROBE_BACKOFF_BASE = 0.01
+
+    async def asyncTearDown(self):
+        probe_service.PROBE_BACKOFF_BASE = self.backoff
+        await self.runner.cleanup()
+
+    async def test_slow_target_does_not_delay_others(self):
+        targets = [ProbeTarget(name="hang", url=f"{self.base}/hang", timeout=0.5, retries=1)]
+        targets += [ProbeTarget(name=f"ok-{i}", url=f"{self.base}/ok", timeout=0.5, retries=1) for i in range(20)]
+        engine = ProbeEngine(targets)
+        started = time.perf_counter()
+        results = {r.target: r for r in await engine.run_once()}
+        self.assertLess(time.perf_counter() - started, 2)
+        self.assertFalse(results["hang"].ok)
+        self.assertIn("timeout", results["hang"].error)
+        self.assertTrue(all(results[f"ok-{i}"].ok for i in range(20)))
+        self.assertEqual(engine.failures["hang"], 1)
+
+    async def test_retries_server_errors(self):
+        engine = ProbeEngine([ProbeTarget(name="flaky", url=f"{self.base}/flaky", retries=3)])
+        result = (await engine.run_once())[0]
+        self.assertTrue(result.ok)
+        self.assertEqual(result.attempts, 2)
+
+    async def test_alerts_once_per_outage(self):
+        alerts = []
+        engine = ProbeEngine([ProbeTarget(name="hang", url=f"{self.base}/hang", timeout=0.2, retries=1)],
+                             on_failure=alerts.append)
+        await engine.run_once()
+        await engine.run_once()
+        self.assertEqual(len(alerts), 1)
+        self.assertEqual(engine.failures["hang"], 2)
+
+    async def test_run_checks_each_target_on_its_interval(self):
+        engine = ProbeEngine([
+            ProbeTarget(name="fast", url=f"{self.base}/ok", interval=0.1, jitter=0),
+            ProbeTarget(name="hang", url=f"{self.base}/hang", interval=0.1, jitter=0, timeout=0.3, retries=1),
+        ], history=100)
+        task = asyncio.create_task(engine.run())
+        await asyncio.sleep(0.65)
+        engine.stop()
+        await asyncio.wait_for(task, 2)
+        self.assertGreaterEqual(len(engine.results["fast"]), 5)
+        self.assertLessEqual(len(engine.results["hang"]), 3)
+
+class TestLoadTargets(unittest.TestCase):
+
+    def test_name_url_pairs(self):
+        targets = load_targets("app=https://a.example, form=https://b.example")
+        self.assertEqual([(t.name, t.url) for t in targets], [("app", "https://a.example"), ("form", "https://b.example")])
+
+    def test_json(self):
+        targets = load_targets('[{"name": "app", "url": "https://a.example", "interval": 60, "timeout": 3}]')
+        self.assertEqual((targets[0].interval, targets[0].timeout), (60, 3))
+
+    def test_empty(self):
+        self.assertEqual(load_targets(""), [])
+
+    def test_rejects_invalid_targets(self):
+        invalid = [
+            '[{"name": "app", "url": "https://a.example"',                       # JSON の誤り
+            '[{"name": "app", "url": "https://a.example", "intervall": 60}]',    # 未知の項目
+            '[{"url": "https://a.example"}]',                                    # name がない
+            '["https://a.example"]',
+            '[{"name": "app", "url": "ftp://a.example"}]',
+            '[{"name": "app", "url": "https://a.example", "interval": 0}]',
+            '[{"name": "app", "url": "https://a.example", "timeout": -1}]',
+            '[{"name": "app", "url": "https://a.example", "timeout": "3"}]',
+            '[{"name": "app", "url": "https://a.example", "retries": 0}]',
+            "app=a.example",
+            "file:///etc/passwd",
+        ]
+        for value in invalid:
+            with self.subTest(value=value):
+                with self.assertRaises(ValueError):
+                    load_targets(value)
+
+class TestBootProbes(unittest.TestCase):
+
+    def setUp(self):
+        self.env = {k: os.environ.get(k) for k in ("ENABLE_PROBES", "PROBE_TARGETS")}
+        os.environ["ENABLE_PROBES"] = "1"
+        os.environ["PROBE_TARGETS"] = '[{"name": "app", "url": "https://a.example", "bogus": 1}]'
+
+    def tearDown(self):
+        for key, value in self.env.items():
+            if value is None:
+                os.environ.pop(key, None)
+            else:
+                os.environ[key] = value
+
+    def test_invalid_targets_do_not_break_requests(self):
+        import app as monitor_app
+        client = monitor_app.app.test_client()
+        with self.assertLogs("app", level="ERROR"):
+            self.assertEqual(client.get("/").status_code, 200)
+        self.assertEqual(client.get("/").status_code, 200)
+        self.assertIsNone(monitor_app.monitor_service.probe_engine)
+
+if __name__ == '__main__':
+    unittest.main()
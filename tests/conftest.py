@@ -0,0 +1,43 @@
+# tests/conftest.py
+import os
+import sys
+import tempfile
+
+import pytest
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+# モジュールの定数は import 時に環境変数から読まれるので、アプリのモジュールより先に決めておく
+os.environ["LOCAL_DB_PATH"] = os.path.join(tempfile.mkdtemp(prefix="acro-test-"), "test.db")
+os.environ["SPREADSHEET_ID"] = "test"
+# テストではクォータで待たせない（bench と同じ）
+os.environ["SHEETS_READ_PER_MINUTE"] = "1000000"
+os.environ["SHEETS_WRITE_PER_MINUTE"] = "1000000"
+os.environ["SHEETS_QUOTA_BURST"] = "1000000"
+
+from bench.fake_gspread import FakeClient  # noqa: E402
+from utils import local_db, sheets, user_directory  # noqa: E402
+
+@pytest.fixture
+def db_path(tmp_path, monkeypatch):
+    """テストごとに空のローカル SQLite を使う。"""
+    path = str(tmp_path / "local.db")
+    monkeypatch.setattr(local_db, "LOCAL_DB_PATH", path)
+    # テーブルを作り直させる
+    for name, module in list(sys.modules.items()):
+        if name.startswith("utils.") and hasattr(module, "_schema_ready"):
+            monkeypatch.setattr(module, "_schema_ready", False)
+    return path
+
+@pytest.fixture
+def spreadsheet(db_path, monkeypatch):
+    """メモリ上のスプレッドシート（bench/fake_gspread）を get_sheet から使えるようにする。"""
+    client = FakeClient()
+    monkeypatch.setattr(sheets, "gc", client)
+    sheets.invalidate_sheet_cache()
+    user_directory._directories.clear()
+    yield client.spreadsheet(os.environ["SPREADSHEET_ID"])
+    sheets.invalidate_sheet_cache()
+    user_directory._directories.clear()
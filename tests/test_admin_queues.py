@@ -0,0 +1,46 @@
+# tests/test_admin_queues.py
+import pytest
+from flask import Flask
+
+from blueprints.admin import admin_bp
+from utils.notify_queue import enqueue_line_message, notify_queue_depth
+from utils import notify_queue
+
+@pytest.fixture
+def client(db_path, monkeypatch):
+    monkeypatch.setenv("ADMIN_TOKEN", "secret")
+    app = Flask(__name__)
+    app.register_blueprint(admin_bp)
+    return app.test_client()
+
+AUTH = {"Authorization": "Bearer secret"}
+
+def dead_notification():
+    row_id = enqueue_line_message("U1", "a")
+    notify_queue._db().execute("UPDATE line_push_queue SET dead = 1 WHERE id = ?", (row_id,))
+    return row_id
+
+@pytest.mark.parametrize("queue", ["write-queue", "notify-queue"])
+def test_requires_admin_token(client, queue):
+    assert client.get(f"/admin/{queue}").status_code == 403
+    assert client.post(f"/admin/{queue}/purge").status_code == 403
+    assert client.get(f"/admin/{queue}", headers=AUTH).status_code == 200
+
+def test_notify_queue_dead_rows_are_listed_and_requeued(client):
+    row_id = dead_notification()
+
+    status = client.get("/admin/notify-queue", headers=AUTH).get_json()
+    assert status["depth"] == {"pending": 0, "dead": 1}
+    assert [r["id"] for r in status["dead"]] == [row_id]
+
+    result = client.post("/admin/notify-queue/requeue", json={"ids": [row_id]}, headers=AUTH).get_json()
+    assert (result["count"], result["depth"]) == (1, {"pending": 1, "dead": 0})
+
+def test_notify_queue_purge_and_bad_requests(client):
+    dead_notification()
+
+    assert client.post("/admin/notify-queue/retry", headers=AUTH).status_code == 404
+    assert client.post("/admin/notify-queue/purge", json={"ids": ["1"]}, headers=AUTH).status_code == 400
+    assert client.post("/admin/other-queue/purge", headers=AUTH).status_code == 404
+    assert client.post("/admin/notify-queue/purge", headers=AUTH).get_json()["count"] == 1
+    assert notify_queue_depth() == {"pending": 0, "dead": 0}
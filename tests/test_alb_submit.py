@@ -0,0 +1,24 @@
+# tests/test_alb_submit.py
+from werkzeug.datastructures import MultiDict
+
+from blueprints.alb import submit_result
+from utils.storage import REGISTRATION_SHEET_NAME
+from utils.user_directory import USER_HEADERS, USER_SHEET_NAME
+from utils.write_queue import flush_once, queue_depth
+
+def test_submit_does_not_wait_for_sheets(spreadsheet):
+    users = spreadsheet.add_worksheet(USER_SHEET_NAME, [USER_HEADERS])
+    registrations = spreadsheet.add_worksheet(REGISTRATION_SHEET_NAME, [["ニックネーム", "LIFF ID"]])
+    spreadsheet.client.reset_calls()
+
+    form = MultiDict([("user_id", "app-1"), ("name", "山田"), ("birthday4", "0123"), ("experience[]", "あり")])
+    assert submit_result(form) == ("登録が完了しました！", 200)
+
+    # 応答までに Sheets は呼ばない（ユーザー情報も講師登録もジャーナルに積むだけ）
+    assert sum(spreadsheet.client.reset_calls().values()) == 0
+    assert queue_depth()["pending"] == 2
+
+    assert flush_once() == 2
+    assert users.rows[1][:4] == ["山田", "20000123", "", "app-1"]
+    assert registrations.rows[1][0] == "山田"
+    assert registrations.rows[1][-1] == "app-1"
@@ -0,0 +1,87 @@
+# tests/test_asgi.py
+import asyncio
+import re
+
+import pytest
+
+pytest.importorskip("starlette.testclient")  # ASGI モードの依存（requirements.txt）と httpx が必要
+from starlette.testclient import TestClient  # noqa: E402
+
+import app as flask_module  # noqa: E402
+import asgi  # noqa: E402
+from utils import write_queue  # noqa: E402
+
+@pytest.fixture
+def client(db_path, monkeypatch):
+    # バックグラウンドのスレッドはテストでは起動しない
+    started = []
+    monkeypatch.setattr(flask_module, "_background_started", True)
+    monkeypatch.setattr(asgi, "start_background_workers", lambda: started.append(True))
+    with TestClient(asgi.app) as client:
+        client.started = started
+        yield client
+
+def csrf_token(client) -> str:
+    """Flask 側のフォームを開いてセッション Cookie と CSRF トークンを受け取る。"""
+    page = client.get("/alb/register")
+    assert page.status_code == 200
+    return re.search(r'name="csrf_token" value="([^"]+)"', page.text).group(1)
+
+def test_lifespan_starts_background_workers(client):
+    assert client.started == [True]
+
+def test_flask_routes_are_served_through_the_mount(client):
+    assert "Flask アプリ稼働中" in client.get("/").text
+    admin = client.get("/admin/")
+    assert admin.status_code == 200
+    assert "管理画面" in admin.text
+    assert client.get("/admin/write-queue").status_code == 403
+
+def test_submit_without_csrf_token_is_rejected(client):
+    response = client.post("/alb/submit", data={"user_id": "app-1", "name": "山田"})
+
+    assert response.status_code == 400
+    assert "CSRF" in response.text
+    assert write_queue.queue_depth()["pending"] == 0
+
+def test_submit_with_csrf_token_passes_form_data_to_submit_result(client):
+    token = csrf_token(client)
+    response = client.post("/alb/submit", data={
+        "csrf_token": token,
+        "user_id": "app-1",
+        "name": "山田",
+        "birthday4": "0123",
+        "experience[]": ["あり", "指導"],
+        "area": "東京",
+    })
+
+    assert response.status_code == 200
+    assert response.text == "登録が完了しました！"
+    # ユーザー登録と講師登録の 2 件がジャーナルに積まれる（複数値の項目もそのまま届く）
+    rows = write_queue._db().execute("SELECT op, row_json FROM sheet_write_queue ORDER BY id").fetchall()
+    assert [r["op"] for r in rows] == ["register_user", "append"]
+    assert '"あり, 指導"' in rows[1]["row_json"]
+
+def test_json_route_accepts_the_token_header(client):
+    token = csrf_token(client)
+    assert client.post("/link/liff", json={"userId": "app-1"}).status_code == 400
+    response = client.post("/link/liff", json={"userId": "app-1"}, headers={"X-CSRFToken": token})
+    assert response.json() == {"ok": True, "mode": "ensure"}
+
+def test_callback_accepts_events_off_the_event_loop(client, monkeypatch):
+    calls = []
+
+    def accept_events(data):
+        try:
+            asyncio.get_running_loop()
+            calls.append("loop")
+        except RuntimeError:
+            calls.append("thread")
+        return "OK", 200
+
+    monkeypatch.setattr(asgi, "accept_events", accept_events)
+    response = client.post("/callback", json={"events": []})
+
+    assert (response.status_code, response.text) == (200, "OK")
+    assert calls == ["thread"]
+    assert client.post("/callback", content=b"not json").status_code == 500
@@ -0,0 +1,68 @@
+# tests/test_event_dispatcher.py
+import threading
+import time
+
+from utils import event_dispatcher
+from utils.event_dispatcher import KeyedDispatcher, SeenKeys
+
+def test_instances_share_seen_keys(db_path):
+    # 別のワーカープロセスに届いた再送の代わり
+    a, b = SeenKeys("webhook", ttl=60), SeenKeys("webhook", ttl=60)
+
+    assert a.add("ev1")
+    assert not b.add("ev1")
+    assert b.add("ev2")
+    assert not a.add("ev2")
+    assert SeenKeys("other", ttl=60).add("ev1")
+
+def test_key_is_accepted_again_after_ttl(db_path, monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(event_dispatcher.time, "time", lambda: now[0])
+    seen = SeenKeys("webhook", ttl=60)
+
+    assert seen.add("ev1")
+    now[0] += 59
+    assert not seen.add("ev1")
+    now[0] += 2
+    assert seen.add("ev1")
+    assert not seen.add("ev1")
+
+def test_rejected_event_can_be_redelivered(db_path):
+    started, release = threading.Event(), threading.Event()
+    handled = []
+
+    def handler(event):
+        started.set()
+        release.wait(5)
+        handled.append(event["id"])
+
+    dispatcher = KeyedDispatcher(handler, name="test-full", workers=1, queue_size=1)
+    assert dispatcher.submit("U1", {"id": "e1"}, event_id="e1")
+    assert started.wait(5)  # e1 は処理中
+    assert dispatcher.submit("U1", {"id": "e2"}, event_id="e2")  # 待ち行列はこれで満杯
+    assert not dispatcher.submit("U1", {"id": "e3"}, event_id="e3")
+
+    release.set()
+    dispatcher.join()
+    assert dispatcher.submit("U1", {"id": "e3"}, event_id="e3")  # 再送は重複扱いにならない
+    dispatcher.join()
+
+    assert handled == ["e1", "e2", "e3"]
+    assert dispatcher.status()["rejected"] == 1
+    assert dispatcher.status()["duplicates"] == 0
+
+def test_events_for_one_user_are_handled_in_order(db_path):
+    handled = {}
+
+    def handler(event):
+        time.sleep(0.001 * (event["n"] % 3))
+        handled.setdefault(event["user"], []).append(event["n"])
+
+    dispatcher = KeyedDispatcher(handler, name="test-order", workers=4, queue_size=100)
+    for n in range(30):
+        for user in ("U1", "U2", "U3"):
+            assert dispatcher.submit(user, {"user": user, "n": n}, event_id=f"{user}-{n}")
+    dispatcher.join()
+
+    assert handled == {user: list(range(30)) for user in ("U1", "U2", "U3")}
+    assert dispatcher.status()["processed"] == 90
@@ -0,0 +1,89 @@
+# tests/test_fanout.py
+import json
+
+import pytest
+
+from utils import fanout
+from utils.notify import LineResult
+from utils.sheets_quota import QuotaWaitTimeout
+
+class Crash(BaseException):
+    """送信中にプロセスが落ちた代わり（send_once の except Exception を素通りする）。"""
+
+class FakeLineClient:
+    """multicast の呼び出しを記録し、results を順に返す（尽きたら成功）。"""
+
+    def __init__(self):
+        self.results = []
+        self.multicasts = []
+
+    def multicast(self, to, messages, retry_key=None):
+        self.multicasts.append((list(to), retry_key))
+        result = self.results.pop(0) if self.results else LineResult(True, 200, None, False)
+        if isinstance(result, BaseException):
+            raise result
+        return result
+
+@pytest.fixture
+def line(db_path, monkeypatch):
+    client = FakeLineClient()
+    monkeypatch.setattr(fanout, "FANOUT_ENABLED", True)
+    monkeypatch.setattr(fanout, "FANOUT_CHUNK_SIZE", 2)
+    monkeypatch.setattr(fanout, "select_recipients", lambda row: [f"U{i}" for i in range(7)])
+    monkeypatch.setattr(fanout, "get_line_client", lambda: client)
+    monkeypatch.setattr(fanout._send_bucket, "acquire", lambda deadline=None: None)
+    return client
+
+def plan_job():
+    fanout.schedule_classroom_fanout(["教室", "東京", "2026/11/01", "U-owner"])
+    assert fanout.plan_once()
+
+def chunks():
+    return fanout._db().execute(
+        "SELECT chunk_no, recipients_json, retry_key, lease_until, sent_at FROM fanout_chunks ORDER BY chunk_no"
+    ).fetchall()
+
+def test_interrupted_job_resumes_at_the_next_chunk(line):
+    plan_job()
+    assert fanout.send_once() == 2
+    assert fanout.send_once() == 2
+
+    # 2 チャンク送ったところで止まったジョブ。再開すると 3 つめから送る
+    assert fanout.send_once() == 2
+    assert fanout.send_once() == 1
+    assert fanout.send_once() == 0
+
+    stored = chunks()
+    assert [to for to, _ in line.multicasts] == [json.loads(c["recipients_json"]) for c in stored]
+    assert [key for _, key in line.multicasts] == [c["retry_key"] for c in stored]
+    assert fanout.fanout_status()["chunks_sent"] == 4
+
+def test_resent_chunk_reuses_its_retry_key(line):
+    plan_job()
+    line.results = [Crash()]
+    with pytest.raises(Crash):
+        fanout.send_once()
+    assert fanout.send_once() == 2  # 送信中のチャンクはリース中なので次のチャンクへ進む
+
+    # リースが切れたら、落ちる前と同じ retry_key で送り直す
+    fanout._db().execute("UPDATE fanout_chunks SET lease_until = 0 WHERE sent_at IS NULL")
+    line.results = [LineResult(False, None, "timeout", True)]
+    assert fanout.send_once() == 0
+    fanout._db().execute("UPDATE fanout_chunks SET next_attempt_at = 0")
+    assert fanout.send_once() == 2
+
+    first = chunks()[0]["retry_key"]
+    assert [key for _, key in line.multicasts if key == first] == [first] * 3
+    assert chunks()[0]["sent_at"] is not None
+
+def test_quota_timeout_releases_the_lease(line, monkeypatch):
+    plan_job()
+
+    def acquire(deadline=None):
+        raise QuotaWaitTimeout("line_multicast")
+
+    monkeypatch.setattr(fanout._send_bucket, "acquire", acquire)
+    assert fanout.send_once() == 0
+
+    assert line.multicasts == []
+    assert all(c["lease_until"] == 0 and c["sent_at"] is None for c in chunks())
@@ -0,0 +1,25 @@
+# tests/test_iter_sheet_rows.py
+from utils.sheets import iter_sheet_rows
+
+def read_all(spreadsheet, rows, page_size):
+    spreadsheet.add_worksheet("書き出し", rows)
+    return list(iter_sheet_rows("書き出し", page_size=page_size))
+
+def test_returns_every_row_across_pages(spreadsheet):
+    rows = [["h"]] + [[str(i)] for i in range(10)]
+    assert read_all(spreadsheet, rows, page_size=3) == rows
+
+def test_keeps_blank_rows_at_page_ends(spreadsheet):
+    # 3 行目と 6 行目はページの最後の行
+    rows = [["h"], ["a"], [], ["b"], ["c"], [], ["d"]]
+    assert read_all(spreadsheet, rows, page_size=3) == rows
+
+def test_keeps_blank_pages_between_data(spreadsheet):
+    rows = [["h"], ["a"], [], [], [], [], [], ["b"]]
+    assert read_all(spreadsheet, rows, page_size=3) == rows
+
+def test_drops_trailing_blank_rows(spreadsheet):
+    rows = [["h"], ["a"], [], [], [], [], []]
+    assert read_all(spreadsheet, rows, page_size=3) == [["h"], ["a"]]
+    # 行数を超えたところで止まる（1:3, 4:6, 7:9）
+    assert spreadsheet.client.calls["get"] == 3
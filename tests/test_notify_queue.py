@@ -0,0 +1,110 @@
+# tests/test_notify_queue.py
+import uuid
+
+import pytest
+
+from utils import notify, notify_queue
+from utils.local_db import get_connection
+from utils.notify import LineClient, LineResult
+from utils.notify_queue import enqueue_line_message, notify_queue_depth, send_once
+
+class FakeLineClient:
+    """push の呼び出しを記録し、results を順に返す（尽きたら成功）。"""
+
+    def __init__(self, *results):
+        self.results = list(results)
+        self.pushes = []
+
+    def push(self, to, messages, retry_key=None):
+        self.pushes.append((to, messages[0]["text"], retry_key))
+        return self.results.pop(0) if self.results else LineResult(True, 200, None, False)
+
+@pytest.fixture
+def line(db_path, monkeypatch):
+    client = FakeLineClient()
+    monkeypatch.setattr(notify_queue, "get_line_client", lambda: client)
+    return client
+
+def retry_now():
+    notify_queue._db().execute("UPDATE line_push_queue SET next_attempt_at = 0")
+
+def test_retry_reuses_the_stored_retry_key(line):
+    line.results = [LineResult(False, None, "timeout", True)]
+    enqueue_line_message("U1", "こんにちは")
+
+    assert send_once() == 0
+    retry_now()
+    assert send_once() == 1
+
+    (_, _, first), (_, _, second) = line.pushes
+    assert first == second
+    uuid.UUID(first)
+    assert notify_queue_depth() == {"pending": 0, "dead": 0}
+
+def test_each_message_gets_its_own_key(line):
+    enqueue_line_message("U1", "a")
+    enqueue_line_message("U1", "b")
+    send_once()
+
+    assert len({key for _, _, key in line.pushes}) == 2
+
+def test_client_error_is_not_retried(line):
+    line.results = [LineResult(False, 400, "bad request", False)]
+    enqueue_line_message("U1", "a")
+    send_once()
+
+    assert notify_queue_depth() == {"pending": 0, "dead": 1}
+
+def test_adds_retry_key_to_an_existing_queue(db_path, line):
+    # retry_key 列がなかった頃の DB ファイル
+    get_connection().executescript("""
+        CREATE TABLE line_push_queue (
+            id INTEGER PRIMARY KEY AUTOINCREMENT, to_id TEXT NOT NULL, message TEXT NOT NULL,
+            created_at REAL NOT NULL, attempts INTEGER NOT NULL DEFAULT 0,
+            next_attempt_at REAL NOT NULL DEFAULT 0, lease_until REAL NOT NULL DEFAULT 0,
+            last_error TEXT, dead INTEGER NOT NULL DEFAULT 0
+        );
+        INSERT INTO line_push_queue (to_id, message, created_at) VALUES ('U1', 'old', 0);
+    """)
+
+    assert send_once() == 1
+    assert line.pushes[0][2]
+    uuid.UUID(line.pushes[0][2])
+
+class FakeResponse:
+    def __init__(self, status, headers=None):
+        self.status_code = status
+        self.headers = headers or {}
+        self.text = ""
+
+def test_push_sends_the_retry_key_on_every_attempt(monkeypatch):
+    monkeypatch.setattr(notify, "LINE_BACKOFF_BASE", 0)
+    client = LineClient("token")
+    responses = [FakeResponse(500), FakeResponse(409, {"x-line-accepted-request-id": "r1"})]
+    sent = []
+
+    def post(url, json=None, headers=None, timeout=None):
+        sent.append(headers["X-Line-Retry-Key"])
+        return responses.pop(0)
+
+    monkeypatch.setattr(client.session, "post", post)
+    result = client.push("U1", [{"type": "text", "text": "a"}], retry_key="key-1")
+
+    # 2 回目は LINE が受付済みと返すので、重複せずに成功扱い
+    assert result.ok
+    assert sent == ["key-1", "key-1"]
+
+def test_dead_rows_can_be_requeued_purged_and_pruned(line, monkeypatch):
+    line.results = [LineResult(False, 400, "bad request", False)] * 3
+    ids = [enqueue_line_message("U1", str(i)) for i in range(3)]
+    send_once()
+
+    assert [r["id"] for r in notify_queue.dead_rows()] == ids[::-1]
+    assert notify_queue.requeue_dead([ids[0]]) == 1
+    assert notify_queue_depth() == {"pending": 1, "dead": 2}
+    assert send_once() == 1
+
+    monkeypatch.setattr(notify_queue, "NOTIFY_QUEUE_DEAD_MAX", 1)
+    assert notify_queue.prune_dead() == 1
+    assert notify_queue.purge_dead() == 1
+    assert notify_queue_depth() == {"pending": 0, "dead": 0}
@@ -0,0 +1,67 @@
+# tests/test_page_cache.py
+import gzip
+
+import pytest
+from flask import Flask
+
+from utils import page_cache
+from utils.page_cache import CSRF_PLACEHOLDER, CachedPage, page_response
+
+HTML = f"<form><input name='csrf_token' value='{CSRF_PLACEHOLDER}'>" + "あいう" * 500 + \
+       f"<input value='{CSRF_PLACEHOLDER}'></form>"
+
+@pytest.mark.parametrize("html", [HTML, "<p>トークンなし</p>", CSRF_PLACEHOLDER, ""])
+def test_gzip_body_matches_body(html):
+    page = CachedPage(html)
+    for token in ("token-1", "もう一つのトークン", ""):
+        assert gzip.decompress(page.gzip_body(token)) == page.body(token)
+        assert page.body(token) == html.replace(CSRF_PLACEHOLDER, token).encode("utf-8")
+
+@pytest.fixture
+def client(monkeypatch):
+    monkeypatch.setattr(page_cache, "brotli", None)
+    app = Flask(__name__)
+    app.secret_key = "test"
+    page = CachedPage(HTML)
+
+    @app.route("/form")
+    def form():
+        return page_response(page, max_age=60)
+
+    return app.test_client()
+
+def test_gzip_response_and_etag(client):
+    response = client.get("/form", headers={"Accept-Encoding": "gzip"})
+    etag = response.headers["ETag"].strip('"')
+
+    assert response.status_code == 200
+    assert response.headers["Content-Encoding"] == "gzip"
+    assert etag.endswith("-gzip")
+    body = gzip.decompress(response.data).decode("utf-8")
+    assert CSRF_PLACEHOLDER not in body
+    assert response.headers["Cache-Control"] == "private, max-age=60"
+    assert set(response.headers["Vary"].replace(" ", "").split(",")) >= {"Cookie", "Accept-Encoding"}
+
+    # 同じセッションなら同じトークンなので ETag も同じになり、304 を返す
+    cached = client.get("/form", headers={"Accept-Encoding": "gzip", "If-None-Match": f'"{etag}"'})
+    assert cached.status_code == 304
+    assert cached.data == b""
+
+def test_identity_response_has_its_own_etag(client):
+    gzipped = client.get("/form", headers={"Accept-Encoding": "gzip"})
+    plain = client.get("/form", headers={"Accept-Encoding": "identity"})
+
+    assert "Content-Encoding" not in plain.headers
+    assert plain.data == gzip.decompress(gzipped.data)
+    assert plain.headers["ETag"] != gzipped.headers["ETag"]
+    # 別の表現の ETag では 304 にしない
+    stale = client.get("/form", headers={"Accept-Encoding": "identity", "If-None-Match": gzipped.headers["ETag"]})
+    assert stale.status_code == 200
+
+def test_new_session_gets_new_etag(client):
+    first = client.get("/form", headers={"Accept-Encoding": "gzip"})
+    # Cookie を持たない別のクライアント
+    second = client.application.test_client().get("/form", headers={"Accept-Encoding": "gzip", "If-None-Match": first.headers["ETag"]})
+
+    assert second.status_code == 200
+    assert second.headers["ETag"] != first.headers["ETag"]
@@ -0,0 +1,37 @@
+# tests/test_settings.py
+import os
+
+import pytest
+
+from utils import settings
+
+@pytest.fixture
+def settings_file(tmp_path, monkeypatch):
+    path = str(tmp_path / "settings.json")
+    monkeypatch.setattr(settings, "SETTINGS_PATH", path)
+    monkeypatch.setattr(settings, "_stat_key", None)
+    monkeypatch.setattr(settings, "_version", "")
+    monkeypatch.setattr(settings, "_checked_at", 0.0)
+    return path
+
+def test_version_changes_with_content_within_one_mtime_tick(settings_file, monkeypatch):
+    # 更新時刻の粒度が粗く、2 回の保存で時刻もサイズも同じになる場合
+    monkeypatch.setattr(settings, "_stat_key_of", lambda path: (1, os.path.getsize(path)) if os.path.exists(path) else None)
+
+    settings.save_settings({"label": "A"})
+    first = settings.settings_version()
+    settings.save_settings({"label": "B"})
+
+    assert settings.load_settings() == {"label": "B"}
+    assert settings.settings_version() != first
+
+def test_same_content_keeps_version(settings_file):
+    settings.save_settings({"label": "A"})
+    first = settings.settings_version()
+    settings.save_settings({"label": "A"})
+
+    assert settings.settings_version() == first
+
+def test_missing_file_has_empty_version(settings_file):
+    settings._refresh(force=True)
+    assert (settings.load_settings(), settings.settings_version()) == ({}, "")
@@ -0,0 +1,78 @@
+# tests/test_sheets_quota.py
+import pytest
+
+from utils import sheets_quota
+from utils.sheets_quota import QuotaWaitTimeout, TokenBucket, backoff_seconds
+
+class Clock:
+    """sheets_quota の time の代わり。sleep すると時計だけ進む。"""
+
+    def __init__(self, now=1000.0):
+        self.now = now
+
+    def time(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+@pytest.fixture
+def clock(db_path, monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(sheets_quota, "time", clock)
+    return clock
+
+def test_burst_then_refill(clock):
+    bucket = TokenBucket("test", per_minute=60, burst=2)
+
+    assert bucket.try_acquire() == 0
+    assert bucket.try_acquire() == 0
+    assert bucket.try_acquire() == pytest.approx(1.0)
+
+    clock.sleep(0.5)
+    assert bucket.try_acquire() == pytest.approx(0.5)
+    clock.sleep(0.5)
+    assert bucket.try_acquire() == 0
+
+def test_refill_is_capped_at_burst(clock):
+    bucket = TokenBucket("test", per_minute=60, burst=2)
+    bucket.try_acquire()
+    clock.sleep(3600)
+
+    waits = [bucket.try_acquire() for _ in range(3)]
+    assert waits[:2] == [0, 0]
+    assert waits[2] > 0
+
+def test_buckets_with_the_same_name_share_tokens(clock):
+    # 別ワーカーのバケットも同じ SQLite の行を使う
+    first = TokenBucket("shared", per_minute=60, burst=1)
+    second = TokenBucket("shared", per_minute=60, burst=1)
+
+    assert first.try_acquire() == 0
+    assert second.try_acquire() == pytest.approx(1.0)
+    assert TokenBucket("other", per_minute=60, burst=1).try_acquire() == 0
+
+def test_acquire_waits_until_deadline(clock):
+    bucket = TokenBucket("test", per_minute=60, burst=1)
+    bucket.try_acquire()
+
+    waited = bucket.acquire(deadline=clock.now + 5)
+    assert 1.0 <= waited <= 1.2
+
+    with pytest.raises(QuotaWaitTimeout):
+        bucket.acquire(deadline=clock.now + 0.5)
+
+def test_block_stops_every_bucket_with_the_name(clock):
+    TokenBucket("test", per_minute=60, burst=10).block(5)
+    bucket = TokenBucket("test", per_minute=60, burst=10)
+
+    assert bucket.try_acquire() == pytest.approx(5.0)
+    clock.sleep(5)
+    assert bucket.try_acquire() == 0
+
+def test_backoff_seconds_prefers_retry_after():
+    assert backoff_seconds(3, "7") == 7.0
+    assert backoff_seconds(0, "-1") == 0.0
+    base = sheets_quota.SHEETS_BACKOFF_BASE
+    assert base * 4 <= backoff_seconds(2, "soon") <= base * 8
+    assert base <= backoff_seconds(0) <= base * 2
@@ -0,0 +1,106 @@
+# tests/test_user_directory.py
+import pytest
+
+from utils.user_directory import USER_HEADERS, USER_SHEET_NAME, UserDirectory
+
+@pytest.fixture
+def users(spreadsheet):
+    spreadsheet.add_worksheet(USER_SHEET_NAME, [
+        USER_HEADERS,
+        ["山田", "2000-01-23", "chat-1", "", "t0"],
+        ["佐藤", "1999-12-31", "", "app-2", "t0"],
+    ])
+    return UserDirectory()
+
+def sheet_rows(spreadsheet):
+    return spreadsheet.worksheet(USER_SHEET_NAME).rows
+
+def test_reload_indexes_each_key(users):
+    assert users.find_by_chat_liff_id("chat-1")["_row"] == 2
+    assert users.find_by_app_liff_id("app-2")["名前"] == "佐藤"
+    assert [r["_row"] for r in users.find_by_name_birthday4("佐藤", "1231")] == [3]
+    assert users.find_by_app_liff_id("missing") is None
+
+def test_update_many_sends_only_changes_and_reindexes(users, spreadsheet):
+    client = spreadsheet.client
+    users.find_by_app_liff_id("app-2")
+    client.reset_calls()
+
+    changed = users.update_many({3: {"アプリ LIFF ID": "app-3", "名前": "佐藤"}})
+
+    assert changed == {3: ["アプリ LIFF ID"]}
+    assert client.reset_calls()["batch_update"] == 1
+    assert sheet_rows(spreadsheet)[2][3] == "app-3"
+    assert users.find_by_app_liff_id("app-2") is None
+    assert users.find_by_app_liff_id("app-3")["_row"] == 3
+
+    # 変更がなければ API を呼ばない
+    assert users.update_many({3: {"アプリ LIFF ID": "app-3"}}) == {}
+    assert client.reset_calls()["batch_update"] == 0
+
+def test_append_many_takes_row_numbers_from_updated_range(users, spreadsheet):
+    users.find_by_app_liff_id("app-2")
+    rows = users.append_many([
+        {"名前": "鈴木", "誕生日": "2001-02-03", "チャット LIFF ID": "chat-4"},
+        {"名前": "田中", "誕生日": "2002-03-04", "アプリ LIFF ID": "app-5"},
+    ])
+
+    assert rows == [4, 5]
+    assert users.find_by_chat_liff_id("chat-4")["_row"] == 4
+    assert users.find_by_app_liff_id("app-5")["_row"] == 5
+    assert sheet_rows(spreadsheet)[4] == ["田中", "2002-03-04", "", "app-5", ""]
+
+def test_append_many_reloads_when_range_is_missing(users, spreadsheet, monkeypatch):
+    worksheet = spreadsheet.worksheet(USER_SHEET_NAME)
+    append_rows = worksheet.append_rows
+
+    def append_without_range(values, **kwargs):
+        append_rows(values, **kwargs)
+        return {}
+
+    monkeypatch.setattr(worksheet, "append_rows", append_without_range)
+    users.find_by_app_liff_id("app-2")
+
+    assert users.append_many([{"名前": "鈴木", "チャット LIFF ID": "chat-4"}]) == [0]
+    # 読み直した索引で引ける
+    assert users.find_by_chat_liff_id("chat-4")["_row"] == 4
+
+def test_upsert_many_splits_fills_and_appends(users, spreadsheet):
+    client = spreadsheet.client
+    users.find_by_app_liff_id("app-2")
+    client.reset_calls()
+
+    results = users.upsert_many([
+        # チャット LIFF ID で既存行に一致。空欄だけを埋め、登録日時は上書きしない
+        {"name": "山田", "birthday": "2000-01-23", "chat_liff_id": "chat-1", "app_liff_id": "app-1", "timestamp": "t1"},
+        # 名前＋誕生日で既存行に一致
+        {"name": "佐藤", "birthday": "1999-12-31", "chat_liff_id": "chat-2", "timestamp": "t1"},
+        # 新規。同じバッチ内の 2 件目は 1 件目へ統合する
+        {"name": "鈴木", "birthday": "2001-02-03", "timestamp": "t1"},
+        {"name": "鈴木", "birthday": "2001-02-03", "chat_liff_id": "chat-4", "timestamp": "t2"},
+    ])
+
+    calls = client.reset_calls()
+    assert (calls["batch_update"], calls["append_rows"]) == (1, 1)
+    assert results == [
+        {"row": 2, "created": False, "changed": ["アプリ LIFF ID"]},
+        {"row": 3, "created": False, "changed": ["チャット LIFF ID"]},
+        {"row": 4, "created": True, "changed": ["名前", "誕生日", "登録日時"]},
+        {"row": 4, "created": True, "changed": ["チャット LIFF ID"]},
+    ]
+    assert sheet_rows(spreadsheet)[1:] == [
+        ["山田", "2000-01-23", "chat-1", "app-1", "t0"],
+        ["佐藤", "1999-12-31", "chat-2", "app-2", "t0"],
+        ["鈴木", "2001-02-03", "chat-4", "", "t1"],
+    ]
+    assert users.find_by_chat_liff_id("chat-4")["_row"] == 4
+
+def test_upsert_many_without_changes_makes_no_calls(users, spreadsheet):
+    client = spreadsheet.client
+    users.find_by_app_liff_id("app-2")
+    client.reset_calls()
+
+    results = users.upsert_many([{"name": "山田", "birthday": "2000-01-23", "chat_liff_id": "chat-1"}])
+
+    assert results == [{"row": 2, "created": False, "changed": []}]
+    assert sum(client.reset_calls().values()) == 0
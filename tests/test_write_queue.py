@@ -0,0 +1,148 @@
+# tests/test_write_queue.py
+import time
+
+import pytest
+
+from utils import write_queue
+from utils.local_db import get_connection
+from utils.user_directory import USER_HEADERS, USER_SHEET_NAME
+from utils.write_queue import (
+    _claim_batch, enqueue_append, enqueue_user_registration, flush_once, prune_dead, purge_dead, queue_depth,
+    requeue_dead,
+)
+
+def queue_rows():
+    return [dict(r) for r in write_queue._db().execute("SELECT * FROM sheet_write_queue ORDER BY id")]
+
+@pytest.fixture
+def sheet(spreadsheet):
+    return spreadsheet.add_worksheet("ログ", [["日時", "内容"]])
+
+def fail_appends(monkeypatch, worksheet):
+    def append_rows(values, **kwargs):
+        raise RuntimeError("boom")
+    monkeypatch.setattr(worksheet, "append_rows", append_rows)
+
+def test_flush_sends_one_append_per_sheet(spreadsheet, sheet):
+    other = spreadsheet.add_worksheet("別シート", [])
+    for i in range(3):
+        enqueue_append("ログ", [f"t{i}", i])
+    enqueue_append("別シート", ["x"])
+    spreadsheet.client.reset_calls()
+
+    assert flush_once() == 4
+    assert spreadsheet.client.calls["append_rows"] == 2
+    assert sheet.rows[1:] == [["t0", "0"], ["t1", "1"], ["t2", "2"]]
+    assert other.rows == [["x"]]
+    assert queue_depth() == {"pending": 0, "dead": 0}
+
+def test_claimed_rows_are_leased(sheet):
+    enqueue_append("ログ", ["a"])
+
+    claimed = _claim_batch(10)
+    assert len(claimed) == 1
+    # リース中は別のワーカーが取り出さない
+    assert _claim_batch(10) == []
+    assert queue_rows()[0]["lease_until"] >= time.time() + write_queue.WRITE_QUEUE_LEASE - 5
+
+def test_expired_lease_is_claimed_again(sheet):
+    enqueue_append("ログ", ["a"])
+    _claim_batch(10)
+    write_queue._db().execute("UPDATE sheet_write_queue SET lease_until = ?", (time.time() - 1,))
+
+    assert flush_once() == 1
+    assert sheet.rows[1:] == [["a"]]
+
+def test_failure_backs_off_and_releases_lease(sheet, monkeypatch):
+    enqueue_append("ログ", ["a"])
+    fail_appends(monkeypatch, sheet)
+    before = time.time()
+
+    assert flush_once() == 0
+    row = queue_rows()[0]
+    assert (row["attempts"], row["dead"], row["lease_until"]) == (1, 0, 0)
+    assert row["next_attempt_at"] >= before + 2
+    assert "boom" in row["last_error"]
+    # 待ち時間が過ぎるまでは再送しない
+    assert flush_once() == 0
+    assert queue_rows()[0]["attempts"] == 1
+
+    monkeypatch.delattr(sheet, "append_rows")  # 元のメソッドに戻す
+    write_queue._db().execute("UPDATE sheet_write_queue SET next_attempt_at = 0")
+    assert flush_once() == 1
+    assert sheet.rows[1:] == [["a"]]
+
+def test_gives_up_after_max_attempts(sheet, monkeypatch):
+    monkeypatch.setattr(write_queue, "WRITE_QUEUE_MAX_ATTEMPTS", 2)
+    enqueue_append("ログ", ["a"])
+    fail_appends(monkeypatch, sheet)
+
+    flush_once()
+    write_queue._db().execute("UPDATE sheet_write_queue SET next_attempt_at = 0")
+    flush_once()
+
+    assert queue_depth() == {"pending": 0, "dead": 1}
+    assert queue_rows()[0]["attempts"] == 2
+
+def test_missing_sheet_is_dead_at_once(spreadsheet):
+    enqueue_append("ないシート", ["a"])
+
+    assert flush_once() == 0
+    assert queue_depth() == {"pending": 0, "dead": 1}
+    assert queue_rows()[0]["attempts"] == 1
+
+def test_requeue_and_purge_dead_rows(spreadsheet):
+    ids = [enqueue_append("ないシート", [i]) for i in range(3)]
+    flush_once()
+
+    assert requeue_dead([ids[0]]) == 1
+    assert queue_depth() == {"pending": 1, "dead": 2}
+    assert queue_rows()[0]["attempts"] == 0
+    assert purge_dead([ids[1]]) == 1
+    assert purge_dead([]) == 0
+    assert purge_dead() == 1
+    assert queue_depth() == {"pending": 1, "dead": 0}
+
+def test_prune_dead_drops_expired_and_excess_rows(spreadsheet, monkeypatch):
+    monkeypatch.setattr(write_queue, "WRITE_QUEUE_DEAD_MAX", 2)
+    ids = [enqueue_append("ないシート", [i]) for i in range(5)]
+    enqueue_append("ないシート", ["pending"])
+    flush_once(limit=5)
+    write_queue._db().execute("UPDATE sheet_write_queue SET created_at = 0 WHERE id = ?", (ids[4],))
+
+    # 期限切れの 1 件と、上限を超えた古い 2 件
+    assert prune_dead() == 3
+    assert [r["id"] for r in queue_rows() if r["dead"]] == ids[2:4]
+    assert queue_depth()["pending"] == 1
+
+def test_user_registrations_are_applied_in_one_batch(spreadsheet):
+    users = spreadsheet.add_worksheet(USER_SHEET_NAME, [USER_HEADERS, ["山田", "2000-01-23", "chat-1", "", "t0"]])
+    # 名前＋誕生日下4桁でアプリ LIFF ID を紐付ける 1 件と、新規の 2 件（同じ人なので 1 行にまとまる）
+    enqueue_user_registration(USER_SHEET_NAME, {"name": "山田", "birthday": "20000123", "app_liff_id": "app-1"})
+    enqueue_user_registration(USER_SHEET_NAME, {"name": "鈴木", "birthday": "20010203", "timestamp": "t1"})
+    enqueue_user_registration(USER_SHEET_NAME, {"name": "鈴木", "birthday": "20010203", "chat_liff_id": "chat-2"})
+    spreadsheet.client.reset_calls()
+
+    assert flush_once() == 3
+    calls = spreadsheet.client.calls
+    assert (calls["batch_update"], calls["append_rows"]) == (1, 1)
+    assert users.rows[1:] == [
+        ["山田", "2000-01-23", "chat-1", "app-1", "t0"],
+        ["鈴木", "20010203", "chat-2", "", "t1"],
+    ]
+    assert queue_depth() == {"pending": 0, "dead": 0}
+
+def test_adds_op_column_to_an_existing_queue(db_path, sheet):
+    # op 列がなかった頃の DB ファイル
+    get_connection().executescript("""
+        CREATE TABLE sheet_write_queue (
+            id INTEGER PRIMARY KEY AUTOINCREMENT, sheet_name TEXT NOT NULL, row_json TEXT NOT NULL,
+            value_input_option TEXT NOT NULL DEFAULT 'RAW', created_at REAL NOT NULL,
+            attempts INTEGER NOT NULL DEFAULT 0, next_attempt_at REAL NOT NULL DEFAULT 0,
+            lease_until REAL NOT NULL DEFAULT 0, last_error TEXT, dead INTEGER NOT NULL DEFAULT 0
+        );
+        INSERT INTO sheet_write_queue (sheet_name, row_json, created_at) VALUES ('ログ', '["old"]', 0);
+    """)
+
+    assert flush_once() == 1
+    assert sheet.rows[1:] == [["old"]]
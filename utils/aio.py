@@ -0,0 +1,24 @@
+# utils/aio.py
+import contextvars
+import functools
+import os
+import anyio
+
+# ASGI モード（asgi.py）用。Sheets などブロックする呼び出しをイベントループの外のスレッドで待つ。
+# スレッド数は上限を設け、それを超えた分はコルーチンのまま（スレッドを使わずに）順番を待つ。
+
+ASYNC_IO_THREADS = int(os.getenv("ASYNC_IO_THREADS", 32))
+
+_limiter = None
+
+def _get_limiter() -> anyio.CapacityLimiter:
+    global _limiter
+    if _limiter is None:
+        _limiter = anyio.CapacityLimiter(ASYNC_IO_THREADS)
+    return _limiter
+
+async def run_io(fn, *args, **kwargs):
+    """fn をスレッドで実行して結果を待つ。締め切りなどの contextvars も引き継ぐ。"""
+    context = contextvars.copy_context()
+    call = functools.partial(context.run, fn, *args, **kwargs)
+    return await anyio.to_thread.run_sync(call, limiter=_get_limiter())
@@ -0,0 +1,16 @@
+# utils/auth.py
+import hmac
+import os
+from flask import request
+
+def token_authorized(env_name: str) -> bool:
+    """
+    環境変数 env_name のトークンと、Authorization: Bearer か ?token= の値が一致するか。
+    個人情報を返すルート用なので、環境変数を設定していなければ常に False（誰も使えない）。
+    """
+    token_env = os.environ.get(env_name)
+    if not token_env:
+        return False
+    auth = request.headers.get("Authorization", "")
+    token = auth[7:] if auth.startswith("Bearer ") else request.args.get("token")
+    return token is not None and hmac.compare_digest(token.encode("utf-8"), token_env.encode("utf-8"))
@@ -0,0 +1,138 @@
+# utils/classroom_index.py
+import os
+import re
+import bisect
+import hashlib
+import threading
+import time
+import unicodedata
+from typing import Dict, List, Optional, Set, Tuple
+from utils.storage import get_storage, CLASSROOM_SHEET_NAME
+from utils.data_version import current_version
+
+# 教室行の列位置（教室登録シートと同じ）
+COL_NAME, COL_LOCATION, COL_DATE, COL_EXPERIENCE, COL_HANDSLEVEL, COL_DETAILS, COL_OWNER = 0, 1, 2, 3, 4, 5, 6
+
+CLASSROOM_INDEX_TTL = int(os.getenv("CLASSROOM_INDEX_TTL", 300))  # 秒
+
+_DATE_PATTERN = re.compile(r"^(\d{4})[-/](\d{1,2})[-/](\d{1,2})")
+
+def normalize(value) -> str:
+    """全角・半角の揺れと前後の空白を吸収する。"""
+    return unicodedata.normalize("NFKC", str(value or "")).strip()
+
+def split_multi(value) -> List[str]:
+    """複数選択の列（"体操,ダンス" や "体操, ダンス"）を値のリストにする。"""
+    return [v for v in (normalize(x) for x in re.split(r"[,、]", str(value or ""))) if v]
+
+def _cell(row: list, i: int) -> str:
+    return row[i] if i < len(row) else ""
+
+def parse_date(value) -> Optional[str]:
+    """開催日を "YYYY-MM-DD" に揃える。解釈できなければ None。"""
+    m = _DATE_PATTERN.match(normalize(value))
+    if not m:
+        return None
+    return f"{m.group(1)}-{int(m.group(2)):02}-{int(m.group(3)):02}"
+
+def classroom_id(row: list) -> str:
+    """
+    行の内容から教室 ID を作る。行の挿入・削除・並べ替えでは変わらない
+    （セルを編集すると別の ID になる）。
+    """
+    cells = [normalize(c) for c in row[:COL_OWNER + 1]]
+    while cells and not cells[-1]:
+        cells.pop()
+    return hashlib.sha1("\x1f".join(cells).encode("utf-8")).hexdigest()[:12]
+
+def assign_classroom_ids(rows: List[list]) -> List[str]:
+    """全行の教室 ID を返す。まったく同じ内容の行には 2 件目から "-2", "-3"... を付ける。"""
+    ids, seen = [], {}
+    for row in rows:
+        cid = classroom_id(row)
+        seen[cid] = seen.get(cid, 0) + 1
+        ids.append(cid if seen[cid] == 1 else f"{cid}-{seen[cid]}")
+    return ids
+
+class ClassroomIndex:
+    """
+    教室行の転置インデックス。
+    場所・希望する経験・補助レベル → 行位置の集合と、開催日順のソート済みリストを持ち、
+    絞り込みは集合演算と二分探索だけで行う。外には行位置ではなく教室 ID を返す。
+    """
+
+    def __init__(self, rows: List[list]):
+        self.rows = rows
+        self.ids = assign_classroom_ids(rows)
+        self._pos: Dict[str, int] = {cid: i for i, cid in enumerate(self.ids)}
+        self.by_location: Dict[str, Set[int]] = {}
+        self.by_experience: Dict[str, Set[int]] = {}
+        self.by_handslevel: Dict[str, Set[int]] = {}
+        dated: List[Tuple[str, int]] = []
+
+        for row_id, row in enumerate(rows):
+            location = normalize(_cell(row, COL_LOCATION))
+            if location:
+                self.by_location.setdefault(location, set()).add(row_id)
+            for v in split_multi(_cell(row, COL_EXPERIENCE)):
+                self.by_experience.setdefault(v, set()).add(row_id)
+            for v in split_multi(_cell(row, COL_HANDSLEVEL)):
+                self.by_handslevel.setdefault(v, set()).add(row_id)
+            d = parse_date(_cell(row, COL_DATE))
+            if d:
+                dated.append((d, row_id))
+
+        dated.sort()
+        self._date_keys = [d for d, _ in dated]
+        self._date_ids = [row_id for _, row_id in dated]
+
+    def row(self, classroom_id: str) -> Optional[list]:
+        pos = self._pos.get(classroom_id)
+        return None if pos is None else self.rows[pos]
+
+    def query(self, location=None, date_from=None, date_to=None, experience=(), handslevel=(),
+              page: int = 1, per_page: int = 20) -> Tuple[List[str], int]:
+        """
+        条件に一致する教室 ID のうち指定ページ分（登録順）と、一致した総件数を返す。
+        同じ項目内の複数値は OR、項目どうしは AND。
+        """
+        candidates: Optional[Set[int]] = None
+
+        def narrow(ids: Set[int]):
+            nonlocal candidates
+            candidates = set(ids) if candidates is None else candidates & ids
+
+        if location:
+            narrow(self.by_location.get(normalize(location), set()))
+        if experience:
+            narrow(set().union(*(self.by_experience.get(normalize(v), set()) for v in experience)))
+        if handslevel:
+            narrow(set().union(*(self.by_handslevel.get(normalize(v), set()) for v in handslevel)))
+        if date_from or date_to:
+            lo = bisect.bisect_left(self._date_keys, parse_date(date_from)) if parse_date(date_from) else 0
+            hi = bisect.bisect_right(self._date_keys, parse_date(date_to)) if parse_date(date_to) else len(self._date_keys)
+            narrow(set(self._date_ids[lo:hi]))
+
+        if candidates is None:
+            matched = self.ids
+        else:
+            matched = [self.ids[pos] for pos in sorted(candidates)]
+        start = (max(page, 1) - 1) * per_page
+        return matched[start:start + per_page], len(matched)
+
+_index: Optional[ClassroomIndex] = None
+_index_key = None
+_index_lock = threading.Lock()
+
+def get_classroom_index() -> ClassroomIndex:
+    """教室データの更新番号が変わるか TTL を過ぎたときだけ作り直したインデックスを返す。"""
+    global _index, _index_key
+    version = current_version(CLASSROOM_SHEET_NAME)
+    with _index_lock:
+        if _index is not None and _index_key[0] == version and time.monotonic() - _index_key[1] < CLASSROOM_INDEX_TTL:
+            return _index
+    _, rows = get_storage().list_classrooms()
+    index = ClassroomIndex(rows)
+    with _index_lock:
+        _index, _index_key = index, (version, time.monotonic())
+    return index
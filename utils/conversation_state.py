@@ -0,0 +1,71 @@
+# utils/conversation_state.py
+import os
+import json
+import time
+import threading
+from utils.local_db import get_connection
+
+# LINE 上の登録フロー（ニックネーム → 生年月日）の途中状態。
+# gunicorn の全ワーカーで共有するためローカル SQLite に置き、期限と件数の上限を設ける。
+
+CONVERSATION_STATE_TTL = int(os.getenv("CONVERSATION_STATE_TTL", 7 * 24 * 3600))  # 秒
+CONVERSATION_STATE_MAX = int(os.getenv("CONVERSATION_STATE_MAX", 10000))          # 保持する最大件数
+_PRUNE_EVERY = 100  # この回数の書き込みごとに期限切れ・上限超過分を消す
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS conversation_states (
+    user_id TEXT PRIMARY KEY,
+    state_json TEXT NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_conversation_states_updated ON conversation_states (updated_at);
+"""
+
+_schema_ready = False
+_writes = 0
+_writes_lock = threading.Lock()
+
+def _db():
+    global _schema_ready
+    conn = get_connection()
+    if not _schema_ready:
+        conn.executescript(_SCHEMA)
+        _schema_ready = True
+    return conn
+
+def get_state(user_id: str) -> dict:
+    """ユーザーの途中状態を返す。なければ（期限切れも含む）空の dict。"""
+    row = _db().execute(
+        "SELECT state_json FROM conversation_states WHERE user_id = ? AND updated_at > ?",
+        (user_id, time.time() - CONVERSATION_STATE_TTL),
+    ).fetchone()
+    return json.loads(row["state_json"]) if row else {}
+
+def set_state(user_id: str, state: dict):
+    global _writes
+    _db().execute(
+        "INSERT INTO conversation_states (user_id, state_json, updated_at) VALUES (?, ?, ?) "
+        "ON CONFLICT(user_id) DO UPDATE SET state_json = excluded.state_json, updated_at = excluded.updated_at",
+        (user_id, json.dumps(state, ensure_ascii=False), time.time()),
+    )
+    with _writes_lock:
+        _writes += 1
+        due = _writes % _PRUNE_EVERY == 0
+    if due:
+        prune_states()
+
+def clear_state(user_id: str):
+    _db().execute("DELETE FROM conversation_states WHERE user_id = ?", (user_id,))
+
+def prune_states() -> int:
+    """期限切れの状態と、上限件数を超えた古い状態を消して、消した件数を返す。"""
+    conn = _db()
+    removed = conn.execute(
+        "DELETE FROM conversation_states WHERE updated_at <= ?", (time.time() - CONVERSATION_STATE_TTL,)
+    ).rowcount
+    removed += conn.execute(
+        "DELETE FROM conversation_states WHERE user_id IN ("
+        "SELECT user_id FROM conversation_states ORDER BY updated_at DESC LIMIT -1 OFFSET ?)",
+        (CONVERSATION_STATE_MAX,),
+    ).rowcount
+    return removed
@@ -0,0 +1,36 @@
+# utils/data_version.py
+from utils.local_db import get_connection
+
+# データセット（シート名など）ごとの更新番号。
+# 全ワーカーで共有するためローカル SQLite に置き、キャッシュのキーに使う。
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS data_versions (
+    name TEXT PRIMARY KEY,
+    version INTEGER NOT NULL
+);
+"""
+
+_schema_ready = False
+
+def _db():
+    global _schema_ready
+    conn = get_connection()
+    if not _schema_ready:
+        conn.executescript(_SCHEMA)
+        _schema_ready = True
+    return conn
+
+def bump_version(name: str) -> int:
+    """データセットの更新番号を1つ進めて返す。"""
+    conn = _db()
+    conn.execute(
+        "INSERT INTO data_versions (name, version) VALUES (?, 1) "
+        "ON CONFLICT(name) DO UPDATE SET version = version + 1",
+        (name,),
+    )
+    return current_version(name)
+
+def current_version(name: str) -> int:
+    row = _db().execute("SELECT version FROM data_versions WHERE name = ?", (name,)).fetchone()
+    return row["version"] if row else 0
@@ -0,0 +1,64 @@
+# utils/deadline.py
+import os
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Optional
+
+# リクエストごとの締め切り。外部 API（Sheets）の呼び出しはこの残り時間を超えて待たない。
+# contextvars に置くので、同じスレッド（リクエスト）内の呼び出しにだけ伝わる。
+
+REQUEST_DEADLINE = float(os.getenv("REQUEST_DEADLINE", 25))  # 秒。gunicorn の既定 timeout（30 秒）より短く
+
+_deadline: ContextVar[Optional[float]] = ContextVar("deadline", default=None)  # time.monotonic() の値
+
+class DeadlineExceeded(TimeoutError):
+    """締め切りを過ぎたため外部 API を呼ばなかった。"""
+
+@contextmanager
+def deadline(seconds: float):
+    """この中の呼び出しを seconds 秒以内に終わらせる（外側の締め切りのほうが早ければそちら）。"""
+    current = _deadline.get()
+    new = time.monotonic() + seconds
+    token = _deadline.set(new if current is None else min(current, new))
+    try:
+        yield
+    finally:
+        _deadline.reset(token)
+
+@contextmanager
+def no_deadline():
+    """この中では締め切りを外す（ストリーミング応答など、リクエストより長く続く処理用）。"""
+    token = _deadline.set(None)
+    try:
+        yield
+    finally:
+        _deadline.reset(token)
+
+def remaining() -> Optional[float]:
+    """締め切りまでの残り秒数。締め切りがなければ None（バックグラウンドのスレッドなど）。"""
+    current = _deadline.get()
+    return None if current is None else current - time.monotonic()
+
+def check():
+    left = remaining()
+    if left is not None and left <= 0:
+        raise DeadlineExceeded("request deadline exceeded")
+
+def init_app(app):
+    """各リクエストに REQUEST_DEADLINE 秒の締め切りを付ける。"""
+    from flask import g
+
+    @app.before_request
+    def _deadline_start():
+        g._deadline_token = _deadline.set(time.monotonic() + REQUEST_DEADLINE)
+
+    @app.teardown_request
+    def _deadline_end(exc=None):
+        token = g.pop("_deadline_token", None)
+        if token is not None:
+            try:
+                _deadline.reset(token)
+            except ValueError:
+                # 別のコンテキストで作られたトークン（通常は起きない）
+                _deadline.set(None)
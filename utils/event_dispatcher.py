@@ -0,0 +1,149 @@
+# utils/event_dispatcher.py
+import os
+import queue
+import threading
+import time
+import zlib
+from typing import Callable, Optional
+from utils.local_db import get_connection
+from utils.logging_util import log_exception
+
+# Webhook イベントをすぐ受け付けて、少数のスレッドで後から処理する。
+# 同じユーザーのイベントは必ず同じスレッドに渡すので、ユーザーごとの順序は保たれる。
+# 受け付けたイベントはメモリ上の待ち行列にしかないので、処理前にプロセスが終わると失われる
+# （LINE には 200 を返し済みのため再送もされない）。
+
+WEBHOOK_WORKERS = int(os.getenv("WEBHOOK_WORKERS", 4))
+WEBHOOK_QUEUE_SIZE = int(os.getenv("WEBHOOK_QUEUE_SIZE", 500))     # スレッドごとの待ち行列の上限
+WEBHOOK_DEDUPE_TTL = int(os.getenv("WEBHOOK_DEDUPE_TTL", 24 * 3600))  # 秒。webhookEventId を覚えておく期間
+_PRUNE_EVERY = 500  # この回数の add ごとに期限切れのキーを消す
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS seen_event_keys (
+    scope TEXT NOT NULL,
+    event_key TEXT NOT NULL,
+    seen_at REAL NOT NULL,
+    PRIMARY KEY (scope, event_key)
+);
+CREATE INDEX IF NOT EXISTS idx_seen_event_keys_seen ON seen_event_keys (seen_at);
+"""
+
+_schema_ready = False
+
+def _db():
+    global _schema_ready
+    conn = get_connection()
+    if not _schema_ready:
+        conn.executescript(_SCHEMA)
+        _schema_ready = True
+    return conn
+
+class SeenKeys:
+    """
+    最近見たキーを ttl 秒間覚えておく。
+    再送が別のワーカーに届いても重複と分かるよう、ローカル SQLite に置いて全ワーカーで共有する。
+    """
+
+    def __init__(self, scope: str, ttl: int = WEBHOOK_DEDUPE_TTL):
+        self.scope = scope
+        self.ttl = ttl
+        self._adds = 0
+        self._lock = threading.Lock()
+
+    def add(self, key: str) -> bool:
+        """新しいキー（または期限切れのキー）なら覚えて True、既に見たキーなら False。"""
+        now = time.time()
+        added = _db().execute(
+            "INSERT INTO seen_event_keys (scope, event_key, seen_at) VALUES (?, ?, ?) "
+            "ON CONFLICT(scope, event_key) DO UPDATE SET seen_at = excluded.seen_at WHERE seen_at <= ?",
+            (self.scope, str(key), now, now - self.ttl),
+        ).rowcount > 0
+        with self._lock:
+            self._adds += 1
+            due = self._adds % _PRUNE_EVERY == 0
+        if due:
+            self.prune()
+        return added
+
+    def discard(self, key: str):
+        _db().execute("DELETE FROM seen_event_keys WHERE scope = ? AND event_key = ?", (self.scope, str(key)))
+
+    def prune(self) -> int:
+        """期限切れのキーを消して、消した件数を返す。"""
+        return _db().execute(
+            "DELETE FROM seen_event_keys WHERE scope = ? AND seen_at <= ?", (self.scope, time.time() - self.ttl)
+        ).rowcount
+
+class KeyedDispatcher:
+    """
+    キー（ユーザー ID）のハッシュでスレッドを選んでイベントを渡す。
+    待ち行列が満杯なら submit は False を返す（呼び出し側で 503 などを返して再送してもらう）。
+    """
+
+    def __init__(self, handler: Callable[[dict], None], name: str,
+                 workers: int = WEBHOOK_WORKERS, queue_size: int = WEBHOOK_QUEUE_SIZE,
+                 dedupe_ttl: int = WEBHOOK_DEDUPE_TTL):
+        self.handler = handler
+        self.name = name
+        self._queues = [queue.Queue(maxsize=queue_size) for _ in range(max(workers, 1))]
+        self._threads = []
+        self._start_lock = threading.Lock()
+        self._seen = SeenKeys(name, dedupe_ttl)
+        self._stats_lock = threading.Lock()
+        self.stats = {"accepted": 0, "duplicates": 0, "rejected": 0, "processed": 0, "errors": 0}
+
+    def _count(self, key: str):
+        with self._stats_lock:
+            self.stats[key] += 1
+
+    def _start(self):
+        # gunicorn の fork 後に作られるよう、最初の submit で起動する
+        with self._start_lock:
+            if self._threads:
+                return
+            for i, q in enumerate(self._queues):
+                t = threading.Thread(target=self._run, args=(q,), name=f"{self.name}-{i}", daemon=True)
+                t.start()
+                self._threads.append(t)
+
+    def submit(self, key: str, event: dict, event_id: Optional[str] = None) -> bool:
+        """イベントを受け付ける。処理済み・受付済みの event_id は捨てて True を返す。"""
+        if not self._threads:
+            self._start()
+        if event_id and not self._seen.add(event_id):
+            self._count("duplicates")
+            return True
+        q = self._queues[zlib.crc32(str(key).encode("utf-8")) % len(self._queues)]
+        try:
+            q.put_nowait(event)
+        except queue.Full:
+            # 再送されたときに処理できるよう、受け付けなかったイベントは忘れる
+            if event_id:
+                self._seen.discard(event_id)
+            self._count("rejected")
+            return False
+        self._count("accepted")
+        return True
+
+    def _run(self, q: queue.Queue):
+        while True:
+            event = q.get()
+            try:
+                self.handler(event)
+                self._count("processed")
+            except Exception as e:
+                self._count("errors")
+                log_exception(e, context=f"{self.name} イベント処理")
+            finally:
+                q.task_done()
+
+    def join(self):
+        """受け付け済みのイベントをすべて処理し終えるまで待つ。"""
+        for q in self._queues:
+            q.join()
+
+    def status(self) -> dict:
+        with self._stats_lock:
+            stats = dict(self.stats)
+        stats["queued"] = sum(q.qsize() for q in self._queues)
+        return stats
@@ -0,0 +1,221 @@
+# utils/fanout.py
+import os
+import json
+import time
+import uuid
+import threading
+from typing import List, Optional
+from utils import outbox
+from utils.local_db import get_connection
+from utils.notify import get_line_client, LINE_MULTICAST_MAX_RECIPIENTS
+from utils.storage import get_storage
+from utils.classroom_index import classroom_id
+from utils.sheets_quota import QuotaWaitTimeout, TokenBucket
+from utils.matching import get_matching_engine
+from utils.logging_util import log_exception, log_info, log_error
+
+# 新しい教室を、相性の良い講師へ LINE の multicast でまとめて知らせる。
+#   1. 教室登録時にジョブだけを SQLite に積む（リクエストは待たせない）
+#   2. バックグラウンドで宛先を選び、最大 500 件ずつのチャンクとして保存する
+#   3. チャンクごとに multicast を送り、送信済みを記録する
+# チャンクごとの X-Line-Retry-Key も保存するので、再起動後に送り直しても重複して届かない。
+
+FANOUT_ENABLED = os.getenv("FANOUT_ENABLED", "0") == "1"  # LINE で一斉送信するので明示的に有効にしたときだけ
+FANOUT_MIN_SCORE = float(os.getenv("FANOUT_MIN_SCORE", 0.7))
+FANOUT_CHUNK_SIZE = min(int(os.getenv("FANOUT_CHUNK_SIZE", LINE_MULTICAST_MAX_RECIPIENTS)), LINE_MULTICAST_MAX_RECIPIENTS)
+FANOUT_MIN_INTERVAL = float(os.getenv("FANOUT_MIN_INTERVAL", 1))  # 秒。multicast どうしの最小間隔（全ワーカー合計で）
+FANOUT_MAX_ATTEMPTS = int(os.getenv("FANOUT_MAX_ATTEMPTS", 8))
+FANOUT_INTERVAL = float(os.getenv("FANOUT_INTERVAL", 2))          # 秒
+FANOUT_LEASE = 120  # 秒。取り出したジョブ・チャンクをこの間は他ワーカーが処理しない
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS fanout_jobs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    classroom_id TEXT NOT NULL UNIQUE,
+    row_json TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    planned INTEGER NOT NULL DEFAULT 0,
+    recipients INTEGER NOT NULL DEFAULT 0,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    next_attempt_at REAL NOT NULL DEFAULT 0,
+    lease_until REAL NOT NULL DEFAULT 0,
+    last_error TEXT,
+    dead INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS idx_fanout_jobs_ready ON fanout_jobs (planned, dead, next_attempt_at, id);
+
+CREATE TABLE IF NOT EXISTS fanout_chunks (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    job_id INTEGER NOT NULL,
+    chunk_no INTEGER NOT NULL,
+    recipients_json TEXT NOT NULL,
+    message TEXT NOT NULL,
+    retry_key TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    next_attempt_at REAL NOT NULL DEFAULT 0,
+    lease_until REAL NOT NULL DEFAULT 0,
+    sent_at REAL,
+    last_error TEXT,
+    dead INTEGER NOT NULL DEFAULT 0,
+    UNIQUE (job_id, chunk_no)
+);
+CREATE INDEX IF NOT EXISTS idx_fanout_chunks_ready ON fanout_chunks (sent_at, dead, next_attempt_at, id);
+"""
+
+_schema_ready = False
+_wakeup = threading.Event()
+_worker_lock = threading.Lock()
+_worker_thread = None
+# multicast の間隔は SQLite のトークンバケットで全ワーカー共通に守る（溜めずに 1 個ずつ）
+_send_bucket = TokenBucket("line_multicast", 60.0 / max(FANOUT_MIN_INTERVAL, 0.001), burst=1)
+
+def _db():
+    global _schema_ready
+    conn = get_connection()
+    if not _schema_ready:
+        conn.executescript(_SCHEMA)
+        _schema_ready = True
+    return conn
+
+def schedule_classroom_fanout(row: list) -> Optional[int]:
+    """教室行の告知ジョブを積む。同じ内容の教室は 1 度しか告知しない。"""
+    if not FANOUT_ENABLED:
+        return None
+    cur = _db().execute(
+        "INSERT OR IGNORE INTO fanout_jobs (classroom_id, row_json, created_at) VALUES (?, ?, ?)",
+        (classroom_id(row), json.dumps(row, ensure_ascii=False), time.time()),
+    )
+    _wakeup.set()
+    return cur.lastrowid if cur.rowcount else None
+
+def fanout_status() -> dict:
+    conn = _db()
+    jobs = conn.execute(
+        "SELECT COALESCE(SUM(planned = 0 AND dead = 0), 0), COALESCE(SUM(dead = 1), 0) FROM fanout_jobs"
+    ).fetchone()
+    chunks = conn.execute(
+        "SELECT COALESCE(SUM(sent_at IS NULL AND dead = 0), 0), COALESCE(SUM(sent_at IS NOT NULL), 0), "
+        "COALESCE(SUM(dead = 1), 0) FROM fanout_chunks"
+    ).fetchone()
+    return {
+        "jobs_pending": jobs[0], "jobs_dead": jobs[1],
+        "chunks_pending": chunks[0], "chunks_sent": chunks[1], "chunks_dead": chunks[2],
+    }
+
+def classroom_message(row: list) -> str:
+    name, location, date = (row + ["", "", ""])[:3]
+    return f"新しい教室の募集があります！\n教室名: {name}\n場所: {location}\n開催日: {date}\nメニューの募集一覧からご確認ください。"
+
+def select_recipients(row: list) -> List[str]:
+    """
+    相性スコアが FANOUT_MIN_SCORE 以上の講師について、ユーザー情報からチャット LIFF ID を引く。
+    教室の登録者本人と、チャット LIFF ID が分からない講師は除く。
+    """
+    engine = get_matching_engine()
+    storage = get_storage()
+    owner = row[-1] if row else ""
+    recipients, seen = [], set()
+    for user_id, _ in engine.instructors_for_row(row, FANOUT_MIN_SCORE):
+        if user_id == owner:
+            continue
+        user = storage.find_user_by_app_liff_id(user_id) or storage.find_user_by_chat_liff_id(user_id)
+        chat_id = user.get("チャット LIFF ID") if user else ""
+        if chat_id and chat_id not in seen:
+            seen.add(chat_id)
+            recipients.append(chat_id)
+    return recipients
+
+def _claim(table: str, where: str, limit: int) -> list:
+    return outbox.claim(_db(), table, limit, FANOUT_LEASE, where)
+
+def _mark_failed(table: str, row, error: str, permanent: bool = False):
+    if outbox.mark_failed(_db(), table, row, error, FANOUT_MAX_ATTEMPTS, permanent):
+        log_error("告知を断念しました (%s id=%s): %s", table, row["id"], error, context="教室告知")
+
+def plan_once() -> bool:
+    """未計画のジョブ 1 件の宛先を選んでチャンクに分ける。処理したジョブがなければ False。"""
+    jobs = _claim("fanout_jobs", "planned = 0", 1)
+    if not jobs:
+        return False
+    job = jobs[0]
+    row = json.loads(job["row_json"])
+    try:
+        recipients = select_recipients(row)
+    except Exception as e:
+        log_exception(e, context="教室告知の宛先選択")
+        _mark_failed("fanout_jobs", job, str(e))
+        return True
+
+    message = classroom_message(row)
+    chunks = [recipients[i:i + FANOUT_CHUNK_SIZE] for i in range(0, len(recipients), FANOUT_CHUNK_SIZE)]
+    conn = _db()
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        conn.executemany(
+            "INSERT OR IGNORE INTO fanout_chunks (job_id, chunk_no, recipients_json, message, retry_key) "
+            "VALUES (?, ?, ?, ?, ?)",
+            [(job["id"], n, json.dumps(chunk), message, str(uuid.uuid4())) for n, chunk in enumerate(chunks)],
+        )
+        conn.execute(
+            "UPDATE fanout_jobs SET planned = 1, recipients = ?, lease_until = 0 WHERE id = ?",
+            (len(recipients), job["id"]),
+        )
+        conn.execute("COMMIT")
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
+    log_info("教室 %s を %d 人に告知します（%d 回に分割）", job["classroom_id"], len(recipients), len(chunks), context="教室告知")
+    return True
+
+def send_once() -> int:
+    """送信待ちのチャンクを 1 件 multicast で送り、届けた宛先数を返す。"""
+    chunks = _claim("fanout_chunks", "sent_at IS NULL", 1)
+    if not chunks:
+        return 0
+    chunk = chunks[0]
+    recipients = json.loads(chunk["recipients_json"])
+
+    # 送信間隔を空けて LINE API のレート制限に当たらないようにする（リースが切れる前に諦める）
+    try:
+        _send_bucket.acquire(time.time() + FANOUT_LEASE / 2)
+    except QuotaWaitTimeout:
+        outbox.release(_db(), "fanout_chunks", chunk["id"])
+        return 0
+
+    try:
+        result = get_line_client().multicast(
+            recipients, [{"type": "text", "text": chunk["message"]}], retry_key=chunk["retry_key"]
+        )
+    except Exception as e:
+        log_exception(e, context="教室告知の送信")
+        _mark_failed("fanout_chunks", chunk, str(e))
+        return 0
+    if not result.ok:
+        _mark_failed("fanout_chunks", chunk, result.error, permanent=not result.retryable)
+        return 0
+    _db().execute("UPDATE fanout_chunks SET sent_at = ?, lease_until = 0 WHERE id = ?", (time.time(), chunk["id"]))
+    return len(recipients)
+
+def _worker_loop():
+    log_info("教室告知を起動しました: %s", fanout_status(), context="教室告知")
+    while True:
+        _wakeup.clear()
+        try:
+            while plan_once():
+                pass
+            while send_once():
+                pass
+        except Exception as e:
+            log_exception(e, context="教室告知")
+        _wakeup.wait(FANOUT_INTERVAL)
+
+def start_fanout_worker():
+    """告知スレッドを（プロセスにつき1本）起動する。起動時に送信途中のジョブも再開される。"""
+    global _worker_thread
+    if not FANOUT_ENABLED:
+        return
+    with _worker_lock:
+        if _worker_thread is not None and _worker_thread.is_alive():
+            return
+        _worker_thread = threading.Thread(target=_worker_loop, name="classroom-fanout", daemon=True)
+        _worker_thread.start()
@@ -0,0 +1,46 @@
+# utils/lazy_import.py
+import importlib
+import threading
+import time
+from typing import Dict
+
+# 起動を速くするため、重いライブラリ（gspread・oauth2client・numpy・requests）は
+# 最初に使われたとき（またはバックグラウンドの事前読み込み）で import する。
+
+_import_times: Dict[str, float] = {}
+_lock = threading.Lock()
+
+class LazyModule:
+    """属性に初めて触れたときに import するモジュールの代理。"""
+
+    def __init__(self, name: str):
+        self._name = name
+        self._module = None
+
+    def _load(self):
+        if self._module is None:
+            started = time.perf_counter()
+            module = importlib.import_module(self._name)  # 同時に呼ばれても import ロックで 1 回だけ実行される
+            with _lock:
+                _import_times.setdefault(self._name, time.perf_counter() - started)
+            self._module = module
+        return self._module
+
+    def __getattr__(self, attr):
+        return getattr(self._load(), attr)
+
+    def __repr__(self):
+        state = "loaded" if self._module is not None else "not loaded"
+        return f"<lazy module {self._name!r} ({state})>"
+
+def lazy_module(name: str) -> LazyModule:
+    return LazyModule(name)
+
+def preload(module: LazyModule):
+    """バックグラウンドで先に import しておく。"""
+    module._load()
+
+def import_times() -> Dict[str, float]:
+    """遅延 import にかかった秒数（モジュール名ごと）。"""
+    with _lock:
+        return dict(_import_times)
@@ -1,6 +1,7 @@
 # utils/liff.py
 import os
 from dotenv import load_dotenv
+from utils.logging_util import log_error
 
 load_dotenv()
 
@@ -11,5 +12,5 @@ def get_liff_id(page_type: str) -> str:
     key = f"LIFF_ID_{page_type.lower()}"
     value = os.getenv(key)
     if not value:
-        print(f"⚠️ 環境変数 {key} が設定されていません。LIFF IDが取得できません。")
+        log_error("環境変数 %s が設定されていません。LIFF IDが取得できません。", key, context="LIFF")
     return value or ""
\ No newline at end of file
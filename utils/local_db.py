@@ -0,0 +1,43 @@
+# utils/local_db.py
+import os
+import sqlite3
+import threading
+
+# ローカル永続化用の SQLite ファイル（書き込みキューなどで共有）
+LOCAL_DB_PATH = os.getenv("LOCAL_DB_PATH", "acro_match.db")
+
+_local = threading.local()
+
+def get_connection(path: str = None) -> sqlite3.Connection:
+    """
+    スレッドごとの SQLite 接続を返す。
+    WAL + synchronous=FULL でコミット時に fsync し、複数ワーカーからの同時書き込みは busy_timeout で待つ。
+    """
+    path = path or LOCAL_DB_PATH
+    connections = getattr(_local, "connections", None)
+    if connections is None:
+        connections = _local.connections = {}
+    conn = connections.get(path)
+    if conn is None:
+        conn = sqlite3.connect(path, timeout=10, isolation_level=None, check_same_thread=False)
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=FULL")
+        conn.execute("PRAGMA busy_timeout=10000")
+        connections[path] = conn
+    return conn
+
+def ensure_column(conn: sqlite3.Connection, table: str, column: str, definition: str) -> bool:
+    """
+    テーブルに列がなければ追加し、追加したら True を返す（前の版で作られた DB ファイル向け）。
+    複数ワーカーが同時に追加しようとした場合は、後のほうは何もしない。
+    """
+    if any(r[1] == column for r in conn.execute(f"PRAGMA table_info({table})")):
+        return False
+    try:
+        conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+    except sqlite3.OperationalError as e:
+        if "duplicate column" not in str(e):
+            raise
+        return False
+    return True
@@ -1,32 +1,165 @@
+import os
+import json
+import atexit
+import time
+import queue
+import random
 import logging
-import traceback
+import logging.handlers
+import threading
 
 # ロガーの設定
+# リクエスト処理のスレッドではレコードをキューへ積むだけにし、
+# 整形（JSON 化）と標準出力への書き込みはバックグラウンドのリスナースレッドで行う。
 logger = logging.getLogger("acro_match")
 logger.setLevel(logging.DEBUG)  # ログレベルを設定（DEBUG, INFO, WARNING, ERROR, CRITICAL）
+logger.propagate = False
 
-# コンソールハンドラーを追加
-console_handler = logging.StreamHandler()
-console_handler.setLevel(logging.DEBUG)
+LOG_FORMAT = os.getenv("LOG_FORMAT", "json")                      # "json" または "text"
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", 10000))          # 溢れた分は捨てて件数だけ数える
+LOG_MAX_FIELD_CHARS = int(os.getenv("LOG_MAX_FIELD_CHARS", 1000))  # メッセージ・ペイロードの最大文字数
 
-# ログのフォーマットを設定
-formatter = logging.Formatter(
-    "%(asctime)s - %(name)s - %(levelname)s - %(message)s"
-)
-console_handler.setFormatter(formatter)
+def _parse_sample_rates(value: str) -> dict:
+    """"LINE Callback=0.1,教室募集一覧=0.5" 形式の文字列を {context: rate} にする。"""
+    rates = {}
+    for item in filter(None, (v.strip() for v in value.split(","))):
+        context, _, rate = item.rpartition("=")
+        try:
+            rates[context.strip()] = min(max(float(rate), 0.0), 1.0)
+        except ValueError:
+            pass
+    return rates
 
-# ロガーにハンドラーを追加
-logger.addHandler(console_handler)
+# context ごとの info ログの採用率（警告・エラーは常に出す）
+_sample_rates = _parse_sample_rates(os.getenv("LOG_SAMPLE_RATES", ""))
+_dropped = 0
 
-def log_exception(e: Exception, context: str = ""):
-    """エラーログを整形して出力するユーティリティ関数"""
-    logger.error(f"❌ {context} エラー: {e}")
-    logger.error(traceback.format_exc())
+def set_sample_rate(context: str, rate: float):
+    _sample_rates[context] = min(max(rate, 0.0), 1.0)
 
-def log_info(message: str, context: str = ""):
-    """情報ログを出力するユーティリティ関数"""
-    logger.info(f"ℹ️ {context}: {message}")
+def _truncate(text: str) -> str:
+    if len(text) <= LOG_MAX_FIELD_CHARS:
+        return text
+    return f"{text[:LOG_MAX_FIELD_CHARS]}…(+{len(text) - LOG_MAX_FIELD_CHARS} chars)"
 
-def log_error(message: str, context: str = ""):
+class JsonFormatter(logging.Formatter):
+    """1 レコード 1 行の JSON。メッセージの組み立てもここ（リスナースレッド）で行う。"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(record.created)) + f".{int(record.msecs):03d}",
+            "level": record.levelname,
+            "logger": record.name,
+            "context": getattr(record, "context", ""),
+            "msg": _truncate(record.getMessage()),
+            "thread": record.threadName,
+        }
+        payload = getattr(record, "payload", None)
+        if payload is not None:
+            try:
+                entry["payload"] = _truncate(json.dumps(payload, ensure_ascii=False, default=str))
+            except Exception:
+                entry["payload"] = _truncate(repr(payload))
+        if record.exc_text:
+            entry["exc"] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False)
+
+class TextFormatter(logging.Formatter):
+    """従来どおりの 1 行テキスト（ローカルで読む用）。"""
+
+    def __init__(self):
+        super().__init__("%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+
+    def format(self, record: logging.LogRecord) -> str:
+        text = super().format(record)
+        payload = getattr(record, "payload", None)
+        if payload is not None:
+            text += f" | {_truncate(repr(payload))}"
+        return text
+
+class _NonBlockingQueueHandler(logging.handlers.QueueHandler):
+    """
+    メッセージの整形はせず、レコードをそのままキューへ積む（整形はリスナー側）。
+    例外の traceback だけは呼び出し元のフレームが生きているうちに文字列にしておく。
+    キューが満杯なら待たずに捨てる。
+    """
+
+    def __init__(self, q):
+        super().__init__(q)
+        self._pid = None
+        self._listener = None
+        self._start_lock = threading.Lock()
+
+    def _ensure_listener(self):
+        # gunicorn が fork した後はリスナースレッドが無いので、プロセスごとに起動し直す
+        if self._pid == os.getpid():
+            return
+        with self._start_lock:
+            if self._pid == os.getpid():
+                return
+            self._listener = logging.handlers.QueueListener(self.queue, _stream_handler, respect_handler_level=True)
+            self._listener.start()
+            self._pid = os.getpid()
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        global _dropped
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            _dropped += 1
+
+    def emit(self, record: logging.LogRecord):
+        self._ensure_listener()
+        super().emit(record)
+
+    def stop(self):
+        if self._listener is not None and self._pid == os.getpid():
+            self._listener.stop()
+            self._pid = None
+
+# コンソールハンドラー（リスナースレッドから書き込む）
+_stream_handler = logging.StreamHandler()
+_stream_handler.setLevel(logging.DEBUG)
+_stream_handler.setFormatter(JsonFormatter() if LOG_FORMAT == "json" else TextFormatter())
+
+# ロガーにはキューハンドラーだけを付ける
+_queue_handler = _NonBlockingQueueHandler(queue.Queue(maxsize=LOG_QUEUE_SIZE))
+logger.addHandler(_queue_handler)
+
+def flush_logs():
+    """キューに残っているログを書き出す（終了時・テスト用）。"""
+    _queue_handler.stop()
+
+atexit.register(flush_logs)
+
+def log_stats() -> dict:
+    return {"queued": _queue_handler.queue.qsize(), "dropped": _dropped}
+
+def _sampled_out(context: str) -> bool:
+    rate = _sample_rates.get(context)
+    return rate is not None and random.random() >= rate
+
+def log_exception(e: Exception, context: str = "", payload=None):
+    """エラーログを traceback つきで出力するユーティリティ関数"""
+    logger.error("%s エラー: %s", context, e, exc_info=(type(e), e, e.__traceback__),
+                 extra={"context": context, "payload": payload})
+
+def log_info(message: str, *args, context: str = "", payload=None):
+    """
+    情報ログを出力するユーティリティ関数。
+    message は % 形式で、args との組み立てはログを書き出すときまで遅らせる。
+    payload（dict など）は JSON の別フィールドとして LOG_MAX_FIELD_CHARS まで出す。
+    """
+    if not logger.isEnabledFor(logging.INFO) or _sampled_out(context):
+        return
+    logger.info(message, *args, extra={"context": context, "payload": payload})
+
+def log_error(message: str, *args, context: str = "", payload=None):
     """警告ログを出力するユーティリティ関数"""
-    logger.warning(f"⚠️ {context}: {message}")
\ No newline at end of file
+    logger.warning(message, *args, extra={"context": context, "payload": payload})
@@ -0,0 +1,243 @@
+# utils/matching.py
+from __future__ import annotations
+import os
+import re
+import threading
+import time
+from datetime import date
+from typing import Dict, List, Optional, Tuple
+from utils.lazy_import import lazy_module
+from utils.storage import get_storage, REGISTRATION_SHEET_NAME, CLASSROOM_SHEET_NAME
+from utils.data_version import current_version
+from utils.classroom_index import normalize, split_multi, parse_date, assign_classroom_ids
+
+np = lazy_module("numpy")  # 起動を速くするため、最初にスコアを計算するときに読み込む
+
+# 講師（アルバイト登録シート）と教室（教室登録シート）の相性スコア。
+# 両者を NumPy の特徴量行列にし、全組み合わせを行列積でまとめて計算する。
+
+# 講師行の列位置
+ALB_NAME, ALB_EXPERIENCE, ALB_HANDSLEVEL, ALB_AREA, ALB_AVAILABLE = 0, 2, 3, 4, 5
+# 教室行の列位置
+CLS_NAME, CLS_LOCATION, CLS_DATE, CLS_EXPERIENCE, CLS_HANDSLEVEL = 0, 1, 2, 3, 4
+
+# スコアの重み（合計 1.0）
+WEIGHT_EXPERIENCE = 0.4
+WEIGHT_HANDSLEVEL = 0.3
+WEIGHT_AREA = 0.2
+WEIGHT_DAY = 0.1
+
+MATCHING_TTL = int(os.getenv("MATCHING_TTL", 300))  # 秒。シートの直接編集を拾うための上限
+
+_WEEKDAYS = "月火水木金土日"
+_AREA_SPLIT = re.compile(r"[,、/／・\s]+")
+
+def _cell(row: list, i: int) -> str:
+    return row[i] if i < len(row) else ""
+
+def area_tokens(value) -> List[str]:
+    """希望エリア・場所を語に分ける（"渋谷・新宿" → ["渋谷", "新宿"]）。"""
+    return [t for t in _AREA_SPLIT.split(normalize(value)) if t]
+
+def available_weekdays(value) -> np.ndarray:
+    """稼働可能日の自由記述を曜日ベクトル（月〜日）にする。読み取れなければ全曜日可とみなす。"""
+    text = normalize(value)
+    days = np.zeros(7, dtype=np.float32)
+    if any(w in text for w in ("毎日", "いつでも", "全日")):
+        days[:] = 1
+    if "平日" in text:
+        days[:5] = 1
+    if "土日" in text or "週末" in text:
+        days[5:] = 1
+    for i, ch in enumerate(_WEEKDAYS):
+        if ch in text:
+            days[i] = 1
+    if not days.any():
+        days[:] = 1
+    return days
+
+def classroom_weekday(value) -> np.ndarray:
+    """開催日を曜日の one-hot にする。日付が読めなければ全曜日とする。"""
+    days = np.zeros(7, dtype=np.float32)
+    d = parse_date(value)
+    if d:
+        try:
+            days[date.fromisoformat(d).weekday()] = 1
+            return days
+        except ValueError:
+            pass
+    days[:] = 1
+    return days
+
+def _multi_hot(values_per_row: List[List[str]], vocab: Dict[str, int]) -> np.ndarray:
+    m = np.zeros((len(values_per_row), len(vocab)), dtype=np.float32)
+    for i, values in enumerate(values_per_row):
+        for v in values:
+            j = vocab.get(v)
+            if j is not None:
+                m[i, j] = 1
+    return m
+
+def _vocab(*groups: List[List[str]]) -> Dict[str, int]:
+    vocab: Dict[str, int] = {}
+    for group in groups:
+        for values in group:
+            for v in values:
+                vocab.setdefault(v, len(vocab))
+    return vocab
+
+class _ClassroomFeatures:
+    """教室側の特徴量（行方向にスライスできる）。"""
+
+    def __init__(self, exp, hands, area, days, exp_count, hands_count, area_empty):
+        self.exp, self.hands, self.area, self.days = exp, hands, area, days
+        # 教室側の希望数で割って「満たしている割合」にする（希望なしは満点扱い）
+        self.exp_count, self.hands_count = exp_count, hands_count
+        self.area_empty = area_empty
+
+    def __getitem__(self, s):
+        return _ClassroomFeatures(self.exp[s], self.hands[s], self.area[s], self.days[s],
+                                  self.exp_count[s], self.hands_count[s], self.area_empty[s])
+
+class MatchingEngine:
+    """
+    講師と教室の特徴量行列。
+      経験・補助レベル: 複数選択の multi-hot（教室側の希望のうち講師が満たす割合）
+      エリア: 希望エリアと場所の語の multi-hot（1語でも重なれば一致）
+      曜日: 稼働可能日と開催日の曜日ベクトル（重なれば一致）
+    """
+
+    def __init__(self, registration_rows: List[list], classroom_rows: List[list]):
+        # 同じ講師が複数回登録した場合は最後の登録を使う
+        latest: Dict[str, list] = {}
+        for row in registration_rows:
+            if row and row[-1]:
+                latest[row[-1]] = row
+        self.instructor_ids: List[str] = list(latest)
+        self.instructors: List[list] = list(latest.values())
+        self.classrooms: List[list] = classroom_rows
+        self.classroom_ids: List[str] = assign_classroom_ids(classroom_rows)
+        self._instructor_pos = {u: i for i, u in enumerate(self.instructor_ids)}
+        self._classroom_pos = {c: i for i, c in enumerate(self.classroom_ids)}
+
+        i_exp = [split_multi(_cell(r, ALB_EXPERIENCE)) for r in self.instructors]
+        c_exp = [split_multi(_cell(r, CLS_EXPERIENCE)) for r in self.classrooms]
+        i_hands = [split_multi(_cell(r, ALB_HANDSLEVEL)) for r in self.instructors]
+        c_hands = [split_multi(_cell(r, CLS_HANDSLEVEL)) for r in self.classrooms]
+        i_area = [area_tokens(_cell(r, ALB_AREA)) for r in self.instructors]
+        c_area = [area_tokens(_cell(r, CLS_LOCATION)) for r in self.classrooms]
+
+        self._exp_vocab, self._hands_vocab = _vocab(i_exp, c_exp), _vocab(i_hands, c_hands)
+        self._area_vocab = _vocab(i_area, c_area)
+        self.i_exp = _multi_hot(i_exp, self._exp_vocab)
+        self.i_hands = _multi_hot(i_hands, self._hands_vocab)
+        self.i_area = _multi_hot(i_area, self._area_vocab)
+        self.i_days = np.stack([available_weekdays(_cell(r, ALB_AVAILABLE)) for r in self.instructors]) \
+            if self.instructors else np.zeros((0, 7), dtype=np.float32)
+        # エリアが書かれていない側があれば判定不能として半分の点を与える
+        self._i_area_empty = self.i_area.sum(axis=1) == 0
+        self.c = self._classroom_features(self.classrooms, c_exp, c_hands, c_area)
+
+    def _classroom_features(self, rows: List[list], exp=None, hands=None, area=None) -> _ClassroomFeatures:
+        """教室行の特徴量を作る。語彙にない値は一致しない希望として数える。"""
+        exp = exp if exp is not None else [split_multi(_cell(r, CLS_EXPERIENCE)) for r in rows]
+        hands = hands if hands is not None else [split_multi(_cell(r, CLS_HANDSLEVEL)) for r in rows]
+        area = area if area is not None else [area_tokens(_cell(r, CLS_LOCATION)) for r in rows]
+        days = np.stack([classroom_weekday(_cell(r, CLS_DATE)) for r in rows]) \
+            if rows else np.zeros((0, 7), dtype=np.float32)
+        return _ClassroomFeatures(
+            _multi_hot(exp, self._exp_vocab), _multi_hot(hands, self._hands_vocab),
+            _multi_hot(area, self._area_vocab), days,
+            np.array([len(set(v)) for v in exp], dtype=np.float32),
+            np.array([len(set(v)) for v in hands], dtype=np.float32),
+            np.array([not v for v in area], dtype=bool),
+        )
+
+    def instructor(self, user_id: str) -> Optional[list]:
+        pos = self._instructor_pos.get(user_id)
+        return None if pos is None else self.instructors[pos]
+
+    def classroom(self, classroom_id: str) -> Optional[list]:
+        pos = self._classroom_pos.get(classroom_id)
+        return None if pos is None else self.classrooms[pos]
+
+    def score(self, i_slice=slice(None), c_slice=slice(None)) -> np.ndarray:
+        """講師 × 教室のスコア行列（0〜1）を返す。スライスで部分行列だけを計算できる。"""
+        return self._score(i_slice, self.c[c_slice])
+
+    def _score(self, i_slice, c: _ClassroomFeatures) -> np.ndarray:
+        exp = (self.i_exp[i_slice] @ c.exp.T) / np.maximum(c.exp_count, 1)
+        exp = np.where(c.exp_count == 0, 1.0, exp)
+        hands = (self.i_hands[i_slice] @ c.hands.T) / np.maximum(c.hands_count, 1)
+        hands = np.where(c.hands_count == 0, 1.0, hands)
+        area = ((self.i_area[i_slice] @ c.area.T) > 0).astype(np.float32)
+        unknown = self._i_area_empty[i_slice][:, None] | c.area_empty[None, :]
+        area = np.where(unknown, 0.5, area)
+        day = ((self.i_days[i_slice] @ c.days.T) > 0).astype(np.float32)
+        return (WEIGHT_EXPERIENCE * exp + WEIGHT_HANDSLEVEL * hands
+                + WEIGHT_AREA * area + WEIGHT_DAY * day).astype(np.float32)
+
+    def instructors_for_row(self, classroom_row: list, min_score: float) -> List[Tuple[str, float]]:
+        """
+        まだ登録シートに反映されていない教室行について、スコアが min_score 以上の講師を
+        スコア順に返す。
+        """
+        scores = self._score(slice(None), self._classroom_features([classroom_row]))[:, 0]
+        hits = np.nonzero(scores >= min_score)[0]
+        hits = hits[np.argsort(-scores[hits], kind="stable")]
+        return [(self.instructor_ids[i], float(scores[i])) for i in hits]
+
+    @staticmethod
+    def _top_k(scores: np.ndarray, k: int) -> np.ndarray:
+        k = min(k, scores.shape[0])
+        if k <= 0:
+            return np.zeros(0, dtype=np.int64)
+        top = np.argpartition(-scores, k - 1)[:k]
+        return top[np.argsort(-scores[top], kind="stable")]
+
+    def candidates_for_classroom(self, classroom_id: str, k: int = 10) -> Optional[List[Tuple[str, float]]]:
+        """教室に合う講師の上位 k 件を (user_id, score) で返す。教室がなければ None。"""
+        pos = self._classroom_pos.get(classroom_id)
+        if pos is None:
+            return None
+        scores = self.score(c_slice=slice(pos, pos + 1))[:, 0]
+        return [(self.instructor_ids[i], float(scores[i])) for i in self._top_k(scores, k)]
+
+    def recommendations_for_instructor(self, user_id: str, k: int = 10) -> Optional[List[Tuple[str, float]]]:
+        """講師に合う教室の上位 k 件を (classroom_id, score) で返す。講師が未登録なら None。"""
+        pos = self._instructor_pos.get(user_id)
+        if pos is None:
+            return None
+        scores = self.score(i_slice=slice(pos, pos + 1))[0]
+        return [(self.classroom_ids[j], float(scores[j])) for j in self._top_k(scores, k)]
+
+    def top_k_all(self, k: int = 10, block: int = 1024) -> Dict[str, List[Tuple[str, float]]]:
+        """全教室について上位 k 人の講師を返す。メモリを抑えるため教室をブロックごとに計算する。"""
+        result: Dict[str, List[Tuple[str, float]]] = {}
+        for start in range(0, len(self.classroom_ids), block):
+            scores = self.score(c_slice=slice(start, start + block))
+            for offset in range(scores.shape[1]):
+                column = scores[:, offset]
+                result[self.classroom_ids[start + offset]] = [
+                    (self.instructor_ids[i], float(column[i])) for i in self._top_k(column, k)
+                ]
+        return result
+
+_engine: Optional[MatchingEngine] = None
+_engine_key = None
+_engine_lock = threading.Lock()
+
+def get_matching_engine() -> MatchingEngine:
+    """講師・教室データの更新番号が変わるか TTL を過ぎたときだけ特徴量行列を作り直す。"""
+    global _engine, _engine_key
+    key = (current_version(REGISTRATION_SHEET_NAME), current_version(CLASSROOM_SHEET_NAME))
+    with _engine_lock:
+        if _engine is not None and _engine_key[0] == key and time.monotonic() - _engine_key[1] < MATCHING_TTL:
+            return _engine
+    storage = get_storage()
+    _, registrations = storage.list_registrations()
+    _, classrooms = storage.list_classrooms()
+    engine = MatchingEngine(registrations, classrooms)
+    with _engine_lock:
+        _engine, _engine_key = engine, (key, time.monotonic())
+    return engine
@@ -0,0 +1,285 @@
+# utils/metrics.py
+import os
+import json
+import time
+import bisect
+import threading
+from typing import Dict, List, Sequence, Tuple
+from utils.local_db import get_connection
+from utils.logging_util import log_exception
+
+# Prometheus 形式のメトリクス。
+# 記録はプロセス内のメモリだけで行い、フラッシャースレッドが数秒ごとにローカル SQLite へ書き出す。
+# /metrics では全プロセス（gunicorn の各ワーカー）の値を SQLite から合算して返す。
+# 各プロセスは自分の累計値を上書きするだけなので、合算しても二重に数えない。
+
+METRICS_FLUSH_INTERVAL = float(os.getenv("METRICS_FLUSH_INTERVAL", 5))  # 秒
+METRICS_RETIRE_AFTER = 600  # 秒。これだけ更新のないプロセスの値は "retired" にまとめる
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS metrics (
+    process TEXT NOT NULL,
+    name TEXT NOT NULL,
+    labels TEXT NOT NULL,
+    value_json TEXT NOT NULL,
+    updated_at REAL NOT NULL,
+    PRIMARY KEY (process, name, labels)
+);
+"""
+
+_RETIRED = "retired"
+
+_lock = threading.Lock()
+_registry: Dict[str, "_Metric"] = {}
+_values: Dict[Tuple[str, str], List[float]] = {}  # (name, labels_json) → 値
+_dirty = set()
+_process = None       # このプロセスのキー（pid と起動時刻）
+_process_pid = None
+_schema_ready = False
+
+def _db():
+    global _schema_ready
+    conn = get_connection()
+    if not _schema_ready:
+        conn.executescript(_SCHEMA)
+        _schema_ready = True
+    return conn
+
+def _ensure_process():
+    """fork 後の子プロセスでは親の値を引き継がず、別のキーで数え直してフラッシャーを起動する。"""
+    global _process, _process_pid
+    pid = os.getpid()
+    if _process_pid == pid:
+        return
+    with _lock:
+        if _process_pid == pid:
+            return
+        _values.clear()
+        _dirty.clear()
+        _process = f"{pid}-{int(time.time() * 1000)}"
+        _process_pid = pid
+    threading.Thread(target=_flusher_loop, name="metrics-flusher", daemon=True).start()
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, help_text: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.help_text = help_text
+        self.labelnames = tuple(labelnames)
+        _registry[name] = self
+
+    def _key(self, labels: dict) -> str:
+        return json.dumps([str(labels.get(n, "")) for n in self.labelnames], ensure_ascii=False)
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount: float = 1.0, **labels):
+        _ensure_process()
+        key = (self.name, self._key(labels))
+        with _lock:
+            value = _values.get(key)
+            if value is None:
+                value = _values[key] = [0.0]
+            value[0] += amount
+            _dirty.add(key)
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help_text: str, labelnames: Sequence[str] = (), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help_text, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, amount: float, **labels):
+        _ensure_process()
+        key = (self.name, self._key(labels))
+        index = bisect.bisect_left(self.buckets, amount)
+        with _lock:
+            value = _values.get(key)
+            if value is None:
+                # バケットごとの件数（累積しない）、+Inf、合計、件数
+                value = _values[key] = [0.0] * (len(self.buckets) + 3)
+            value[index] += 1
+            value[-2] += amount
+            value[-1] += 1
+            _dirty.add(key)
+
+    def time(self, **labels):
+        return _Timer(self, labels)
+
+class _Timer:
+    def __init__(self, histogram: Histogram, labels: dict):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.start, **self.labels)
+        return False
+
+# ---- アプリのメトリクス ----
+
+HTTP_REQUESTS = Counter("acro_http_requests_total", "HTTP requests", ["method", "endpoint", "status"])
+HTTP_LATENCY = Histogram("acro_http_request_duration_seconds", "HTTP request latency", ["method", "endpoint"])
+SHEETS_CALLS = Counter("acro_sheets_calls_total", "Google Sheets API calls", ["sheet", "method", "outcome"])
+SHEETS_LATENCY = Histogram("acro_sheets_call_duration_seconds", "Google Sheets API call latency", ["sheet", "method"])
+SHEETS_THROTTLED = Counter("acro_sheets_throttled_total", "Sheets calls delayed by the quota limiter", ["bucket", "reason"])
+SHEETS_ROWS = Counter("acro_sheets_rows_total", "Rows read or written through the Sheets API", ["sheet", "method"])
+LINE_REQUESTS = Counter("acro_line_requests_total", "LINE Messaging API requests", ["api", "status"])
+LINE_LATENCY = Histogram("acro_line_request_duration_seconds", "LINE Messaging API request latency", ["api"])
+LINE_RECIPIENTS = Counter("acro_line_recipients_total", "Recipients addressed through the LINE API", ["api"])
+
+def init_app(app):
+    """全リクエストの件数と処理時間を endpoint 単位で記録する。"""
+    from flask import g, request
+
+    @app.before_request
+    def _metrics_start():
+        g._metrics_start = time.perf_counter()
+
+    @app.after_request
+    def _metrics_record(response):
+        start = g.pop("_metrics_start", None)
+        if start is not None:
+            endpoint = request.endpoint or "unmatched"
+            HTTP_LATENCY.observe(time.perf_counter() - start, method=request.method, endpoint=endpoint)
+            HTTP_REQUESTS.inc(method=request.method, endpoint=endpoint, status=response.status_code)
+        return response
+
+def payload_rows(method: str, args: tuple, result) -> int:
+    """Sheets 呼び出しで読み書きした行数の目安。"""
+    if method in ("append_rows", "batch_update", "update") and args and isinstance(args[0], list):
+        return len(args[0])
+    if method in ("append_row", "update_cell", "row_values"):
+        return 1
+    if isinstance(result, list):
+        return len(result)
+    return 0
+
+# ---- SQLite への書き出しと合算 ----
+
+def flush() -> int:
+    """このプロセスの更新された値を SQLite へ書き出し、書いた件数を返す。"""
+    _ensure_process()
+    with _lock:
+        rows = [(name, labels, json.dumps(_values[(name, labels)])) for name, labels in _dirty]
+        _dirty.clear()
+        process = _process
+    now = time.time()
+    conn = _db()
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        conn.executemany(
+            "INSERT INTO metrics (process, name, labels, value_json, updated_at) VALUES (?, ?, ?, ?, ?) "
+            "ON CONFLICT(process, name, labels) DO UPDATE SET value_json = excluded.value_json, "
+            "updated_at = excluded.updated_at",
+            [(process, name, labels, value, now) for name, labels, value in rows],
+        )
+        # 生存確認を兼ねて自分の行の更新時刻を進める
+        conn.execute("UPDATE metrics SET updated_at = ? WHERE process = ?", (now, process))
+        _retire_stale(conn, process, now)
+        conn.execute("COMMIT")
+    except Exception:
+        conn.execute("ROLLBACK")
+        with _lock:
+            _dirty.update((name, labels) for name, labels, _ in rows)
+        raise
+    return len(rows)
+
+def _retire_stale(conn, process: str, now: float):
+    """終了したプロセスの値を "retired" 行へ足し込んで消す（カウンターが減らないように）。"""
+    stale = conn.execute(
+        "SELECT process, name, labels, value_json FROM metrics "
+        "WHERE process NOT IN (?, ?) AND updated_at < ?",
+        (_RETIRED, process, now - METRICS_RETIRE_AFTER),
+    ).fetchall()
+    if not stale:
+        return
+    for row in stale:
+        current = conn.execute(
+            "SELECT value_json FROM metrics WHERE process = ? AND name = ? AND labels = ?",
+            (_RETIRED, row["name"], row["labels"]),
+        ).fetchone()
+        merged = _add(json.loads(current["value_json"]) if current else None, json.loads(row["value_json"]))
+        conn.execute(
+            "INSERT INTO metrics (process, name, labels, value_json, updated_at) VALUES (?, ?, ?, ?, ?) "
+            "ON CONFLICT(process, name, labels) DO UPDATE SET value_json = excluded.value_json",
+            (_RETIRED, row["name"], row["labels"], json.dumps(merged), now),
+        )
+        conn.execute(
+            "DELETE FROM metrics WHERE process = ? AND name = ? AND labels = ?",
+            (row["process"], row["name"], row["labels"]),
+        )
+
+def _add(a, b):
+    if a is None:
+        return list(b)
+    if len(a) != len(b):
+        # バケット定義が変わった古い値は捨てる
+        return list(b)
+    return [x + y for x, y in zip(a, b)]
+
+def _flusher_loop():
+    while True:
+        time.sleep(METRICS_FLUSH_INTERVAL)
+        try:
+            flush()
+        except Exception as e:
+            log_exception(e, context="メトリクス書き出し")
+
+def collect() -> Dict[Tuple[str, str], List[float]]:
+    """全プロセスの値を合算して返す。"""
+    totals: Dict[Tuple[str, str], List[float]] = {}
+    for row in _db().execute("SELECT name, labels, value_json FROM metrics"):
+        key = (row["name"], row["labels"])
+        totals[key] = _add(totals.get(key), json.loads(row["value_json"]))
+    return totals
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _labels_text(names, values, extra: str = "") -> str:
+    parts = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+def _format_number(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(value)
+
+def render(gauges: Dict[str, Tuple[str, float]] = None) -> str:
+    """Prometheus のテキスト形式にする。gauges は {name: (help, value)} の追加の値。"""
+    totals = collect()
+    by_name: Dict[str, list] = {}
+    for (name, labels), value in totals.items():
+        by_name.setdefault(name, []).append((json.loads(labels), value))
+
+    lines = []
+    for name, metric in _registry.items():
+        lines.append(f"# HELP {name} {metric.help_text}")
+        lines.append(f"# TYPE {name} {metric.kind}")
+        for label_values, value in sorted(by_name.get(name, [])):
+            if metric.kind == "counter":
+                lines.append(f"{name}{_labels_text(metric.labelnames, label_values)} {_format_number(value[0])}")
+                continue
+            if len(value) != len(metric.buckets) + 3:
+                continue
+            cumulative = 0.0
+            bounds = [repr(b) for b in metric.buckets] + ["+Inf"]
+            for bound, count in zip(bounds, value):
+                cumulative += count
+                labels_text = _labels_text(metric.labelnames, label_values, 'le="%s"' % bound)
+                lines.append(f"{name}_bucket{labels_text} {_format_number(cumulative)}")
+            lines.append(f"{name}_sum{_labels_text(metric.labelnames, label_values)} {repr(value[-2])}")
+            lines.append(f"{name}_count{_labels_text(metric.labelnames, label_values)} {_format_number(value[-1])}")
+    for name, (help_text, value) in (gauges or {}).items():
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} gauge")
+        lines.append(f"{name} {_format_number(value)}")
+    return "\n".join(lines) + "\n"
@@ -1,51 +1,178 @@
 # utils/notify.py
 
 import os
-import requests
+import time
+import uuid
+import random
+import threading
+from collections import namedtuple
+from email.utils import parsedate_to_datetime
 from dotenv import load_dotenv
-from utils.logging_util import log_exception
+from utils.logging_util import log_exception, log_error
 from typing import Tuple, Optional
-from utils.sheets import get_chat_liff_id_by_app_liff_id
+from utils.lazy_import import lazy_module
+from utils.storage import get_storage
+from utils.metrics import LINE_LATENCY, LINE_RECIPIENTS, LINE_REQUESTS
+
+requests = lazy_module("requests")
 
 load_dotenv()
 
 LINE_API_URL = "https://api.line.me/v2/bot/message/push"
-LINE_ACCESS_TOKEN = os.getenv("LINE_ACCESS_TOKEN")
+LINE_MULTICAST_URL = "https://api.line.me/v2/bot/message/multicast"
+LINE_MULTICAST_MAX_RECIPIENTS = 500  # LINE API の上限
 
-def send_line_message(user_id: str, message_text: str) -> Tuple[bool, Optional[str]]:
-    access_token = os.getenv("LINE_ACCESS_TOKEN")
-    print("🪪 LINE_ACCESS_TOKEN:", access_token is not None)
-
-    url = LINE_API_URL
-    headers = {
-        "Content-Type": "application/json",
-        "Authorization": f"Bearer {access_token}"
-    }
-    payload = {
-        "to": user_id,
-        "messages": [{"type": "text", "text": message_text}]
-    }
+LINE_CONNECT_TIMEOUT = float(os.getenv("LINE_CONNECT_TIMEOUT", 3))   # 秒
+LINE_READ_TIMEOUT = float(os.getenv("LINE_READ_TIMEOUT", 10))        # 秒
+LINE_MAX_RETRIES = int(os.getenv("LINE_MAX_RETRIES", 3))
+LINE_BACKOFF_BASE = float(os.getenv("LINE_BACKOFF_BASE", 0.5))       # 秒
+LINE_MAX_RETRY_AFTER = float(os.getenv("LINE_MAX_RETRY_AFTER", 30))  # 秒。これより長い Retry-After は呼び出し側に任せる
+LINE_MAX_CONCURRENCY = int(os.getenv("LINE_MAX_CONCURRENCY", 4))     # 同時に LINE API へ出すリクエスト数の上限
+LINE_POOL_SIZE = int(os.getenv("LINE_POOL_SIZE", 8))
+
+# ok: 送信できた / retryable: 時間をおけば成功しうる（429・5xx・通信エラー）
+LineResult = namedtuple("LineResult", ["ok", "status", "error", "retryable"])
 
+def _retry_after_seconds(value: Optional[str]) -> Optional[float]:
+    """Retry-After ヘッダー（秒数または HTTP 日付）を秒に直す。"""
+    if not value:
+        return None
     try:
-        response = requests.post(url, headers=headers, json=payload)
-        print("📨 LINE送信ステータス:", response.status_code)
-        print("📨 レスポンス内容:", response.text)
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+    try:
+        return max(parsedate_to_datetime(value).timestamp() - time.time(), 0.0)
+    except (TypeError, ValueError):
+        return None
+
+class LineClient:
+    """
+    LINE Messaging API のプッシュ送信クライアント。
+    接続プールを使い回し、429・5xx・通信エラーはバックオフして再試行する。
+    同時送信数はセマフォで制限する（待ち時間はセマフォの外で過ごす）。
+    """
+
+    def __init__(self, access_token: Optional[str]):
+        self.access_token = access_token
+        self.session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=LINE_POOL_SIZE, max_retries=0)
+        self.session.mount("https://", adapter)
+        self.session.headers.update({
+            "Content-Type": "application/json",
+            "Authorization": f"Bearer {access_token}",
+        })
+        self._slots = threading.BoundedSemaphore(LINE_MAX_CONCURRENCY)
+        self._stats_lock = threading.Lock()
+        self.stats = {"sends": 0, "success": 0, "retries": 0, "failures": 0}
+
+    def _count(self, key: str):
+        with self._stats_lock:
+            self.stats[key] += 1
+
+    def push(self, to: str, messages: list, retry_key: Optional[str] = None) -> LineResult:
+        """
+        1 宛先へメッセージを送る。
+        retry_key を保存しておけば、タイムアウトのあと再送しても LINE 側で重複が除かれる。
+        """
+        return self._post(LINE_API_URL, {"to": to, "messages": messages}, retry_key)
+
+    def multicast(self, to: list, messages: list, retry_key: Optional[str] = None) -> LineResult:
+        """
+        最大 500 宛先へ同じメッセージを送る。
+        retry_key を保存しておけば、プロセスを再起動して再送しても LINE 側で重複が除かれる。
+        """
+        if len(to) > LINE_MULTICAST_MAX_RECIPIENTS:
+            raise ValueError(f"multicast の宛先は {LINE_MULTICAST_MAX_RECIPIENTS} 件までです: {len(to)}")
+        return self._post(LINE_MULTICAST_URL, {"to": list(to), "messages": messages}, retry_key)
 
-        if response.status_code != 200:
-            return False, f"LINE送信失敗: {response.status_code} {response.text}"
+    def _post(self, url: str, payload: dict, retry_key: Optional[str] = None) -> LineResult:
+        """再試行しても同じ送信と分かるよう X-Line-Retry-Key を付けて送る。"""
+        self._count("sends")
+        headers = {"X-Line-Retry-Key": retry_key or str(uuid.uuid4())}
+        api = url.rstrip("/").rsplit("/", 1)[-1]  # "push" / "multicast"
+        recipients = payload["to"]
+        LINE_RECIPIENTS.inc(len(recipients) if isinstance(recipients, list) else 1, api=api)
+        result = None
 
-        return True, None
+        for attempt in range(LINE_MAX_RETRIES + 1):
+            wait = None
+            with self._slots:
+                started = time.perf_counter()
+                try:
+                    response = self.session.post(
+                        url, json=payload, headers=headers,
+                        timeout=(LINE_CONNECT_TIMEOUT, LINE_READ_TIMEOUT),
+                    )
+                except requests.RequestException as e:
+                    LINE_LATENCY.observe(time.perf_counter() - started, api=api)
+                    LINE_REQUESTS.inc(api=api, status="error")
+                    result = LineResult(False, None, f"LINE送信失敗: {e}", True)
+                else:
+                    status = response.status_code
+                    LINE_LATENCY.observe(time.perf_counter() - started, api=api)
+                    LINE_REQUESTS.inc(api=api, status=status)
+                    if status == 200:
+                        self._count("success")
+                        return LineResult(True, status, None, False)
+                    if status == 409 and response.headers.get("x-line-accepted-request-id"):
+                        # 同じ Retry-Key の送信が既に受け付けられている（前回の応答が届かなかった）
+                        self._count("success")
+                        return LineResult(True, status, None, False)
+                    retryable = status == 429 or status >= 500
+                    result = LineResult(False, status, f"LINE送信失敗: {status} {response.text[:200]}", retryable)
+                    if retryable:
+                        wait = _retry_after_seconds(response.headers.get("Retry-After"))
+
+            if not result.retryable or attempt == LINE_MAX_RETRIES:
+                break
+            if wait is None:
+                wait = LINE_BACKOFF_BASE * (2 ** attempt) * (1 + random.random())
+            if wait > LINE_MAX_RETRY_AFTER:
+                # 長い待ちで呼び出し元（ワーカー）を塞がない
+                break
+            self._count("retries")
+            time.sleep(wait)
+
+        self._count("failures")
+        return result
+
+_client: Optional[LineClient] = None
+_client_lock = threading.Lock()
+
+def get_line_client() -> LineClient:
+    """プロセスで共有する LineClient を返す（初回呼び出し時に作る）。"""
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = LineClient(os.getenv("LINE_ACCESS_TOKEN"))
+    return _client
+
+def get_line_stats() -> dict:
+    if _client is None:
+        return {"sends": 0, "success": 0, "retries": 0, "failures": 0}
+    with _client._stats_lock:
+        return dict(_client.stats)
+
+def send_line_message(user_id: str, message_text: str) -> Tuple[bool, Optional[str]]:
+    try:
+        result = get_line_client().push(user_id, [{"type": "text", "text": message_text}])
+        if not result.ok:
+            log_error("%s", result.error, context="send_line_message")
+        return result.ok, result.error
 
     except Exception as e:
         log_exception(e, context="send_line_message 内で例外")
         return False, str(e)
 
 def notify_interested_classroom(app_liff_id: str, classroom_name: str):
-    chat_liff_id = get_chat_liff_id_by_app_liff_id(app_liff_id)
+    user = get_storage().find_user_by_app_liff_id(app_liff_id)
+    chat_liff_id = user.get("チャット LIFF ID") if user else None
     if chat_liff_id:
         msg = f"あなたの教室「{classroom_name}」に興味を持っている人がいます！"
         success, error = send_line_message(chat_liff_id, msg)
         if not success:
-            print("❌ 通知失敗:", error)
+            log_error("%s", error, context="通知失敗")
     else:
-        print("⚠️ チャットIDが見つかりませんでした")
+        log_error("チャットIDが見つかりませんでした", context="通知")
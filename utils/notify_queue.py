@@ -0,0 +1,152 @@
+# utils/notify_queue.py
+import os
+import time
+import uuid
+import threading
+from typing import List, Optional
+from utils import outbox
+from utils.local_db import get_connection, ensure_column
+from utils.notify import get_line_client
+from utils.logging_util import log_exception, log_info, log_error
+
+# LINE のプッシュ通知をローカルのキューに積んですぐ応答し、
+# バックグラウンドで送る（LINE API が遅い／落ちていても通知を失わない）
+NOTIFY_QUEUE_BATCH_SIZE = int(os.getenv("NOTIFY_QUEUE_BATCH_SIZE", 20))
+NOTIFY_QUEUE_INTERVAL = float(os.getenv("NOTIFY_QUEUE_INTERVAL", 2))       # 秒
+NOTIFY_QUEUE_MAX_ATTEMPTS = int(os.getenv("NOTIFY_QUEUE_MAX_ATTEMPTS", 8))
+NOTIFY_QUEUE_LEASE = 120  # 秒。取り出した通知をこの間は他ワーカーが送らない
+NOTIFY_QUEUE_DEAD_TTL = int(os.getenv("NOTIFY_QUEUE_DEAD_TTL", 14 * 24 * 3600))  # 秒。断念した通知を残す期間
+NOTIFY_QUEUE_DEAD_MAX = int(os.getenv("NOTIFY_QUEUE_DEAD_MAX", 10000))           # 断念した通知を残す最大件数
+_PRUNE_INTERVAL = 3600  # 秒。この間隔で断念した古い通知を消す
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS line_push_queue (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    to_id TEXT NOT NULL,
+    message TEXT NOT NULL,
+    retry_key TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    next_attempt_at REAL NOT NULL DEFAULT 0,
+    lease_until REAL NOT NULL DEFAULT 0,
+    last_error TEXT,
+    dead INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS idx_line_push_queue_ready ON line_push_queue (dead, next_attempt_at, id);
+"""
+
+_schema_ready = False
+_wakeup = threading.Event()
+_sender_lock = threading.Lock()
+_sender_thread = None
+_last_prune = 0.0
+
+def _db():
+    global _schema_ready
+    conn = get_connection()
+    if not _schema_ready:
+        conn.executescript(_SCHEMA)
+        if ensure_column(conn, "line_push_queue", "retry_key", "TEXT NOT NULL DEFAULT ''"):
+            # 列がなかった頃に積まれた通知にも、以後の再送で変わらないキーを振る
+            conn.executemany(
+                "UPDATE line_push_queue SET retry_key = ? WHERE id = ?",
+                [(str(uuid.uuid4()), r["id"]) for r in conn.execute("SELECT id FROM line_push_queue")],
+            )
+        _schema_ready = True
+    return conn
+
+def enqueue_line_message(to_id: str, message: str) -> int:
+    """
+    通知をキューへ積んで ID を返す。送信は送信スレッドが行う。
+    X-Line-Retry-Key もここで決めて保存するので、何度再送しても LINE 側で 1 通にまとまる。
+    """
+    cur = _db().execute(
+        "INSERT INTO line_push_queue (to_id, message, retry_key, created_at) VALUES (?, ?, ?, ?)",
+        (to_id, message, str(uuid.uuid4()), time.time()),
+    )
+    _wakeup.set()
+    return cur.lastrowid
+
+def notify_queue_depth() -> dict:
+    """未送信件数と、再試行を諦めた件数を返す。"""
+    return outbox.depth(_db(), "line_push_queue")
+
+def dead_rows(limit: int = 100) -> list:
+    """再試行を諦めた通知を新しい順に返す（管理画面での確認用）。"""
+    return outbox.dead_rows(_db(), "line_push_queue", "id, to_id, message, attempts, created_at, last_error", limit)
+
+def requeue_dead(ids: Optional[List[int]] = None) -> int:
+    """
+    諦めた通知（ids を省略すると全件）を未送信に戻し、戻した件数を返す。
+    保存してある X-Line-Retry-Key で送り直すので、実は届いていた通知が重複することはない。
+    """
+    count = outbox.requeue_dead(_db(), "line_push_queue", ids)
+    if count:
+        _wakeup.set()
+    return count
+
+def purge_dead(ids: Optional[List[int]] = None) -> int:
+    """諦めた通知（ids を省略すると全件）を消して、消した件数を返す。"""
+    return outbox.purge_dead(_db(), "line_push_queue", ids)
+
+def prune_dead() -> int:
+    """期限切れの諦めた通知と、上限件数を超えた古い諦めた通知を消して、消した件数を返す。"""
+    removed = outbox.prune_dead(_db(), "line_push_queue", NOTIFY_QUEUE_DEAD_TTL, NOTIFY_QUEUE_DEAD_MAX)
+    if removed:
+        log_info("断念した通知を %d 件削除しました", removed, context="通知キュー")
+    return removed
+
+def _claim_batch(limit: int) -> list:
+    """送信対象の通知をリースして取り出す（複数ワーカーで二重送信しないため）。"""
+    return outbox.claim(
+        _db(), "line_push_queue", limit, NOTIFY_QUEUE_LEASE, columns="id, to_id, message, retry_key, attempts"
+    )
+
+def _mark_failed(row, error: str, permanent: bool = False):
+    # 400 番台（429 以外）は再送しても成功しない
+    if outbox.mark_failed(_db(), "line_push_queue", row, error, NOTIFY_QUEUE_MAX_ATTEMPTS, permanent):
+        log_error("通知の送信を断念しました (id=%s): %s", row["id"], error, context="通知キュー")
+
+def send_once(limit: int = NOTIFY_QUEUE_BATCH_SIZE) -> int:
+    """キューから取り出した通知を送り、送信できた件数を返す。"""
+    rows = _claim_batch(limit)
+    sent = 0
+    for row in rows:
+        try:
+            result = get_line_client().push(
+                row["to_id"], [{"type": "text", "text": row["message"]}], retry_key=row["retry_key"]
+            )
+        except Exception as e:
+            log_exception(e, context="通知キュー送信")
+            _mark_failed(row, str(e))
+            continue
+        if result.ok:
+            _db().execute("DELETE FROM line_push_queue WHERE id = ?", (row["id"],))
+            sent += 1
+        else:
+            _mark_failed(row, result.error, permanent=not result.retryable)
+    return sent
+
+def _sender_loop():
+    global _last_prune
+    log_info("通知キューを起動しました: %s", notify_queue_depth(), context="通知キュー")
+    while True:
+        _wakeup.clear()
+        try:
+            if time.monotonic() - _last_prune >= _PRUNE_INTERVAL:
+                _last_prune = time.monotonic()
+                prune_dead()
+            while send_once() >= NOTIFY_QUEUE_BATCH_SIZE:
+                pass
+        except Exception as e:
+            log_exception(e, context="通知キュー")
+        _wakeup.wait(NOTIFY_QUEUE_INTERVAL)
+
+def start_notifier():
+    """送信スレッドを（プロセスにつき1本）起動する。起動時に未送信分も再送される。"""
+    global _sender_thread
+    with _sender_lock:
+        if _sender_thread is not None and _sender_thread.is_alive():
+            return
+        _sender_thread = threading.Thread(target=_sender_loop, name="line-push-queue", daemon=True)
+        _sender_thread.start()
@@ -0,0 +1,98 @@
+# utils/outbox.py
+import sqlite3
+import time
+from typing import List, Optional, Tuple
+
+# ローカル SQLite に積んでバックグラウンドで送るキュー（書き込みキュー・通知キュー・教室告知）の共通処理。
+# どのテーブルも attempts / next_attempt_at / lease_until / last_error / dead の列を持つ。
+#   - 取り出した行はリースし、期限が切れるまで他ワーカーは取り出さない
+#   - 失敗した行は 2, 4, 8... 秒（最大 300 秒）待ってから再送し、上限回数で諦める（dead = 1）
+#   - 諦めた行は管理画面から再送に戻すか消せる。古いものは prune_dead で消す（created_at 列が必要）
+# テーブル名は各モジュールの定数だけを渡すこと（SQL に直接埋め込む）。
+
+MAX_BACKOFF = 300  # 秒
+
+def backoff_seconds(attempts: int) -> float:
+    return min(MAX_BACKOFF, 2 ** attempts)
+
+def claim(conn: sqlite3.Connection, table: str, limit: int, lease: float,
+          where: str = "1", columns: str = "*") -> list:
+    """送信できる行を古い順に最大 limit 件リースして返す（複数ワーカーで同じ行を送らないため）。"""
+    now = time.time()
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        rows = conn.execute(
+            f"SELECT {columns} FROM {table} WHERE {where} AND dead = 0 AND next_attempt_at <= ? AND lease_until <= ? "
+            "ORDER BY id LIMIT ?",
+            (now, now, limit),
+        ).fetchall()
+        if rows:
+            conn.executemany(
+                f"UPDATE {table} SET lease_until = ? WHERE id = ?", [(now + lease, r["id"]) for r in rows]
+            )
+        conn.execute("COMMIT")
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
+    return rows
+
+def release(conn: sqlite3.Connection, table: str, row_id: int):
+    """送らずにリースだけを返す（次の取り出しで再び対象になる）。"""
+    conn.execute(f"UPDATE {table} SET lease_until = 0 WHERE id = ?", (row_id,))
+
+def mark_failed(conn: sqlite3.Connection, table: str, row, error, max_attempts: int, permanent: bool = False) -> bool:
+    """失敗を記録してリースを返す。諦めた（dead にした）ら True。"""
+    attempts = row["attempts"] + 1
+    dead = 1 if permanent or attempts >= max_attempts else 0
+    conn.execute(
+        f"UPDATE {table} SET attempts = ?, next_attempt_at = ?, lease_until = 0, last_error = ?, dead = ? WHERE id = ?",
+        (attempts, time.time() + backoff_seconds(attempts), str(error)[:500], dead, row["id"]),
+    )
+    return bool(dead)
+
+def depth(conn: sqlite3.Connection, table: str) -> dict:
+    """未送信件数と、再試行を諦めた件数を返す。"""
+    pending, dead = conn.execute(
+        f"SELECT COALESCE(SUM(dead = 0), 0), COALESCE(SUM(dead = 1), 0) FROM {table}"
+    ).fetchone()
+    return {"pending": pending, "dead": dead}
+
+def dead_rows(conn: sqlite3.Connection, table: str, columns: str, limit: int) -> list:
+    """再試行を諦めた行を新しい順に返す。"""
+    rows = conn.execute(
+        f"SELECT {columns} FROM {table} WHERE dead = 1 ORDER BY id DESC LIMIT ?", (limit,)
+    ).fetchall()
+    return [dict(r) for r in rows]
+
+def _id_filter(ids: Optional[List[int]]) -> Tuple[str, list]:
+    if ids is None:
+        return "", []
+    return " AND id IN (%s)" % ",".join("?" * len(ids)), list(ids)
+
+def requeue_dead(conn: sqlite3.Connection, table: str, ids: Optional[List[int]] = None) -> int:
+    """諦めた行（ids を省略すると全件）を未送信に戻し、戻した件数を返す。"""
+    if ids is not None and not ids:
+        return 0
+    where, params = _id_filter(ids)
+    return conn.execute(
+        f"UPDATE {table} SET dead = 0, attempts = 0, next_attempt_at = 0, lease_until = 0 WHERE dead = 1" + where,
+        params,
+    ).rowcount
+
+def purge_dead(conn: sqlite3.Connection, table: str, ids: Optional[List[int]] = None) -> int:
+    """諦めた行（ids を省略すると全件）を消して、消した件数を返す。"""
+    if ids is not None and not ids:
+        return 0
+    where, params = _id_filter(ids)
+    return conn.execute(f"DELETE FROM {table} WHERE dead = 1" + where, params).rowcount
+
+def prune_dead(conn: sqlite3.Connection, table: str, ttl: float, max_rows: int) -> int:
+    """created_at から ttl 秒を過ぎた諦めた行と、新しい順に max_rows 件を超えた諦めた行を消す。"""
+    removed = conn.execute(
+        f"DELETE FROM {table} WHERE dead = 1 AND created_at <= ?", (time.time() - ttl,)
+    ).rowcount
+    removed += conn.execute(
+        f"DELETE FROM {table} WHERE id IN (SELECT id FROM {table} WHERE dead = 1 ORDER BY id DESC LIMIT -1 OFFSET ?)",
+        (max_rows,),
+    ).rowcount
+    return removed
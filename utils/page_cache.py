@@ -0,0 +1,156 @@
+# utils/page_cache.py
+import os
+import time
+import zlib
+import struct
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Optional, Tuple
+from flask import Response, current_app, request, session
+from flask_wtf.csrf import generate_csrf
+
+try:
+    import brotli  # 任意。入っていれば br でも返す
+except ImportError:
+    brotli = None
+
+# レンダリング済みページのキャッシュ。
+# テンプレートは CSRF トークンの位置にプレースホルダーを入れて描画しておき、
+# リクエストごとにトークンを差し込むだけで返す。
+# gzip はプレースホルダーで区切った断片ごとに圧縮済みのものを持ち、
+# トークン部分だけを圧縮してつなぎ合わせる（本文全体を毎回圧縮しない）。
+
+CSRF_PLACEHOLDER = "__ACRO_MATCH_CSRF_TOKEN__"
+PAGE_CACHE_TTL = int(os.getenv("PAGE_CACHE_TTL", 300))  # 秒。シートの直接編集を拾うための上限
+PAGE_CACHE_MAX_ENTRIES = 64
+PAGE_GZIP_LEVEL = 9
+PAGE_BROTLI_QUALITY = 5
+# 設定の版で描画し直すフォームページを、ブラウザにキャッシュさせる秒数
+FORM_PAGE_MAX_AGE = int(os.getenv("FORM_PAGE_MAX_AGE", 300))
+
+# gzip ヘッダー（更新時刻なし・OS 不明）
+_GZIP_HEADER = b"\x1f\x8b\x08\x00\x00\x00\x00\x00\x00\xff"
+
+def _deflate_segment(data: bytes, final: bool) -> bytes:
+    """
+    断片を生の deflate で圧縮する。途中の断片は Z_FULL_FLUSH でバイト境界と辞書を区切るので、
+    別々に圧縮した断片を並べても 1 本の正しい deflate ストリームになる。
+    """
+    compressor = zlib.compressobj(PAGE_GZIP_LEVEL, zlib.DEFLATED, -15)
+    return compressor.compress(data) + compressor.flush(zlib.Z_FINISH if final else zlib.Z_FULL_FLUSH)
+
+class CachedPage:
+    def __init__(self, html: str):
+        self.parts = html.split(CSRF_PLACEHOLDER)
+        self.digest = hashlib.sha256(html.encode("utf-8")).hexdigest()
+        self.created_at = time.monotonic()
+        self._encoded = [p.encode("utf-8") for p in self.parts]
+        last = len(self._encoded) - 1
+        self._deflated = [_deflate_segment(p, i == last) for i, p in enumerate(self._encoded)]
+        self._head_crc = zlib.crc32(self._encoded[0])
+
+    def body(self, token: str) -> bytes:
+        return token.encode("utf-8").join(self._encoded)
+
+    def gzip_body(self, token: str) -> bytes:
+        """トークンを差し込んだ本文の gzip。圧縮するのはトークンだけ。"""
+        token_bytes = token.encode("utf-8")
+        token_deflated = _deflate_segment(token_bytes, final=False)
+        crc = self._head_crc
+        for part in self._encoded[1:]:
+            crc = zlib.crc32(part, zlib.crc32(token_bytes, crc))
+        size = sum(len(p) for p in self._encoded) + len(token_bytes) * (len(self._encoded) - 1)
+        return b"".join((
+            _GZIP_HEADER,
+            token_deflated.join(self._deflated),
+            struct.pack("<II", crc, size & 0xFFFFFFFF),
+        ))
+
+_pages = OrderedDict()  # キー → CachedPage
+_lock = threading.Lock()
+
+def get_page(key) -> Optional[CachedPage]:
+    with _lock:
+        page = _pages.get(key)
+        if page is None:
+            return None
+        if time.monotonic() - page.created_at > PAGE_CACHE_TTL:
+            del _pages[key]
+            return None
+        _pages.move_to_end(key)
+        return page
+
+def put_page(key, html: str) -> CachedPage:
+    page = CachedPage(html)
+    with _lock:
+        _pages[key] = page
+        _pages.move_to_end(key)
+        while len(_pages) > PAGE_CACHE_MAX_ENTRIES:
+            _pages.popitem(last=False)
+    return page
+
+def clear_pages():
+    with _lock:
+        _pages.clear()
+
+def _page_csrf() -> Tuple[str, Optional[float]]:
+    """
+    セッション内で同じ署名済み CSRF トークンを使い回し、(トークン, 残りの有効秒数) を返す。
+    有効期限の半分を過ぎたら作り直すので、キャッシュされたページのトークンは常に期限内。
+    """
+    limit = current_app.config.get("WTF_CSRF_TIME_LIMIT", 3600)
+    cached = session.get("_page_csrf")
+    now = time.time()
+    if cached and (limit is None or now - cached[1] < limit / 2):
+        return cached[0], (None if limit is None else limit - (now - cached[1]))
+    token = generate_csrf()
+    session["_page_csrf"] = [token, now]
+    return token, limit
+
+def page_csrf_token() -> str:
+    return _page_csrf()[0]
+
+def _choose_encoding() -> str:
+    accept = request.accept_encodings
+    if brotli is not None and accept["br"]:
+        return "br"
+    if accept["gzip"]:
+        return "gzip"
+    return "identity"
+
+def page_response(page: CachedPage, max_age: int = 0) -> Response:
+    """
+    トークンを差し込んだページを、クライアントが受け付ける圧縮形式で返す。ETag が一致すれば 304。
+    max_age を指定すると、トークンの残り有効期間を超えない範囲でブラウザにキャッシュさせる。
+    """
+    token, token_ttl = _page_csrf()
+    encoding = _choose_encoding()
+    etag = hashlib.sha256(f"{page.digest}:{token}".encode("utf-8")).hexdigest()[:32]
+    if encoding != "identity":
+        # 表現ごとに異なる強い ETag にする
+        etag = f"{etag}-{encoding}"
+
+    if request.if_none_match.contains(etag):
+        response = Response(status=304)
+    elif encoding == "gzip":
+        response = Response(page.gzip_body(token), content_type="text/html; charset=utf-8")
+    elif encoding == "br":
+        response = Response(brotli.compress(page.body(token), quality=PAGE_BROTLI_QUALITY),
+                            content_type="text/html; charset=utf-8")
+    else:
+        response = Response(page.body(token), content_type="text/html; charset=utf-8")
+    if encoding != "identity":
+        response.headers["Content-Encoding"] = encoding
+    response.set_etag(etag)
+
+    # ページに CSRF トークンを含むので共有キャッシュには載せない
+    if token_ttl is not None:
+        max_age = min(max_age, int(token_ttl))
+    if max_age > 0:
+        response.headers["Cache-Control"] = f"private, max-age={max_age}"
+    else:
+        response.headers["Cache-Control"] = "private, no-cache"
+    response.vary.add("Cookie")
+    response.vary.add("Accept-Encoding")
+    return response
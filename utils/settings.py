@@ -1,14 +1,81 @@
 # utils/settings.py
+import hashlib
 import json
 import os
+import tempfile
+import threading
+import time
+from utils.logging_util import log_exception
 
 SETTINGS_PATH = "settings.json"
+SETTINGS_CHECK_INTERVAL = float(os.getenv("SETTINGS_CHECK_INTERVAL", 1))  # 秒。ファイルの更新を確かめる間隔
 
-def load_settings():
+# 読み込んだ設定をメモリに置き、ファイルの更新時刻かサイズが変わったときだけ読み直す
+_lock = threading.Lock()
+_settings = {}
+_stat_key = None     # (st_mtime_ns, st_size)
+_version = ""        # 読み込んだ内容のハッシュ
+_checked_at = 0.0
+
+def _stat_key_of(path: str):
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return (st.st_mtime_ns, st.st_size)
+
+def _refresh(force: bool = False):
+    global _settings, _stat_key, _version, _checked_at
+    now = time.monotonic()
+    if not force and now - _checked_at < SETTINGS_CHECK_INTERVAL:
+        return
+    with _lock:
+        _checked_at = now
+        key = _stat_key_of(SETTINGS_PATH)
+        if key == _stat_key and not force:
+            return
+        if key is None:
+            _settings, _stat_key, _version = {}, None, ""
+            return
+        try:
+            with open(SETTINGS_PATH, "rb") as f:
+                data = f.read()
+            _settings = json.loads(data.decode("utf-8"))
+            _version = hashlib.sha256(data).hexdigest()[:16]
+        except Exception as e:
+            # 読めなければ前回の設定を使い続ける（ファイルが再び変わるまで読み直さない）
+            log_exception(e, context="設定読み込み失敗")
+        _stat_key = key
+
+def load_settings() -> dict:
+    """設定を返す。全リクエストで同じ dict を共有するので、呼び出し側で書き換えないこと。"""
+    _refresh()
+    return _settings
+
+def settings_version() -> str:
+    """
+    設定の版（読み込んだ内容のハッシュ）。ファイルがなければ空文字。キャッシュのキーに使う。
+    更新時刻の粒度が粗いファイルシステムで同じ時刻に 2 回保存しても、内容が違えば版も変わる。
+    """
+    _refresh()
+    return _version
+
+def save_settings(settings: dict):
+    """一時ファイルに書いてから置き換えるので、読み込み側が書きかけのファイルを見ることはない。"""
+    directory = os.path.dirname(os.path.abspath(SETTINGS_PATH))
+    fd, tmp_path = tempfile.mkstemp(prefix=".settings.", suffix=".json", dir=directory)
     try:
-        if os.path.exists(SETTINGS_PATH):
-            with open(SETTINGS_PATH, "r", encoding="utf-8") as f:
-                return json.load(f)
-    except Exception as e:
-        print("⚠️ 設定読み込み失敗:", e)
-    return {}
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(settings, f, ensure_ascii=False, indent=2)
+            f.flush()
+            os.fsync(f.fileno())
+        try:
+            os.chmod(tmp_path, os.stat(SETTINGS_PATH).st_mode & 0o777)
+        except FileNotFoundError:
+            os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, SETTINGS_PATH)
+    except Exception:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    _refresh(force=True)
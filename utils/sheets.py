@@ -1,107 +1,251 @@
 import os
 import json
-import gspread
+import time
+import threading
 from typing import Optional
-from oauth2client.service_account import ServiceAccountCredentials
-from utils.logging_util import log_exception
+from utils.deadline import remaining
+from utils.lazy_import import lazy_module
+from utils.logging_util import log_exception, log_info, log_error
+from utils.metrics import SHEETS_CALLS, SHEETS_LATENCY, SHEETS_ROWS, SHEETS_THROTTLED, payload_rows
+from utils.sheets_quota import (
+    SHEETS_QUOTA_MAX_WAIT, SingleFlight, backoff_seconds, bucket_for, read_bucket,
+)
+
+gspread = lazy_module("gspread")
 
 SCOPES = ["https://spreadsheets.google.com/feeds", "https://www.googleapis.com/auth/drive"]
 gc = None
+_gc_lock = threading.Lock()
 
 def _init_gc():
     global gc
     if gc is not None:
         return gc
+    # 起動直後の事前読み込みとリクエストが同時に来ても認証は 1 回だけ
+    with _gc_lock:
+        if gc is not None:
+            return gc
+
+        log_info("Initializing Google Credentials", context="Google 認証")
+        cred_json = os.getenv("GOOGLE_CREDENTIALS")
+        if not cred_json:
+            raise RuntimeError("GOOGLE_CREDENTIALS not set")
 
-    print("🔐 Initializing Google Credentials")
-    cred_json = os.getenv("GOOGLE_CREDENTIALS")
-    if not cred_json:
-        raise RuntimeError("GOOGLE_CREDENTIALS not set")
+        from oauth2client.service_account import ServiceAccountCredentials
+        from utils.sheets_transport import authorize
+        credentials = ServiceAccountCredentials.from_json_keyfile_dict(json.loads(cred_json), SCOPES)
+        gc = authorize(credentials)
+        return gc
 
-    credentials = ServiceAccountCredentials.from_json_keyfile_dict(json.loads(cred_json), SCOPES)
-    gc = gspread.authorize(credentials)
-    return gc
+# 🗂 スプレッドシート／ワークシートのハンドルキャッシュ（プロセス単位）
+# open_by_key と worksheet() はどちらもメタデータ取得の往復が発生するため、
+# (spreadsheet_id, sheet_name) ごとに一度だけ解決して使い回す。
+_handle_lock = threading.Lock()
+_spreadsheet_cache = {}  # spreadsheet_id → gspread.Spreadsheet
+_worksheet_cache = {}    # (spreadsheet_id, sheet_name) → CachedWorksheet
+_handle_stats = {"hits": 0, "misses": 0, "refreshes": 0}
 
-def get_sheet(sheet_name):
+# シート名変更・削除後に古いハンドルを使うと返ってくるエラーメッセージ
+_STALE_HANDLE_MESSAGES = ("Unable to parse range", "No grid with id", "not found")
+
+def _is_stale_handle_error(e: Exception) -> bool:
+    if isinstance(e, gspread.exceptions.WorksheetNotFound):
+        return True
+    if isinstance(e, gspread.exceptions.APIError) and e.code in (400, 404):
+        message = str(e.error.get("message", ""))
+        return any(m in message for m in _STALE_HANDLE_MESSAGES)
+    return False
+
+def _resolve_worksheet(spreadsheet_id: str, sheet_name: str):
+    """キャッシュを使わずにワークシートを取得する（スプレッドシートのハンドルは再利用）。"""
     client = _init_gc()
+    deadline = _quota_deadline()
+    with _handle_lock:
+        spreadsheet = _spreadsheet_cache.get(spreadsheet_id)
+    if spreadsheet is None:
+        read_bucket.acquire(deadline)
+        spreadsheet = client.open_by_key(spreadsheet_id)
+        with _handle_lock:
+            _spreadsheet_cache[spreadsheet_id] = spreadsheet
+    read_bucket.acquire(deadline)
+    return spreadsheet.worksheet(sheet_name)
+
+def _quota_deadline() -> float:
+    """クォータ待ちの締め切り（time.time()）。リクエストの残り時間のほうが短ければそちら。"""
+    left = remaining()
+    return time.time() + (SHEETS_QUOTA_MAX_WAIT if left is None else min(SHEETS_QUOTA_MAX_WAIT, left))
+
+# 同じワークシートへの同時の読み取りは 1 回の API 呼び出しにまとめる
+_read_flights = SingleFlight()
+
+class CachedWorksheet:
+    """
+    gspread.Worksheet の薄いラッパー。
+    シート名変更・削除で呼び出しが失敗した場合はハンドルを取り直し、1回だけ再試行する。
+    """
+
+    def __init__(self, spreadsheet_id: str, sheet_name: str, worksheet):
+        self._spreadsheet_id = spreadsheet_id
+        self._sheet_name = sheet_name
+        self._worksheet = worksheet
+
+    def _refresh(self):
+        with _handle_lock:
+            _handle_stats["refreshes"] += 1
+        self._worksheet = _resolve_worksheet(self._spreadsheet_id, self._sheet_name)
+
+    def __getattr__(self, name):
+        attr = getattr(self._worksheet, name)
+        if not callable(attr):
+            return attr
+
+        def invoke(*args, **kwargs):
+            try:
+                return getattr(self._worksheet, name)(*args, **kwargs)
+            except Exception as e:
+                if not _is_stale_handle_error(e):
+                    raise
+                log_info("%s: ハンドルが無効になったため再取得します (%s)", self._sheet_name, e, context="シートキャッシュ")
+                try:
+                    self._refresh()
+                except Exception:
+                    # 削除された場合は次回 get_sheet で改めて解決させる
+                    invalidate_sheet_cache(self._sheet_name, self._spreadsheet_id)
+                    raise
+                return getattr(self._worksheet, name)(*args, **kwargs)
+
+        def throttled(*args, **kwargs):
+            # クォータのトークンを取ってから呼ぶ。429 は全ワーカーで待ってから再試行する
+            bucket = bucket_for(name)
+            deadline = _quota_deadline()
+            attempt = 0
+            while True:
+                if bucket.acquire(deadline) > 0:
+                    SHEETS_THROTTLED.inc(bucket=bucket.name, reason="quota")
+                try:
+                    return invoke(*args, **kwargs)
+                except gspread.exceptions.APIError as e:
+                    if e.code != 429:
+                        raise
+                    wait = backoff_seconds(attempt, e.response.headers.get("Retry-After"))
+                    SHEETS_THROTTLED.inc(bucket=bucket.name, reason="429")
+                    log_error("%s.%s: クォータ超過のため %.1f 秒待ちます", self._sheet_name, name, wait, context="シートクォータ")
+                    bucket.block(wait)
+                    if time.time() + wait > deadline:
+                        raise
+                    attempt += 1
+
+        def call(*args, **kwargs):
+            # 呼び出し 1 回（待ち・再取得・再試行を含む）ごとに処理時間と結果を記録する
+            started = time.perf_counter()
+            outcome = "ok"
+            try:
+                if bucket_for(name) is read_bucket:
+                    key = (self._spreadsheet_id, self._sheet_name, name, repr(args), repr(sorted(kwargs.items())))
+                    result, shared = _read_flights.do(key, lambda: throttled(*args, **kwargs), timeout=remaining())
+                    if shared:
+                        outcome = "coalesced"
+                else:
+                    result = throttled(*args, **kwargs)
+            except Exception as e:
+                outcome = f"error_{e.code}" if isinstance(e, gspread.exceptions.APIError) else "error"
+                raise
+            finally:
+                SHEETS_LATENCY.observe(time.perf_counter() - started, sheet=self._sheet_name, method=name)
+                SHEETS_CALLS.inc(sheet=self._sheet_name, method=name, outcome=outcome)
+            rows = payload_rows(name, args, result)
+            if rows and outcome != "coalesced":
+                SHEETS_ROWS.inc(rows, sheet=self._sheet_name, method=name)
+            return result
+
+        return call
+
+def get_sheet(sheet_name):
+    spreadsheet_id = os.getenv("SPREADSHEET_ID")
+    key = (spreadsheet_id, sheet_name)
+    with _handle_lock:
+        cached = _worksheet_cache.get(key)
+        if cached is not None:
+            _handle_stats["hits"] += 1
+            return cached
+        _handle_stats["misses"] += 1
+
     try:
-        spreadsheet = client.open_by_key(os.getenv("SPREADSHEET_ID"))
-        return spreadsheet.worksheet(sheet_name)
+        worksheet = _resolve_worksheet(spreadsheet_id, sheet_name)
     except Exception as e:
         log_exception(e, context=f"シート取得失敗: {sheet_name}")
         raise
 
-def append_row_if_new_user(name, birthday, chat_liff_id="", app_liff_id="", timestamp=None, sheet_name="ユーザー情報"):
-    sheet = get_sheet(sheet_name)
-    records = sheet.get_all_records()
-
-    for idx, row in enumerate(records, start=2):
-        if row.get("チャット LIFF ID") == chat_liff_id or (name and birthday and row.get("名前") == name and row.get("誕生日") == birthday):
-            updated = False
-            if not row.get("名前") and name:
-                col = list(row.keys()).index("名前") + 1
-                sheet.update_cell(idx, col, name)
-                updated = True
-            if not row.get("誕生日") and birthday:
-                col = list(row.keys()).index("誕生日") + 1
-                sheet.update_cell(idx, col, birthday)
-                updated = True
-            if not row.get("チャット LIFF ID") and chat_liff_id:
-                col = list(row.keys()).index("チャット LIFF ID") + 1
-                sheet.update_cell(idx, col, chat_liff_id)
-                updated = True
-            if not row.get("アプリ LIFF ID") and app_liff_id:
-                col = list(row.keys()).index("アプリ LIFF ID") + 1
-                sheet.update_cell(idx, col, app_liff_id)
-                updated = True
-            if not row.get("登録日時") and timestamp:
-                col = list(row.keys()).index("登録日時") + 1
-                sheet.update_cell(idx, col, timestamp)
-                updated = True
-            return not updated
-
-    headers = sheet.row_values(1)
-    new_row = {
-        "名前": name,
-        "誕生日": birthday,
-        "チャット LIFF ID": chat_liff_id,
-        "アプリ LIFF ID": app_liff_id,
-        "登録日時": timestamp or ""
-    }
-    sheet.append_row([new_row.get(h, "") for h in headers])
-    return True
-
-def update_app_liff_id_by_name_birthday(name, birthday, app_liff_id, sheet_name="ユーザー情報"):
-    sheet = get_sheet(sheet_name)
-    records = sheet.get_all_records()
+    handle = CachedWorksheet(spreadsheet_id, sheet_name, worksheet)
+    with _handle_lock:
+        # 並行して解決された場合は先に登録されたほうを使う
+        return _worksheet_cache.setdefault(key, handle)
 
-    for idx, row in enumerate(records, start=2):
-        if row.get("名前") == name and row.get("誕生日") == birthday:
-            col = list(row.keys()).index("アプリ LIFF ID") + 1
-            sheet.update_cell(idx, col, app_liff_id)
-            return True
-    return False
+def invalidate_sheet_cache(sheet_name: Optional[str] = None, spreadsheet_id: Optional[str] = None):
+    """ハンドルキャッシュを破棄する。sheet_name 省略時は全件。"""
+    spreadsheet_id = spreadsheet_id or os.getenv("SPREADSHEET_ID")
+    with _handle_lock:
+        if sheet_name is None:
+            _worksheet_cache.clear()
+            _spreadsheet_cache.clear()
+        else:
+            _worksheet_cache.pop((spreadsheet_id, sheet_name), None)
+
+def get_sheet_cache_stats() -> dict:
+    """ハンドルキャッシュのヒット／ミス／再取得回数を返す。"""
+    with _handle_lock:
+        stats = dict(_handle_stats)
+        stats["cached_worksheets"] = len(_worksheet_cache)
+    stats["coalesced_reads"] = _read_flights.stats["followers"]
+    return stats
 
-def update_liff_id_by_name_and_birthday4(nickname, birthday4, app_liff_id, sheet_name="ユーザー情報"):
+SHEET_PAGE_SIZE = int(os.getenv("SHEET_PAGE_SIZE", 1000))  # iter_sheet_rows で 1 回に読む行数
+
+def iter_sheet_rows(sheet_name: str, page_size: int = SHEET_PAGE_SIZE):
+    """
+    シートを page_size 行ずつの範囲読み取りで先頭から返す（1 行目のヘッダーも含む）。
+    全件をメモリに載せないので、大きなシートの書き出しに使う。
+    途中の空行は空のリストとして返し、シートの行番号とずれないようにする（末尾の空行は返さない）。
+    グリッドの行数（row_count）を超えて空のページが返ったところで終わりとみなす。
+    """
     sheet = get_sheet(sheet_name)
-    records = sheet.get_all_records()
-    for idx, row in enumerate(records, start=2):
-        if row.get("名前") == nickname:
-            full_birthday = str(row.get("誕生日", ""))
-            digits = ''.join(filter(str.isdigit, full_birthday))
-            if len(digits) >= 4 and digits[-4:] == str(birthday4):
-                col_index = list(row.keys()).index("アプリ LIFF ID") + 1
-                sheet.update_cell(idx, col_index, app_liff_id)
-                return True
-    return False
+    row_count = getattr(sheet, "row_count", 0) or 0  # ハンドルを取得した時点の値。後で増えていても空ページで止まる
+    start, blanks = 1, 0
+    while True:
+        end = start + page_size - 1
+        page = sheet.get(f"{start}:{end}")
+        if not page:
+            if end >= row_count:
+                return
+            blanks += page_size
+        else:
+            # API は範囲末尾の空行を省くので、前のページまでの空行は続きのデータがあるときだけ補う
+            for _ in range(blanks):
+                yield []
+            for row in page:
+                yield list(row)
+            blanks = page_size - len(page)
+        start = end + 1
+
+# 以下のユーザー情報の関数は既存の呼び出し元向け。保存先は STORAGE_BACKEND に従う（get_storage 経由）
+
+def append_row_if_new_user(name, birthday, chat_liff_id="", app_liff_id="", timestamp=None):
+    # 遅延インポートで循環インポートを回避
+    from utils.storage import get_storage
+    result = get_storage().upsert_user(
+        name, birthday, chat_liff_id=chat_liff_id, app_liff_id=app_liff_id, timestamp=timestamp
+    )
+    # 既存の呼び出し元向けに、既存行を補完した場合のみ False を返す
+    return result["created"] or not result["changed"]
+
+def update_liff_id_by_name_and_birthday4(nickname, birthday4, app_liff_id):
+    from utils.storage import get_storage
+    return get_storage().set_app_liff_id_by_name_birthday4(nickname, str(birthday4), app_liff_id)
 
-def get_chat_liff_id_by_app_liff_id(app_liff_id: str, user_sheet_name: str = "ユーザー情報") -> Optional[str]:
-    sheet = get_sheet(user_sheet_name)
-    records = sheet.get_all_records()
-    for row in records:
-        if row.get("アプリ LIFF ID") == app_liff_id:
-            return row.get("チャット LIFF ID")
-    return None
+def get_chat_liff_id_by_app_liff_id(app_liff_id: str) -> Optional[str]:
+    from utils.storage import get_storage
+    record = get_storage().find_user_by_app_liff_id(app_liff_id)
+    return record.get("チャット LIFF ID") if record else None
 
 def highlight_classroom_row(row_index: int, sheet_name: str = "教室登録シート"):
     sheet = get_sheet(sheet_name)
@@ -0,0 +1,168 @@
+# utils/sheets_quota.py
+import os
+import time
+import random
+import threading
+from typing import Callable, Dict, Hashable, Optional, Tuple
+from utils.deadline import DeadlineExceeded
+from utils.local_db import get_connection
+
+# Google Sheets API の分あたりクォータ（読み取り・書き込み別）を守るためのトークンバケット。
+# gunicorn の全ワーカーで同じバケットを使うようローカル SQLite に置く。
+# あわせて、同じワークシートへの同時の読み取りを 1 回の呼び出しにまとめる（single-flight）。
+
+SHEETS_READ_PER_MINUTE = float(os.getenv("SHEETS_READ_PER_MINUTE", 60))    # サービスアカウント 1 つあたりの既定値
+SHEETS_WRITE_PER_MINUTE = float(os.getenv("SHEETS_WRITE_PER_MINUTE", 60))
+SHEETS_QUOTA_BURST = float(os.getenv("SHEETS_QUOTA_BURST", 20))            # 溜めておける最大トークン数
+SHEETS_QUOTA_MAX_WAIT = float(os.getenv("SHEETS_QUOTA_MAX_WAIT", 10))      # 秒。トークン待ち・429 後の待ちの上限
+SHEETS_BACKOFF_BASE = float(os.getenv("SHEETS_BACKOFF_BASE", 1))          # 秒。429 のあとの最初の待ち
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS rate_buckets (
+    name TEXT PRIMARY KEY,
+    tokens REAL NOT NULL,
+    updated_at REAL NOT NULL,
+    blocked_until REAL NOT NULL DEFAULT 0
+);
+"""
+
+_schema_ready = False
+
+def _db():
+    global _schema_ready
+    conn = get_connection()
+    if not _schema_ready:
+        conn.executescript(_SCHEMA)
+        _schema_ready = True
+    return conn
+
+class QuotaWaitTimeout(Exception):
+    """クォータの空きを SHEETS_QUOTA_MAX_WAIT 秒待っても得られなかった。"""
+
+class TokenBucket:
+    """毎秒 per_minute / 60 個ずつ補充され、burst 個まで溜まるトークンバケット。"""
+
+    def __init__(self, name: str, per_minute: float, burst: float = SHEETS_QUOTA_BURST):
+        self.name = name
+        self.rate = per_minute / 60.0
+        self.burst = max(burst, 1.0)
+
+    def try_acquire(self) -> float:
+        """トークンを 1 つ取れたら 0、取れなければ次に取れるまでの秒数を返す。"""
+        now = time.time()
+        conn = _db()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute(
+                "SELECT tokens, updated_at, blocked_until FROM rate_buckets WHERE name = ?", (self.name,)
+            ).fetchone()
+            if row is None:
+                tokens, blocked_until = self.burst, 0.0
+            else:
+                tokens = min(self.burst, row["tokens"] + max(now - row["updated_at"], 0.0) * self.rate)
+                blocked_until = row["blocked_until"]
+            if now < blocked_until:
+                wait = blocked_until - now
+            elif tokens >= 1.0:
+                tokens -= 1.0
+                wait = 0.0
+            else:
+                wait = (1.0 - tokens) / self.rate
+            conn.execute(
+                "INSERT INTO rate_buckets (name, tokens, updated_at, blocked_until) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT(name) DO UPDATE SET tokens = excluded.tokens, updated_at = excluded.updated_at",
+                (self.name, tokens, now, blocked_until),
+            )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return wait
+
+    def acquire(self, deadline: float) -> float:
+        """トークンが取れるまで待ち、待った秒数を返す。deadline（time.time()）を過ぎそうなら QuotaWaitTimeout。"""
+        started = time.time()
+        while True:
+            wait = self.try_acquire()
+            if wait <= 0:
+                return time.time() - started
+            if time.time() + wait > deadline:
+                raise QuotaWaitTimeout(f"Sheets {self.name} quota: {wait:.1f}s 待ちが必要")
+            # 同時に待っているスレッドが一斉に起きないよう少しずらす
+            time.sleep(wait * (1 + random.random() * 0.2))
+
+    def block(self, seconds: float):
+        """429 を受けたとき、全ワーカーでしばらく送信を止めてトークンも空にする。"""
+        now = time.time()
+        _db().execute(
+            "INSERT INTO rate_buckets (name, tokens, updated_at, blocked_until) VALUES (?, 0, ?, ?) "
+            "ON CONFLICT(name) DO UPDATE SET tokens = 0, updated_at = excluded.updated_at, "
+            "blocked_until = MAX(blocked_until, excluded.blocked_until)",
+            (self.name, now, now + seconds),
+        )
+
+read_bucket = TokenBucket("sheets_read", SHEETS_READ_PER_MINUTE)
+write_bucket = TokenBucket("sheets_write", SHEETS_WRITE_PER_MINUTE)
+
+# 次の名前で始まるメソッドを読み取り、それ以外を書き込みとして数える
+_READ_PREFIXES = ("get", "row_values", "col_values", "acell", "cell", "find", "batch_get", "worksheet", "open")
+
+def bucket_for(method: str) -> TokenBucket:
+    return read_bucket if method.startswith(_READ_PREFIXES) else write_bucket
+
+def backoff_seconds(attempt: int, retry_after=None) -> float:
+    """429 のあとの待ち秒数。Retry-After があればそれに従う。"""
+    if retry_after:
+        try:
+            return max(float(retry_after), 0.0)
+        except ValueError:
+            pass
+    return SHEETS_BACKOFF_BASE * (2 ** attempt) * (1 + random.random())
+
+class _Flight:
+    __slots__ = ("done", "result", "error")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+class SingleFlight:
+    """同じキーの呼び出しが実行中なら、その結果を待って共有する（プロセス内）。"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._flights: Dict[Hashable, _Flight] = {}
+        self.stats = {"leaders": 0, "followers": 0}
+
+    def do(self, key: Hashable, fn: Callable, timeout: Optional[float] = None) -> Tuple[object, bool]:
+        """
+        (結果, 他の呼び出しの結果を共有したか) を返す。
+        結果は呼び出し元の間で共有されるので、書き換えないこと。
+        timeout 秒待っても実行中の呼び出しが終わらなければ DeadlineExceeded。
+        """
+        with self._lock:
+            flight = self._flights.get(key)
+            if flight is not None:
+                self.stats["followers"] += 1
+                leader = False
+            else:
+                flight = self._flights[key] = _Flight()
+                self.stats["leaders"] += 1
+                leader = True
+        if not leader:
+            if not flight.done.wait(None if timeout is None else max(timeout, 0)):
+                raise DeadlineExceeded("request deadline exceeded while waiting for a shared Sheets read")
+            if flight.error is not None:
+                raise flight.error
+            return flight.result, True
+        try:
+            flight.result = fn()
+            return flight.result, False
+        except Exception as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                self._flights.pop(key, None)
+            flight.done.set()
@@ -0,0 +1,55 @@
+# utils/sheets_transport.py
+import os
+from typing import Tuple
+import gspread
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from utils.deadline import DeadlineExceeded, remaining
+
+# Google Sheets API との HTTP 接続。
+# gspread の既定の HTTPClient は接続プールの大きさもタイムアウトも指定しないので、
+# keep-alive の接続をスレッド数に見合うだけ持ち、呼び出しごとにタイムアウトを付ける。
+# gspread の読み込みが重いので、このモジュールは utils/sheets.py の _init_gc からだけ import する。
+
+SHEETS_POOL_SIZE = int(os.getenv("SHEETS_POOL_SIZE", 10))               # 同時に張る keep-alive 接続数
+SHEETS_CONNECT_TIMEOUT = float(os.getenv("SHEETS_CONNECT_TIMEOUT", 5))  # 秒
+SHEETS_READ_TIMEOUT = float(os.getenv("SHEETS_READ_TIMEOUT", 30))       # 秒
+SHEETS_CONNECT_RETRIES = int(os.getenv("SHEETS_CONNECT_RETRIES", 2))    # 送信前の接続失敗だけ再試行する
+
+def call_timeout() -> Tuple[float, float]:
+    """(接続, 読み取り) タイムアウト。リクエストの締め切りが近ければ残り時間まで縮める。"""
+    left = remaining()
+    if left is None:
+        return SHEETS_CONNECT_TIMEOUT, SHEETS_READ_TIMEOUT
+    if left <= 0:
+        raise DeadlineExceeded("request deadline exceeded before Sheets call")
+    return min(SHEETS_CONNECT_TIMEOUT, left), min(SHEETS_READ_TIMEOUT, left)
+
+class PooledHTTPClient(gspread.HTTPClient):
+    """接続プールの大きさとタイムアウトを指定した gspread の HTTPClient。"""
+
+    def __init__(self, auth, session=None):
+        super().__init__(auth, session)
+        retry = Retry(total=SHEETS_CONNECT_RETRIES, connect=SHEETS_CONNECT_RETRIES, read=False, status=0,
+                      other=0, backoff_factor=0.2)
+        adapter = HTTPAdapter(pool_connections=2, pool_maxsize=SHEETS_POOL_SIZE, max_retries=retry)
+        self.session.mount("https://", adapter)
+
+    def request(self, method, endpoint, params=None, data=None, json=None, files=None, headers=None):
+        # 親クラスは self.timeout を全スレッドで共有するので、呼び出しごとのタイムアウトを渡すよう置き換える
+        response = self.session.request(
+            method=method,
+            url=endpoint,
+            json=json,
+            params=params,
+            data=data,
+            files=files,
+            headers=headers,
+            timeout=call_timeout(),
+        )
+        if response.ok:
+            return response
+        raise gspread.exceptions.APIError(response)
+
+def authorize(credentials) -> gspread.Client:
+    return gspread.authorize(credentials, http_client=PooledHTTPClient)
@@ -0,0 +1,110 @@
+# utils/startup.py
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import List
+
+# 起動処理の計測と事前読み込み。
+# Render の無料プランではスリープ明けの起動がそのまま利用者の待ち時間になるので、
+# 認証・スプレッドシートを開く・キャッシュを作る処理を最初のリクエストと並行してバックグラウンドで行う。
+
+PREWARM_ENABLED = os.getenv("PREWARM_ENABLED", "1") == "1"
+
+_started = time.perf_counter()  # app.py の最初で import される
+_lock = threading.Lock()
+_steps: List[dict] = []
+_marks = {}
+_prewarm_thread = None
+
+def _elapsed() -> float:
+    return time.perf_counter() - _started
+
+def mark(name: str):
+    """起動からの経過秒数を記録する（"app_imported" など）。"""
+    with _lock:
+        _marks.setdefault(name, round(_elapsed(), 4))
+
+@contextmanager
+def step(name: str):
+    """処理にかかった秒数を記録する。失敗しても記録して例外はそのまま投げる。"""
+    started = time.perf_counter()
+    entry = {"step": name, "start_s": round(_elapsed(), 4), "ok": False}
+    try:
+        yield
+        entry["ok"] = True
+    finally:
+        entry["seconds"] = round(time.perf_counter() - started, 4)
+        with _lock:
+            _steps.append(entry)
+
+def _prewarm():
+    # 遅延インポートで循環インポートを回避
+    from utils.lazy_import import preload
+    from utils.logging_util import log_exception, log_info
+    from utils.storage import STORAGE_BACKEND, get_storage, USER_SHEET_NAME, REGISTRATION_SHEET_NAME, CLASSROOM_SHEET_NAME
+    import utils.sheets as sheets
+    import utils.notify as notify
+
+    def run(name, fn):
+        try:
+            with step(name):
+                fn()
+            return True
+        except Exception as e:
+            log_exception(e, context=f"事前読み込み: {name}")
+            return False
+
+    run("import_libraries", lambda: (preload(sheets.gspread), preload(notify.requests)))
+    if STORAGE_BACKEND == "sheets":
+        if sheets.gc is None and not os.getenv("GOOGLE_CREDENTIALS"):
+            log_info("GOOGLE_CREDENTIALS がないため事前読み込みを省略します", context="起動")
+            return
+        if not run("authorize", sheets._init_gc):
+            return
+        run("open_worksheets", lambda: [
+            sheets.get_sheet(name) for name in (USER_SHEET_NAME, REGISTRATION_SHEET_NAME, CLASSROOM_SHEET_NAME)
+        ])
+        from utils.user_directory import get_user_directory
+        run("load_users", get_user_directory().reload)
+    run("storage", get_storage)
+
+    from utils.classroom_index import get_classroom_index
+    from utils.matching import get_matching_engine
+    run("classroom_index", get_classroom_index)
+    run("matching_engine", get_matching_engine)
+
+    mark("prewarm_done")
+    log_info("事前読み込みが完了しました", context="起動", payload=startup_report())
+
+def start_prewarm():
+    """事前読み込みのスレッドを起動する（プロセスごとに 1 回）。"""
+    global _prewarm_thread
+    if not PREWARM_ENABLED:
+        return
+    with _lock:
+        if _prewarm_thread is not None:
+            return
+        _prewarm_thread = threading.Thread(target=_prewarm, name="prewarm", daemon=True)
+    _prewarm_thread.start()
+
+def init_app(app):
+    """最初のリクエストに応答するまでの時間を記録する。"""
+    from flask import request
+
+    @app.after_request
+    def _startup_first_response(response):
+        if "first_response" not in _marks:
+            mark("first_response")
+            with _lock:
+                _marks.setdefault("first_response_path", request.path)
+        return response
+
+def startup_report() -> dict:
+    from utils.lazy_import import import_times
+    with _lock:
+        return {
+            "marks": dict(_marks),
+            "steps": [dict(s) for s in _steps],
+            "lazy_imports": {k: round(v, 4) for k, v in import_times().items()},
+        }
@@ -0,0 +1,118 @@
+# utils/storage.py
+import os
+import threading
+from abc import ABC, abstractmethod
+from typing import Iterator, List, Optional, Tuple
+
+# 保存先の切り替え: "sheets"（既定）または "sqlite"
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "sheets").lower()
+
+USER_SHEET_NAME = "ユーザー情報"
+REGISTRATION_SHEET_NAME = "アルバイト登録シート"
+CLASSROOM_SHEET_NAME = "教室登録シート"
+
+# ユーザー情報のフィールド名（シートのヘッダーと同じ）
+USER_FIELDS = ["名前", "誕生日", "チャット LIFF ID", "アプリ LIFF ID", "登録日時"]
+
+# シートにヘッダーがない場合（SQLite など）に使う列名。最後の列はどちらも LIFF ID
+REGISTRATION_HEADERS = ["ニックネーム", "誕生日4桁", "経験", "補助レベル", "希望エリア", "稼働可能日・時間", "連絡可能時間帯", "LIFF ID"]
+CLASSROOM_HEADERS = ["教室名", "場所", "開催日", "希望する経験", "補助レベル", "業務詳細・その他自由記述", "LIFF ID"]
+
+class StorageBackend(ABC):
+    """
+    永続化のインターフェース。
+    講師登録・教室はシートと同じ列順のリスト（最後の列が LIFF ID）でやり取りし、
+    ユーザーは USER_FIELDS をキーとする dict でやり取りする。
+    """
+
+    name = "base"
+
+    # ---- ユーザー ----
+
+    @abstractmethod
+    def find_user_by_app_liff_id(self, app_liff_id: str) -> Optional[dict]:
+        ...
+
+    @abstractmethod
+    def find_user_by_chat_liff_id(self, chat_liff_id: str) -> Optional[dict]:
+        ...
+
+    @abstractmethod
+    def set_app_liff_id_by_name_birthday4(self, name: str, birthday4: str, app_liff_id: str) -> bool:
+        """名前と誕生日下4桁が一致する最初のユーザーにアプリ LIFF ID を設定する。"""
+        ...
+
+    @abstractmethod
+    def upsert_user(self, name, birthday, chat_liff_id="", app_liff_id="", timestamp=None) -> dict:
+        """
+        チャット LIFF ID、または名前＋誕生日が一致するユーザーの空欄を補完し、なければ追加する。
+        戻り値は {"row": 識別子, "created": 追加したか, "changed": 書き込んだフィールド名}。
+        """
+        ...
+
+    def register_user(self, name, birthday, chat_liff_id="", app_liff_id="", timestamp=None):
+        """
+        フォーム・LINE からのユーザー登録。アプリ LIFF ID つきで名前＋誕生日下4桁が一致するユーザーがいれば
+        そのユーザーにアプリ LIFF ID を設定し、なければ upsert_user で補完・追加する。
+        反映を待たずに戻る実装もある（SheetsStorage は書き込みキュー経由）。
+        """
+        digits = "".join(filter(str.isdigit, str(birthday or "")))
+        if name and len(digits) >= 4 and app_liff_id:
+            if self.set_app_liff_id_by_name_birthday4(name, digits[-4:], app_liff_id):
+                return
+        self.upsert_user(name, birthday, chat_liff_id=chat_liff_id, app_liff_id=app_liff_id, timestamp=timestamp)
+
+    # ---- 講師登録 ----
+
+    @abstractmethod
+    def add_registration(self, row: list):
+        ...
+
+    @abstractmethod
+    def list_registrations(self) -> Tuple[List[str], List[list]]:
+        """(ヘッダー, データ行) を返す。"""
+        ...
+
+    @abstractmethod
+    def is_registered(self, user_id: str) -> bool:
+        ...
+
+    # ---- 教室 ----
+
+    @abstractmethod
+    def add_classroom(self, row: list):
+        ...
+
+    @abstractmethod
+    def list_classrooms(self) -> Tuple[List[str], List[list]]:
+        """(ヘッダー, データ行) を返す。データ行は登録順。"""
+        ...
+
+    # ---- 書き出し ----
+
+    @abstractmethod
+    def iter_rows(self, sheet_name: str) -> Iterator[list]:
+        """
+        USER_SHEET_NAME / REGISTRATION_SHEET_NAME / CLASSROOM_SHEET_NAME の内容をヘッダー行から 1 行ずつ返す。
+        全件をメモリに載せないので、大きな表の書き出しに使う。
+        """
+        ...
+
+_storage = None
+_storage_lock = threading.Lock()
+
+def get_storage() -> StorageBackend:
+    """設定 (STORAGE_BACKEND) に応じたプロセス共有のストレージを返す。"""
+    global _storage
+    with _storage_lock:
+        if _storage is None:
+            # 遅延インポートで使わないバックエンドの依存を読み込まない
+            if STORAGE_BACKEND == "sqlite":
+                from utils.storage_sqlite import SQLiteStorage
+                _storage = SQLiteStorage()
+            elif STORAGE_BACKEND == "sheets":
+                from utils.storage_sheets import SheetsStorage
+                _storage = SheetsStorage()
+            else:
+                raise RuntimeError(f"未知の STORAGE_BACKEND です: {STORAGE_BACKEND}")
+        return _storage
@@ -0,0 +1,114 @@
+# utils/storage_sheets.py
+import os
+import threading
+import time
+from typing import Iterator, List, Optional, Tuple
+from utils.sheets import get_sheet, iter_sheet_rows
+from utils.storage import StorageBackend, USER_SHEET_NAME, REGISTRATION_SHEET_NAME, CLASSROOM_SHEET_NAME
+from utils.user_directory import get_user_directory
+from utils.write_queue import enqueue_append, enqueue_user_registration
+from utils.data_version import bump_version
+
+# /alb/check 用の登録済み ID 集合を読み直す間隔（秒）
+REGISTRATION_ID_TTL = int(os.getenv("REGISTRATION_ID_TTL", 60))
+# このプロセスで追加した ID は、書き込みキューがシートへ反映するまでの間も集合に残す
+_RECENT_REGISTRATION_GRACE = 600
+
+class SheetsStorage(StorageBackend):
+    """Google スプレッドシートを保存先とする実装。追記は書き込みキュー経由。"""
+
+    name = "sheets"
+
+    def __init__(self):
+        self._registered_lock = threading.Lock()
+        self._registered_ids = set()
+        self._recent_registrations = {}  # user_id → 追加時刻
+        self._registered_loaded_at = 0.0
+
+    @staticmethod
+    def _public(record: Optional[dict]) -> Optional[dict]:
+        if record is None:
+            return None
+        return {k: v for k, v in record.items() if k != "_row"}
+
+    # ---- ユーザー ----
+
+    def find_user_by_app_liff_id(self, app_liff_id: str) -> Optional[dict]:
+        return self._public(get_user_directory(USER_SHEET_NAME).find_by_app_liff_id(app_liff_id))
+
+    def find_user_by_chat_liff_id(self, chat_liff_id: str) -> Optional[dict]:
+        return self._public(get_user_directory(USER_SHEET_NAME).find_by_chat_liff_id(chat_liff_id))
+
+    def set_app_liff_id_by_name_birthday4(self, name: str, birthday4: str, app_liff_id: str) -> bool:
+        directory = get_user_directory(USER_SHEET_NAME)
+        records = directory.find_by_name_birthday4(name, str(birthday4))
+        if not records:
+            return False
+        directory.update_fields(records[0]["_row"], {"アプリ LIFF ID": app_liff_id})
+        return True
+
+    def upsert_user(self, name, birthday, chat_liff_id="", app_liff_id="", timestamp=None) -> dict:
+        return get_user_directory(USER_SHEET_NAME).upsert(
+            name, birthday, chat_liff_id=chat_liff_id, app_liff_id=app_liff_id, timestamp=timestamp
+        )
+
+    def register_user(self, name, birthday, chat_liff_id="", app_liff_id="", timestamp=None):
+        # 書き込みキューに積むだけ。フラッシャーが UserDirectory.register_many でまとめて反映する
+        enqueue_user_registration(USER_SHEET_NAME, {
+            "name": name,
+            "birthday": birthday,
+            "chat_liff_id": chat_liff_id,
+            "app_liff_id": app_liff_id,
+            "timestamp": timestamp,
+        })
+
+    # ---- 講師登録 ----
+
+    def add_registration(self, row: list):
+        enqueue_append(REGISTRATION_SHEET_NAME, row, value_input_option="USER_ENTERED")
+        bump_version(REGISTRATION_SHEET_NAME)
+        # 書き込みキューの反映を待たずに登録済みとして扱う
+        if row and row[-1]:
+            with self._registered_lock:
+                self._registered_ids.add(row[-1])
+                self._recent_registrations[row[-1]] = time.monotonic()
+
+    def list_registrations(self) -> Tuple[List[str], List[list]]:
+        values = get_sheet(REGISTRATION_SHEET_NAME).get_all_values()
+        return (values[0] if values else []), values[1:]
+
+    def is_registered(self, user_id: str) -> bool:
+        if not user_id:
+            return False
+        if time.monotonic() - self._registered_loaded_at > REGISTRATION_ID_TTL:
+            self._reload_registered_ids()
+        with self._registered_lock:
+            return user_id in self._registered_ids
+
+    def _reload_registered_ids(self):
+        """ヘッダー行で LIFF ID 列（最後の列）の位置を調べ、その列だけを読み込む。"""
+        sheet = get_sheet(REGISTRATION_SHEET_NAME)
+        id_col = len(sheet.row_values(1))
+        ids = set(filter(None, sheet.col_values(id_col)[1:])) if id_col else set()
+        now = time.monotonic()
+        with self._registered_lock:
+            self._recent_registrations = {
+                u: t for u, t in self._recent_registrations.items() if now - t < _RECENT_REGISTRATION_GRACE
+            }
+            self._registered_ids = ids | set(self._recent_registrations)
+            self._registered_loaded_at = now
+
+    # ---- 教室 ----
+
+    def add_classroom(self, row: list):
+        enqueue_append(CLASSROOM_SHEET_NAME, row)
+        bump_version(CLASSROOM_SHEET_NAME)
+
+    def list_classrooms(self) -> Tuple[List[str], List[list]]:
+        values = get_sheet(CLASSROOM_SHEET_NAME).get_all_values()
+        return (values[0] if values else []), values[1:]
+
+    # ---- 書き出し ----
+
+    def iter_rows(self, sheet_name: str) -> Iterator[list]:
+        return iter_sheet_rows(sheet_name)
@@ -0,0 +1,290 @@
+# utils/storage_sqlite.py
+import os
+import json
+import time
+import threading
+from typing import Iterator, List, Optional, Tuple
+from utils.local_db import get_connection, LOCAL_DB_PATH
+from utils.storage import (
+    StorageBackend, REGISTRATION_HEADERS, CLASSROOM_HEADERS, USER_FIELDS,
+    USER_SHEET_NAME, REGISTRATION_SHEET_NAME, CLASSROOM_SHEET_NAME,
+)
+from utils.data_version import bump_version
+from utils.logging_util import log_exception, log_info
+
+STORAGE_SQLITE_PATH = os.getenv("STORAGE_SQLITE_PATH", LOCAL_DB_PATH)
+
+# "1" のとき、スタッフ閲覧用にスプレッドシートへ非同期でミラーする
+STORAGE_SHEETS_MIRROR = os.getenv("STORAGE_SHEETS_MIRROR", "0") == "1"
+MIRROR_INTERVAL = float(os.getenv("STORAGE_MIRROR_INTERVAL", 5))  # 秒
+_ITER_PAGE_SIZE = 1000  # iter_rows で 1 回に読む行数
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS users (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    name TEXT NOT NULL DEFAULT '',
+    birthday TEXT NOT NULL DEFAULT '',
+    birthday4 TEXT NOT NULL DEFAULT '',
+    chat_liff_id TEXT NOT NULL DEFAULT '',
+    app_liff_id TEXT NOT NULL DEFAULT '',
+    registered_at TEXT NOT NULL DEFAULT '',
+    mirrored INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS idx_users_app ON users (app_liff_id);
+CREATE INDEX IF NOT EXISTS idx_users_chat ON users (chat_liff_id);
+CREATE INDEX IF NOT EXISTS idx_users_name_bday4 ON users (name, birthday4);
+CREATE INDEX IF NOT EXISTS idx_users_mirrored ON users (mirrored);
+
+CREATE TABLE IF NOT EXISTS registrations (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_id TEXT NOT NULL,
+    row_json TEXT NOT NULL,
+    created_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_registrations_user ON registrations (user_id);
+
+CREATE TABLE IF NOT EXISTS classrooms (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_id TEXT NOT NULL,
+    row_json TEXT NOT NULL,
+    created_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_classrooms_user ON classrooms (user_id);
+"""
+
+# users テーブルの列名 ↔ ユーザー情報のフィールド名
+_USER_COLUMNS = {
+    "名前": "name",
+    "誕生日": "birthday",
+    "チャット LIFF ID": "chat_liff_id",
+    "アプリ LIFF ID": "app_liff_id",
+    "登録日時": "registered_at",
+}
+
+def _birthday4(birthday) -> str:
+    digits = "".join(filter(str.isdigit, str(birthday or "")))
+    return digits[-4:] if len(digits) >= 4 else ""
+
+class SQLiteStorage(StorageBackend):
+    """ローカル SQLite を保存先とする実装。検索はすべてインデックス経由。"""
+
+    name = "sqlite"
+
+    def __init__(self, path: str = STORAGE_SQLITE_PATH, mirror: bool = STORAGE_SHEETS_MIRROR):
+        self.path = path
+        self.mirror = mirror
+        self._write_lock = threading.Lock()
+        self._db().executescript(_SCHEMA)
+        if self.mirror:
+            threading.Thread(target=self._mirror_loop, name="sqlite-sheets-mirror", daemon=True).start()
+
+    def _db(self):
+        return get_connection(self.path)
+
+    @staticmethod
+    def _user(row) -> Optional[dict]:
+        if row is None:
+            return None
+        return {field: row[column] for field, column in _USER_COLUMNS.items()}
+
+    # ---- ユーザー ----
+
+    def find_user_by_app_liff_id(self, app_liff_id: str) -> Optional[dict]:
+        if not app_liff_id:
+            return None
+        row = self._db().execute(
+            "SELECT * FROM users WHERE app_liff_id = ? ORDER BY id LIMIT 1", (app_liff_id,)
+        ).fetchone()
+        return self._user(row)
+
+    def find_user_by_chat_liff_id(self, chat_liff_id: str) -> Optional[dict]:
+        if not chat_liff_id:
+            return None
+        row = self._db().execute(
+            "SELECT * FROM users WHERE chat_liff_id = ? ORDER BY id LIMIT 1", (chat_liff_id,)
+        ).fetchone()
+        return self._user(row)
+
+    def set_app_liff_id_by_name_birthday4(self, name: str, birthday4: str, app_liff_id: str) -> bool:
+        if not (name and birthday4):
+            return False
+        cur = self._db().execute(
+            "UPDATE users SET app_liff_id = ?, mirrored = 0 WHERE id = "
+            "(SELECT id FROM users WHERE name = ? AND birthday4 = ? ORDER BY id LIMIT 1)",
+            (app_liff_id, name, str(birthday4)),
+        )
+        return cur.rowcount > 0
+
+    def upsert_user(self, name, birthday, chat_liff_id="", app_liff_id="", timestamp=None) -> dict:
+        values = {
+            "名前": name or "",
+            "誕生日": birthday or "",
+            "チャット LIFF ID": chat_liff_id or "",
+            "アプリ LIFF ID": app_liff_id or "",
+            "登録日時": timestamp or "",
+        }
+        conn = self._db()
+        with self._write_lock:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = None
+                if values["チャット LIFF ID"]:
+                    row = conn.execute(
+                        "SELECT * FROM users WHERE chat_liff_id = ? ORDER BY id LIMIT 1", (values["チャット LIFF ID"],)
+                    ).fetchone()
+                if values["名前"] and values["誕生日"]:
+                    by_person = conn.execute(
+                        "SELECT * FROM users WHERE name = ? AND birthday4 = ? AND birthday = ? ORDER BY id LIMIT 1",
+                        (values["名前"], _birthday4(values["誕生日"]), values["誕生日"]),
+                    ).fetchone()
+                    if by_person is not None and (row is None or by_person["id"] < row["id"]):
+                        row = by_person
+
+                if row is None:
+                    cur = conn.execute(
+                        "INSERT INTO users (name, birthday, birthday4, chat_liff_id, app_liff_id, registered_at) "
+                        "VALUES (?, ?, ?, ?, ?, ?)",
+                        (values["名前"], values["誕生日"], _birthday4(values["誕生日"]),
+                         values["チャット LIFF ID"], values["アプリ LIFF ID"], values["登録日時"]),
+                    )
+                    conn.execute("COMMIT")
+                    return {"row": cur.lastrowid, "created": True, "changed": [f for f, v in values.items() if v]}
+
+                # 空欄のフィールドだけを補完する
+                current = self._user(row)
+                changed = {f: v for f, v in values.items() if v and not current.get(f)}
+                if changed:
+                    assignments = ", ".join(f"{_USER_COLUMNS[f]} = ?" for f in changed)
+                    params = list(changed.values())
+                    if "誕生日" in changed:
+                        assignments += ", birthday4 = ?"
+                        params.append(_birthday4(changed["誕生日"]))
+                    conn.execute(f"UPDATE users SET {assignments}, mirrored = 0 WHERE id = ?", params + [row["id"]])
+                conn.execute("COMMIT")
+                return {"row": row["id"], "created": False, "changed": list(changed)}
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+
+    # ---- 講師登録 ----
+
+    def add_registration(self, row: list):
+        self._db().execute(
+            "INSERT INTO registrations (user_id, row_json, created_at) VALUES (?, ?, ?)",
+            (row[-1] if row else "", json.dumps(row, ensure_ascii=False), time.time()),
+        )
+        bump_version(REGISTRATION_SHEET_NAME)
+        if self.mirror:
+            from utils.write_queue import enqueue_append
+            enqueue_append(REGISTRATION_SHEET_NAME, row, value_input_option="USER_ENTERED")
+
+    def list_registrations(self) -> Tuple[List[str], List[list]]:
+        rows = self._db().execute("SELECT row_json FROM registrations ORDER BY id").fetchall()
+        return list(REGISTRATION_HEADERS), [json.loads(r["row_json"]) for r in rows]
+
+    def is_registered(self, user_id: str) -> bool:
+        if not user_id:
+            return False
+        return self._db().execute(
+            "SELECT 1 FROM registrations WHERE user_id = ? LIMIT 1", (user_id,)
+        ).fetchone() is not None
+
+    # ---- 教室 ----
+
+    def add_classroom(self, row: list):
+        self._db().execute(
+            "INSERT INTO classrooms (user_id, row_json, created_at) VALUES (?, ?, ?)",
+            (row[-1] if row else "", json.dumps(row, ensure_ascii=False), time.time()),
+        )
+        bump_version(CLASSROOM_SHEET_NAME)
+        if self.mirror:
+            from utils.write_queue import enqueue_append
+            enqueue_append(CLASSROOM_SHEET_NAME, row)
+
+    def list_classrooms(self) -> Tuple[List[str], List[list]]:
+        rows = self._db().execute("SELECT row_json FROM classrooms ORDER BY id").fetchall()
+        return list(CLASSROOM_HEADERS), [json.loads(r["row_json"]) for r in rows]
+
+    # ---- 書き出し ----
+
+    def iter_rows(self, sheet_name: str) -> Iterator[list]:
+        # 読み取りのトランザクションを開いたままにしないよう、id の範囲でページごとに読む
+        if sheet_name == USER_SHEET_NAME:
+            table, headers = "users", list(USER_FIELDS)
+            to_row = lambda r: [r[column] for column in _USER_COLUMNS.values()]
+        elif sheet_name == REGISTRATION_SHEET_NAME:
+            table, headers = "registrations", list(REGISTRATION_HEADERS)
+            to_row = lambda r: json.loads(r["row_json"])
+        elif sheet_name == CLASSROOM_SHEET_NAME:
+            table, headers = "classrooms", list(CLASSROOM_HEADERS)
+            to_row = lambda r: json.loads(r["row_json"])
+        else:
+            raise ValueError(f"未知の表です: {sheet_name}")
+        yield headers
+        last_id = 0
+        while True:
+            rows = self._db().execute(
+                f"SELECT * FROM {table} WHERE id > ? ORDER BY id LIMIT ?", (last_id, _ITER_PAGE_SIZE)
+            ).fetchall()
+            if not rows:
+                return
+            for r in rows:
+                yield to_row(r)
+            last_id = rows[-1]["id"]
+
+    # ---- スプレッドシートへのミラー ----
+
+    def mirror_users_once(self, limit: int = 200) -> int:
+        """
+        未ミラーのユーザーをまとめてユーザー情報シートへ反映する。
+        SQLite を正とし、シートと値が食い違うフィールドは SQLite の値で上書きして記録を残す。
+        """
+        from utils.user_directory import get_user_directory
+        conn = self._db()
+        rows = conn.execute("SELECT * FROM users WHERE mirrored = 0 ORDER BY id LIMIT ?", (limit,)).fetchall()
+        if not rows:
+            return 0
+        directory = get_user_directory(USER_SHEET_NAME)
+        results = directory.upsert_many([{
+            "name": r["name"],
+            "birthday": r["birthday"],
+            "chat_liff_id": r["chat_liff_id"],
+            "app_liff_id": r["app_liff_id"],
+            "timestamp": r["registered_at"],
+        } for r in rows])
+
+        # upsert は空欄しか埋めないので、変更された値（アプリ LIFF ID の付け替えなど）はここで書き込む。
+        # 登録日時はシート側の表示形式が変わるだけなので比べない
+        updates, conflicts = {}, []
+        for r, result in zip(rows, results):
+            record = directory.get_row(result["row"])
+            if record is None:
+                continue
+            fields = {
+                f: v for f, v in self._user(r).items()
+                if f != "登録日時" and v and str(record.get(f, "")) != str(v)
+            }
+            if fields:
+                updates[result["row"]] = fields
+                conflicts.append({"id": r["id"], "row": result["row"], "fields": list(fields)})
+        if updates:
+            directory.update_many(updates)
+            log_info("シートと食い違う %d 件のユーザーを SQLite の値で上書きしました", len(updates),
+                     context="SQLite ストレージ", payload={"conflicts": conflicts})
+
+        # ミラー中に更新された行は mirrored = 0 のまま次回へ回す
+        with self._write_lock:
+            conn.executemany(
+                "UPDATE users SET mirrored = 1 WHERE id = ? AND name = ? AND birthday = ? AND chat_liff_id = ? AND app_liff_id = ?",
+                [(r["id"], r["name"], r["birthday"], r["chat_liff_id"], r["app_liff_id"]) for r in rows],
+            )
+        return len(rows)
+
+    def _mirror_loop(self):
+        log_info("ユーザー情報シートへのミラーを開始しました", context="SQLite ストレージ")
+        while True:
+            try:
+                self.mirror_users_once()
+            except Exception as e:
+                log_exception(e, context="ユーザー情報シートへのミラー")
+            time.sleep(MIRROR_INTERVAL)
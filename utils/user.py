@@ -1,8 +1,5 @@
 # utils/user.py
-from utils.sheets import (
-    append_row_if_new_user,
-    update_liff_id_by_name_and_birthday4
-)
+from utils.storage import get_storage
 from utils.logging_util import log_exception
 from datetime import datetime
 import re
@@ -19,12 +16,9 @@ def register_user_info(name: str, birthday: str, chat_liff_id: str = "", app_lif
         if len(digits) != 8:
             raise ValueError("誕生日は8桁の数値 (YYYYMMDD) である必要があります")
 
-        if name and digits and app_liff_id:
-            if update_liff_id_by_name_and_birthday4(name, digits[-4:], app_liff_id):
-                return
-
-        # それ以外は新規追加 or 情報補完
-        append_row_if_new_user(name, birthday, chat_liff_id=chat_liff_id, app_liff_id=app_liff_id, timestamp=timestamp)
+        # 既存ユーザーへのアプリ LIFF ID の紐付け、それ以外は新規追加 or 情報補完
+        # （Sheets では書き込みキューに積むだけなので、呼び出し元は Sheets を待たない）
+        get_storage().register_user(name, birthday, chat_liff_id=chat_liff_id, app_liff_id=app_liff_id, timestamp=timestamp)
 
     except Exception as e:
         log_exception(e, context="register_user_info 処理")
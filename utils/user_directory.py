@@ -0,0 +1,315 @@
+# utils/user_directory.py
+import os
+import re
+import threading
+import time
+from typing import Dict, List, Optional
+from utils.lazy_import import lazy_module
+from utils.sheets import get_sheet
+from utils.logging_util import log_info
+
+gspread_utils = lazy_module("gspread.utils")
+
+USER_SHEET_NAME = "ユーザー情報"
+USER_HEADERS = ["名前", "誕生日", "チャット LIFF ID", "アプリ LIFF ID", "登録日時"]
+
+# スタッフがシートを直接編集した場合に備えて、一定時間ごとに全件を読み直す
+USER_DIRECTORY_TTL = int(os.getenv("USER_DIRECTORY_TTL", 300))
+
+# append_row の応答 "'ユーザー情報'!A12:E12" から行番号を取り出す
+_UPDATED_RANGE_ROW = re.compile(r"![A-Z]+(\d+)")
+
+def _birthday4(birthday) -> str:
+    digits = "".join(filter(str.isdigit, str(birthday or "")))
+    return digits[-4:] if len(digits) >= 4 else ""
+
+class UserDirectory:
+    """
+    ユーザー情報シートのインメモリ索引。
+    アプリ LIFF ID / チャット LIFF ID / (名前, 誕生日下4桁) から行番号を O(1) で引き、
+    書き込みは既知のセルへ直接行う。このモジュール経由の書き込みは索引へ即時反映される。
+    """
+
+    def __init__(self, sheet_name: str = USER_SHEET_NAME, ttl: int = USER_DIRECTORY_TTL):
+        self.sheet_name = sheet_name
+        self.ttl = ttl
+        self._lock = threading.RLock()
+        self._headers: List[str] = []
+        self._rows: Dict[int, dict] = {}                # 行番号 → {ヘッダー: 値}
+        self._by_app: Dict[str, List[int]] = {}         # アプリ LIFF ID → 行番号
+        self._by_chat: Dict[str, List[int]] = {}        # チャット LIFF ID → 行番号
+        self._by_name_bday4: Dict[tuple, List[int]] = {}  # (名前, 誕生日下4桁) → 行番号
+        self._loaded_at = 0.0
+
+    # ---- 索引の構築 ----
+
+    def reload(self):
+        """シートを1回だけ読み込み、索引を作り直す。"""
+        values = get_sheet(self.sheet_name).get_all_values()
+        with self._lock:
+            self._headers = values[0] if values else list(USER_HEADERS)
+            self._rows = {}
+            self._by_app, self._by_chat, self._by_name_bday4 = {}, {}, {}
+            for row_number, row in enumerate(values[1:], start=2):
+                record = {h: (row[i] if i < len(row) else "") for i, h in enumerate(self._headers)}
+                self._rows[row_number] = record
+                self._index(row_number, record)
+            self._loaded_at = time.monotonic()
+        log_info("%d 件のユーザーを索引しました", len(self._rows), context="ユーザー索引")
+
+    def _ensure_loaded(self):
+        if not self._loaded_at or time.monotonic() - self._loaded_at > self.ttl:
+            self.reload()
+
+    @staticmethod
+    def _add(index: dict, key, row_number: int):
+        if not key:
+            return
+        rows = index.setdefault(key, [])
+        if row_number not in rows:
+            rows.append(row_number)
+            rows.sort()
+
+    @staticmethod
+    def _remove(index: dict, key, row_number: int):
+        rows = index.get(key)
+        if rows and row_number in rows:
+            rows.remove(row_number)
+            if not rows:
+                del index[key]
+
+    def _index_keys(self, record: dict):
+        name = record.get("名前", "")
+        bday4 = _birthday4(record.get("誕生日"))
+        return (
+            (self._by_app, record.get("アプリ LIFF ID", "")),
+            (self._by_chat, record.get("チャット LIFF ID", "")),
+            (self._by_name_bday4, (name, bday4) if name and bday4 else None),
+        )
+
+    def _index(self, row_number: int, record: dict):
+        for index, key in self._index_keys(record):
+            self._add(index, key, row_number)
+
+    def _unindex(self, row_number: int, record: dict):
+        for index, key in self._index_keys(record):
+            self._remove(index, key, row_number)
+
+    def _record(self, row_number: Optional[int]) -> Optional[dict]:
+        if row_number is None:
+            return None
+        record = dict(self._rows[row_number])
+        record["_row"] = row_number
+        return record
+
+    # ---- 検索 ----
+
+    def find_by_app_liff_id(self, app_liff_id: str) -> Optional[dict]:
+        if not app_liff_id:
+            return None
+        self._ensure_loaded()
+        with self._lock:
+            rows = self._by_app.get(app_liff_id)
+            return self._record(rows[0] if rows else None)
+
+    def find_by_chat_liff_id(self, chat_liff_id: str) -> Optional[dict]:
+        if not chat_liff_id:
+            return None
+        self._ensure_loaded()
+        with self._lock:
+            rows = self._by_chat.get(chat_liff_id)
+            return self._record(rows[0] if rows else None)
+
+    def find_by_name_birthday4(self, name: str, birthday4: str) -> List[dict]:
+        """名前と誕生日下4桁が一致するユーザーを行番号順に返す。"""
+        if not (name and birthday4):
+            return []
+        self._ensure_loaded()
+        with self._lock:
+            return [self._record(r) for r in self._by_name_bday4.get((name, str(birthday4)), [])]
+
+    def get_row(self, row_number: int) -> Optional[dict]:
+        """行番号のレコードを返す。索引にない行なら None。"""
+        with self._lock:
+            return self._record(row_number) if row_number in self._rows else None
+
+    def as_row(self, record: dict) -> list:
+        """レコードをシートの列順のリストに戻す。"""
+        with self._lock:
+            return [record.get(h, "") for h in self._headers]
+
+    # ---- 書き込み ----
+
+    def update_fields(self, row_number: int, fields: dict) -> List[str]:
+        """既知の行の指定フィールドを書き換え、実際に変わったフィールド名を返す。"""
+        return self.update_many({row_number: fields}).get(row_number, [])
+
+    def update_many(self, updates: Dict[int, dict]) -> Dict[int, List[str]]:
+        """
+        複数行・複数フィールドの更新を1回の batch_update にまとめて送る。
+        現在値と同じフィールドは送らず、変更がなければ API を呼ばない。
+        """
+        with self._lock:
+            changes = {}
+            for row_number, fields in updates.items():
+                record = self._rows[row_number]
+                changed = {f: v for f, v in fields.items() if str(record.get(f, "")) != str(v)}
+                if changed:
+                    changes[row_number] = changed
+            data = [
+                {"range": gspread_utils.rowcol_to_a1(row_number, self._headers.index(f) + 1), "values": [[v]]}
+                for row_number, changed in changes.items()
+                for f, v in changed.items()
+            ]
+        if not data:
+            return {}
+
+        # update_cell と同じく USER_ENTERED で書き込む
+        get_sheet(self.sheet_name).batch_update(data, value_input_option="USER_ENTERED")
+
+        with self._lock:
+            for row_number, changed in changes.items():
+                record = self._rows[row_number]
+                self._unindex(row_number, record)
+                record.update(changed)
+                self._index(row_number, record)
+        return {row_number: list(changed) for row_number, changed in changes.items()}
+
+    def append(self, record: dict) -> int:
+        """新しい行を追加し、その行番号を返す。"""
+        return self.append_many([record])[0]
+
+    def append_many(self, records: List[dict]) -> List[int]:
+        """複数行を1回の append_rows で追加し、それぞれの行番号を返す。"""
+        if not records:
+            return []
+        with self._lock:
+            headers = self._headers or list(USER_HEADERS)
+        stored = [{h: record.get(h, "") for h in headers} for record in records]
+        response = get_sheet(self.sheet_name).append_rows([[r[h] for h in headers] for r in stored])
+
+        updated_range = ((response or {}).get("updates") or {}).get("updatedRange", "")
+        m = _UPDATED_RANGE_ROW.search(updated_range)
+        if not m:
+            # 行番号が分からなければ読み直して整合性を保つ
+            self.reload()
+            return [0] * len(records)
+        first_row = int(m.group(1))
+        with self._lock:
+            for offset, record in enumerate(stored):
+                self._rows[first_row + offset] = record
+                self._index(first_row + offset, record)
+        return [first_row + offset for offset in range(len(stored))]
+
+    def upsert(self, name, birthday, chat_liff_id="", app_liff_id="", timestamp=None) -> dict:
+        """
+        チャット LIFF ID、または名前＋誕生日が一致する行があれば空欄を補完し、なければ追加する。
+        戻り値は {"row": 行番号, "created": 追加したか, "changed": 書き込んだフィールド名}。
+        """
+        return self.upsert_many([{
+            "name": name,
+            "birthday": birthday,
+            "chat_liff_id": chat_liff_id,
+            "app_liff_id": app_liff_id,
+            "timestamp": timestamp,
+        }])[0]
+
+    def upsert_many(self, entries: List[dict]) -> List[dict]:
+        """
+        複数ユーザーの upsert をまとめて行う。
+        既存行の補完は1回の batch_update、新規行は1回の append_rows で送る。
+        """
+        self._ensure_loaded()
+        if any(self._find_upsert_target(e.get("name"), e.get("birthday"), e.get("chat_liff_id")) is None for e in entries) \
+                and time.monotonic() - self._loaded_at > 1.0:
+            # 別ワーカーが追加した直後かもしれないので、追加前に一度だけ読み直す
+            self.reload()
+
+        updates: Dict[int, dict] = {}
+        new_records: List[dict] = []
+        plan = []  # entries と同じ順に ("row", 行番号) か ("new", new_records の添字)
+        with self._lock:
+            for e in entries:
+                values = {
+                    "名前": e.get("name") or "",
+                    "誕生日": e.get("birthday") or "",
+                    "チャット LIFF ID": e.get("chat_liff_id") or "",
+                    "アプリ LIFF ID": e.get("app_liff_id") or "",
+                    "登録日時": e.get("timestamp") or "",
+                }
+                row_number = self._find_upsert_target(values["名前"], values["誕生日"], values["チャット LIFF ID"])
+                if row_number is not None:
+                    # 空欄のフィールドだけを補完する（同じ行への複数エントリは先勝ち）
+                    record = {**self._rows[row_number], **updates.get(row_number, {})}
+                    fields = {f: v for f, v in values.items() if v and not record.get(f) and f in self._headers}
+                    updates.setdefault(row_number, {}).update(fields)
+                    plan.append(("row", row_number, list(fields)))
+                    continue
+
+                # 同じバッチ内で先に追加予定のユーザーと一致すればそちらへ統合する
+                for i, pending in enumerate(new_records):
+                    same_chat = values["チャット LIFF ID"] and pending["チャット LIFF ID"] == values["チャット LIFF ID"]
+                    same_person = values["名前"] and values["誕生日"] and \
+                        (pending["名前"], pending["誕生日"]) == (values["名前"], values["誕生日"])
+                    if same_chat or same_person:
+                        fields = {f: v for f, v in values.items() if v and not pending.get(f)}
+                        pending.update(fields)
+                        plan.append(("new", i, list(fields)))
+                        break
+                else:
+                    new_records.append(values)
+                    plan.append(("new", len(new_records) - 1, [f for f, v in values.items() if v]))
+
+        changed = self.update_many(updates)
+        new_rows = self.append_many(new_records)
+
+        results = []
+        for kind, ref, fields in plan:
+            if kind == "row":
+                written = set(changed.get(ref, []))
+                results.append({"row": ref, "created": False, "changed": [f for f in fields if f in written]})
+            else:
+                results.append({"row": new_rows[ref], "created": True, "changed": fields})
+        return results
+
+    def register_many(self, entries: List[dict]):
+        """
+        フォーム・LINE からのユーザー登録（entries は upsert_many と同じ形）をまとめて反映する。
+        アプリ LIFF ID つきで名前＋誕生日下4桁が一致するユーザーがいれば、そのユーザーのアプリ LIFF ID を書き換え、
+        それ以外は upsert_many で空欄の補完か追加を行う。書き込みキューのフラッシャーから呼ぶ。
+        """
+        self._ensure_loaded()
+        links: Dict[int, dict] = {}
+        rest = []
+        for e in entries:
+            name, app_liff_id = e.get("name"), e.get("app_liff_id")
+            bday4 = _birthday4(e.get("birthday"))
+            matches = self.find_by_name_birthday4(name, bday4) if app_liff_id else []
+            if matches:
+                # 同じ行への複数エントリは後勝ち（1 件ずつ反映した場合と同じ）
+                links[matches[0]["_row"]] = {"アプリ LIFF ID": app_liff_id}
+            else:
+                rest.append(e)
+        self.update_many(links)
+        if rest:
+            self.upsert_many(rest)
+
+    def _find_upsert_target(self, name, birthday, chat_liff_id) -> Optional[int]:
+        with self._lock:
+            matches = list(self._by_chat.get(chat_liff_id, [])) if chat_liff_id else []
+            if name and birthday:
+                for r in self._by_name_bday4.get((name, _birthday4(birthday)), []):
+                    if str(self._rows[r].get("誕生日")) == str(birthday):
+                        matches.append(r)
+            return min(matches) if matches else None
+
+_directories: Dict[str, UserDirectory] = {}
+_directories_lock = threading.Lock()
+
+def get_user_directory(sheet_name: str = USER_SHEET_NAME) -> UserDirectory:
+    """シート名ごとのプロセス共有ディレクトリを返す。"""
+    with _directories_lock:
+        directory = _directories.get(sheet_name)
+        if directory is None:
+            directory = _directories[sheet_name] = UserDirectory(sheet_name)
+        return directory
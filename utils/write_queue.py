@@ -0,0 +1,182 @@
+# utils/write_queue.py
+import os
+import json
+import time
+import threading
+from typing import List, Optional
+from utils import outbox
+from utils.lazy_import import lazy_module
+from utils.local_db import get_connection, ensure_column
+from utils.data_version import bump_version
+from utils.sheets import get_sheet
+from utils.user_directory import get_user_directory
+from utils.logging_util import log_exception, log_info, log_error
+
+gspread = lazy_module("gspread")
+
+# フォーム送信をローカルのジャーナルに書いてすぐ応答し、
+# バックグラウンドでまとめて Sheets へ反映する（Sheets が遅い／落ちていても送信を失わない）
+# 操作（op）ごとにまとめて送る:
+#   append        … 行の追記。シートごとに 1 回の append_rows
+#   register_user … ユーザー情報の登録・補完。シートごとに UserDirectory.register_many（batch_update + append_rows）
+WRITE_QUEUE_BATCH_SIZE = int(os.getenv("WRITE_QUEUE_BATCH_SIZE", 100))
+WRITE_QUEUE_INTERVAL = float(os.getenv("WRITE_QUEUE_INTERVAL", 2))       # 秒
+WRITE_QUEUE_MAX_ATTEMPTS = int(os.getenv("WRITE_QUEUE_MAX_ATTEMPTS", 10))
+WRITE_QUEUE_LEASE = 120  # 秒。取り出した行をこの間は他ワーカーが処理しない
+WRITE_QUEUE_DEAD_TTL = int(os.getenv("WRITE_QUEUE_DEAD_TTL", 14 * 24 * 3600))  # 秒。断念した行を残す期間
+WRITE_QUEUE_DEAD_MAX = int(os.getenv("WRITE_QUEUE_DEAD_MAX", 10000))           # 断念した行を残す最大件数
+_PRUNE_INTERVAL = 3600  # 秒。この間隔で断念した古い行を消す
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS sheet_write_queue (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    op TEXT NOT NULL DEFAULT 'append',
+    sheet_name TEXT NOT NULL,
+    row_json TEXT NOT NULL,
+    value_input_option TEXT NOT NULL DEFAULT 'RAW',
+    created_at REAL NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    next_attempt_at REAL NOT NULL DEFAULT 0,
+    lease_until REAL NOT NULL DEFAULT 0,
+    last_error TEXT,
+    dead INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS idx_sheet_write_queue_ready ON sheet_write_queue (dead, next_attempt_at, id);
+"""
+
+_schema_ready = False
+_wakeup = threading.Event()
+_flusher_lock = threading.Lock()
+_flusher_thread = None
+_last_prune = 0.0
+
+def _db():
+    global _schema_ready
+    conn = get_connection()
+    if not _schema_ready:
+        conn.executescript(_SCHEMA)
+        ensure_column(conn, "sheet_write_queue", "op", "TEXT NOT NULL DEFAULT 'append'")
+        _schema_ready = True
+    return conn
+
+def _enqueue(op: str, sheet_name: str, payload, value_input_option: str = "RAW") -> int:
+    cur = _db().execute(
+        "INSERT INTO sheet_write_queue (op, sheet_name, row_json, value_input_option, created_at) VALUES (?, ?, ?, ?, ?)",
+        (op, sheet_name, json.dumps(payload, ensure_ascii=False), value_input_option, time.time()),
+    )
+    _wakeup.set()
+    return cur.lastrowid
+
+def enqueue_append(sheet_name: str, row: list, value_input_option: str = "RAW") -> int:
+    """行をジャーナルへ追記してジャーナル ID を返す。Sheets への書き込みはフラッシャーが行う。"""
+    return _enqueue("append", sheet_name, row, value_input_option)
+
+def enqueue_user_registration(sheet_name: str, entry: dict) -> int:
+    """
+    ユーザー情報の登録（UserDirectory.register_many の 1 件分の dict）をジャーナルへ積んで ID を返す。
+    既存行の更新を伴うが、フラッシャーがまとめて反映するのでリクエストは Sheets を待たない。
+    """
+    return _enqueue("register_user", sheet_name, entry)
+
+def queue_depth() -> dict:
+    """未送信件数と、再試行を諦めた件数を返す。"""
+    return outbox.depth(_db(), "sheet_write_queue")
+
+def dead_rows(limit: int = 100) -> list:
+    """再試行を諦めた行を新しい順に返す（管理画面での確認用）。"""
+    return outbox.dead_rows(_db(), "sheet_write_queue", "id, op, sheet_name, row_json, attempts, created_at, last_error", limit)
+
+def requeue_dead(ids: Optional[List[int]] = None) -> int:
+    """諦めた行（ids を省略すると全件）を未送信に戻し、戻した件数を返す。"""
+    count = outbox.requeue_dead(_db(), "sheet_write_queue", ids)
+    if count:
+        _wakeup.set()
+    return count
+
+def purge_dead(ids: Optional[List[int]] = None) -> int:
+    """諦めた行（ids を省略すると全件）を消して、消した件数を返す。"""
+    return outbox.purge_dead(_db(), "sheet_write_queue", ids)
+
+def prune_dead() -> int:
+    """期限切れの諦めた行と、上限件数を超えた古い諦めた行を消して、消した件数を返す。"""
+    removed = outbox.prune_dead(_db(), "sheet_write_queue", WRITE_QUEUE_DEAD_TTL, WRITE_QUEUE_DEAD_MAX)
+    if removed:
+        log_info("断念した書き込みを %d 件削除しました", removed, context="書き込みキュー")
+    return removed
+
+def _claim_batch(limit: int) -> list:
+    """送信対象の行をリースして取り出す（複数ワーカーで同じ行を送らないため）。"""
+    return outbox.claim(
+        _db(), "sheet_write_queue", limit, WRITE_QUEUE_LEASE,
+        columns="id, op, sheet_name, row_json, value_input_option, attempts",
+    )
+
+def _mark_failed(rows: list, e: Exception):
+    conn = _db()
+    # シートが存在しない場合は再試行しても成功しない
+    permanent = isinstance(e, gspread.exceptions.WorksheetNotFound)
+    for r in rows:
+        if outbox.mark_failed(conn, "sheet_write_queue", r, e, WRITE_QUEUE_MAX_ATTEMPTS, permanent):
+            log_error("書き込みを断念しました (id=%s, sheet=%s): %s", r["id"], r["sheet_name"], e, context="書き込みキュー")
+
+def _apply(op: str, sheet_name: str, option: str, payloads: list):
+    if op == "append":
+        get_sheet(sheet_name).append_rows(payloads, value_input_option=option)
+    elif op == "register_user":
+        get_user_directory(sheet_name).register_many(payloads)
+    else:
+        raise ValueError(f"未知の書き込み操作です: {op}")
+
+def flush_once(limit: int = WRITE_QUEUE_BATCH_SIZE) -> int:
+    """
+    ジャーナルから取り出した行を、操作・シートごとに 1 回にまとめて送る。
+    送信できた行数を返す。
+    """
+    rows = _claim_batch(limit)
+    if not rows:
+        return 0
+
+    flushed = 0
+    conn = _db()
+    # 同じ操作・同じシート・同じ入力モードの行をまとめる（シート内の順序は保つ）
+    groups = {}
+    for r in rows:
+        groups.setdefault((r["op"], r["sheet_name"], r["value_input_option"]), []).append(r)
+
+    for (op, sheet_name, option), group in groups.items():
+        try:
+            _apply(op, sheet_name, option, [json.loads(r["row_json"]) for r in group])
+        except Exception as e:
+            log_exception(e, context=f"書き込みキュー送信失敗: {sheet_name}")
+            _mark_failed(group, e)
+            continue
+        conn.executemany("DELETE FROM sheet_write_queue WHERE id = ?", [(r["id"],) for r in group])
+        # シートの内容が変わったので、シートを元にしたキャッシュを無効にする
+        bump_version(sheet_name)
+        flushed += len(group)
+    return flushed
+
+def _flusher_loop():
+    global _last_prune
+    log_info("書き込みキューを起動しました: %s", queue_depth(), context="書き込みキュー")
+    while True:
+        _wakeup.clear()
+        try:
+            if time.monotonic() - _last_prune >= _PRUNE_INTERVAL:
+                _last_prune = time.monotonic()
+                prune_dead()
+            # 満杯のバッチが続く間は待たずに流し切る
+            while flush_once() >= WRITE_QUEUE_BATCH_SIZE:
+                pass
+        except Exception as e:
+            log_exception(e, context="書き込みキュー")
+        _wakeup.wait(WRITE_QUEUE_INTERVAL)
+
+def start_flusher():
+    """フラッシャースレッドを（プロセスにつき1本）起動する。起動時に未送信分も再送される。"""
+    global _flusher_thread
+    with _flusher_lock:
+        if _flusher_thread is not None and _flusher_thread.is_alive():
+            return
+        _flusher_thread = threading.Thread(target=_flusher_loop, name="sheet-write-queue", daemon=True)
+        _flusher_thread.start()